@@ -83,3 +83,57 @@ def shift(shape, stride, anchors):
     shifted_anchors = keras.backend.reshape(shifted_anchors, [k * number_of_anchors, 4])
 
     return shifted_anchors
+
+
+def bbox_transform(anchors, gt_boxes, mean=None, std=None):
+    """ Compute bounding-box regression targets of gt_boxes w.r.t. anchors, the inverse of bbox_transform_inv.
+
+    Args
+        anchors  : Tensor of shape (..., 4) for (x1, y1, x2, y2).
+        gt_boxes : Tensor of the same shape as anchors.
+        mean     : The mean value to normalize the targets with (defaults to [0, 0, 0, 0]).
+        std      : The standard deviation to normalize the targets with (defaults to [0.2, 0.2, 0.2, 0.2]).
+
+    Returns
+        A tensor of the same shape as anchors with the normalized targets (d_x1, d_y1, d_x2, d_y2), like utils.anchors.bbox_transform.
+    """
+    if mean is None:
+        mean = [0, 0, 0, 0]
+    if std is None:
+        std = [0.2, 0.2, 0.2, 0.2]
+
+    width  = anchors[..., 2] - anchors[..., 0]
+    height = anchors[..., 3] - anchors[..., 1]
+
+    targets = keras.backend.stack([
+        (gt_boxes[..., 0] - anchors[..., 0]) / width,
+        (gt_boxes[..., 1] - anchors[..., 1]) / height,
+        (gt_boxes[..., 2] - anchors[..., 2]) / width,
+        (gt_boxes[..., 3] - anchors[..., 3]) / height,
+    ], axis=-1)
+
+    mean = keras.backend.constant(mean, dtype=keras.backend.floatx())
+    std  = keras.backend.constant(std, dtype=keras.backend.floatx())
+    return (targets - mean) / std
+
+
+def overlap(boxes, query_boxes):
+    """ Compute the overlap (IoU) of every box with every query box, like utils.compute_overlap.
+
+    Args
+        boxes       : Tensor of shape (N, 4) for (x1, y1, x2, y2).
+        query_boxes : Tensor of shape (K, 4) for (x1, y1, x2, y2).
+
+    Returns
+        A tensor of shape (N, K) with the overlap between boxes and query_boxes.
+    """
+    boxes       = keras.backend.expand_dims(boxes, axis=1)
+    query_boxes = keras.backend.expand_dims(query_boxes, axis=0)
+
+    iw = keras.backend.minimum(boxes[..., 2], query_boxes[..., 2]) - keras.backend.maximum(boxes[..., 0], query_boxes[..., 0]) + 1
+    ih = keras.backend.minimum(boxes[..., 3], query_boxes[..., 3]) - keras.backend.maximum(boxes[..., 1], query_boxes[..., 1]) + 1
+    intersection = keras.backend.maximum(iw, 0) * keras.backend.maximum(ih, 0)
+
+    box_areas   = (boxes[..., 2] - boxes[..., 0] + 1) * (boxes[..., 3] - boxes[..., 1] + 1)
+    query_areas = (query_boxes[..., 2] - query_boxes[..., 0] + 1) * (query_boxes[..., 3] - query_boxes[..., 1] + 1)
+    return intersection / (box_areas + query_areas - intersection)
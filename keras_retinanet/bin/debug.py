@@ -28,6 +28,7 @@ if __name__ == "__main__" and __package__ is None:
     __package__ = "keras_retinanet.bin"
 
 # Change these to absolute imports if you copy this script outside the keras_retinanet package.
+from ..preprocessing.generator import _accepts_keyword
 from ..preprocessing.pascal_voc import PascalVocGenerator
 from ..preprocessing.csv_generator import CSVGenerator
 from ..preprocessing.kitti import KittiGenerator
@@ -179,7 +180,11 @@ def run(generator, args):
 
         anchors = anchors_for_shape(image.shape)
 
-        labels_batch, regression_batch, boxes_batch = generator.compute_anchor_targets(anchors, [image], [annotations], generator.num_classes())
+        # custom target functions without compute_annotations always return the annotations
+        if _accepts_keyword(generator.compute_anchor_targets, 'compute_annotations'):
+            labels_batch, regression_batch, boxes_batch = generator.compute_anchor_targets(anchors, [image], [annotations], generator.num_classes(), compute_annotations=True)
+        else:
+            labels_batch, regression_batch, boxes_batch = generator.compute_anchor_targets(anchors, [image], [annotations], generator.num_classes())
         anchor_states                               = labels_batch[0, :, -1]
 
         # draw anchors on the image
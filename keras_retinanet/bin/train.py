@@ -24,7 +24,6 @@ import warnings
 import keras
 import keras.preprocessing.image
 import tensorflow as tf
-from imgaug import augmenters as iaa
 
 # Allow relative imports when being executed as script.
 if __name__ == "__main__" and __package__ is None:
@@ -39,14 +38,18 @@ from .. import models
 from ..attrdict import AttrDict
 from ..callbacks import RedirectModel
 from ..callbacks.eval import Evaluate
-from ..models.retinanet import retinanet_bbox
+from ..models.retinanet import retinanet_bbox, retinanet_targets
 from ..preprocessing.csv_generator import CSVGenerator
 from ..preprocessing.kitti import KittiGenerator
 from ..preprocessing.open_images import OpenImagesGenerator
+from ..preprocessing.pack import PackGenerator
 from ..preprocessing.pascal_voc import PascalVocGenerator
 from ..utils.anchors import make_shapes_callback
+from ..utils.buffer_pool import BufferPool
+from ..utils.image_cache import ImageCache
 from ..utils.keras_version import check_keras_version
 from ..utils.model import freeze as freeze_model
+from ..utils.photometric import PhotometricAugmentation
 from ..utils.transform import random_transform_generator
 sys.path.append('/repos/kerastrainutils')
 from callbacks import CSVWallClockLogger
@@ -94,7 +97,10 @@ def create_models(backbone_retinanet, num_classes, weights, multi_gpu=0,
                   regr_feature_sizes    = [256]*4,
                   common_feature_sizes  = [],
                   coordconv             = False,
-                  submodels             = None):
+                  submodels             = None,
+                  compact_targets       = False,
+                  uint8_inputs          = False,
+                  in_graph_targets      = False):
     """ Creates three models (model, training_model, prediction_model).
 
     Args
@@ -103,6 +109,9 @@ def create_models(backbone_retinanet, num_classes, weights, multi_gpu=0,
         weights            : The weights to load into the model.
         multi_gpu          : The number of GPUs to use for training.
         freeze_backbone    : If True, disables learning for the backbone.
+        compact_targets    : If True, the classification loss expects compact (class index, anchor state) targets.
+        uint8_inputs       : If True, the models take uint8 images and normalize them in-graph.
+        in_graph_targets   : If True, the training model takes annotations and assigns anchor targets in-graph (see retinanet_targets).
 
     Returns
         model            : The base model. This is also the model that is saved in snapshots.
@@ -117,7 +126,7 @@ def create_models(backbone_retinanet, num_classes, weights, multi_gpu=0,
     if multi_gpu > 1:
         from keras.utils import multi_gpu_model
         with tf.device('/cpu:0'):
-            model = model_with_weights(backbone_retinanet(num_classes, modifier=modifier), 
+            model = model_with_weights(backbone_retinanet(num_classes, modifier=modifier, uint8_inputs=uint8_inputs), 
                                        weights=weights, skip_mismatch=skip_mismatch)
         training_model = multi_gpu_model(model, gpus=multi_gpu)
     else:
@@ -128,6 +137,7 @@ def create_models(backbone_retinanet, num_classes, weights, multi_gpu=0,
                                       regr_feature_sizes  = regr_feature_sizes,
                                       common_feature_sizes  = common_feature_sizes,
                                       coordconv = coordconv,
+                                      uint8_inputs = uint8_inputs,
                                       )
         model = model_with_weights(retinanet, weights=weights, skip_mismatch=skip_mismatch)
         training_model = model
@@ -140,11 +150,24 @@ def create_models(backbone_retinanet, num_classes, weights, multi_gpu=0,
                                       )
 
     # compile model
-    training_model.compile(
-        loss={
+    if in_graph_targets:
+        if multi_gpu > 1:
+            with tf.device('/cpu:0'):
+                training_model = retinanet_targets(model, num_classes, alpha=alpha, gamma=gamma, compact=compact_targets)
+            training_model = multi_gpu_model(training_model, gpus=multi_gpu)
+        else:
+            training_model = retinanet_targets(model, num_classes, alpha=alpha, gamma=gamma, compact=compact_targets)
+        loss = {
+            'regression_loss'     : losses.passthrough(),
+            'classification_loss' : losses.passthrough()
+        }
+    else:
+        loss = {
             'regression'    : losses.smooth_l1(),
-            'classification': losses.focal(alpha=alpha, gamma=gamma)
-        },
+            'classification': losses.focal(alpha=alpha, gamma=gamma, compact=compact_targets)
+        }
+    training_model.compile(
+        loss=loss,
         optimizer=keras.optimizers.adam(lr=lr, clipnorm=0.001)
     )
 
@@ -234,34 +257,30 @@ def create_callbacks(model, training_model, prediction_model, validation_generat
 
     return callbacks
 
-def create_homogenous_augm_wrapper(args):
-    seq = []
-    if args.freq_gaussian_noise > 0.0:
-        seq.append( iaa.Sometimes(args.freq_gaussian_noise, iaa.AdditiveGaussianNoise(scale=0.05*255, per_channel=0.25)) )
-    if args.freq_gaussian_blur > 0.0:
-        seq.append( iaa.Sometimes(args.freq_gaussian_blur, iaa.GaussianBlur(sigma=args.sigma_gaussian_blur)) )
-    if args.freq_hue_sat > 0.0:
-        # change hue and saturation
-        sometimes = lambda aug: iaa.Sometimes(args.freq_hue_sat, aug)
-        seq.append( sometimes(iaa.AddToHueAndSaturation((-args.hue_sat, args.hue_sat))) )
-
-    if args.freq_sharpen >0.0:
-        seq.append( iaa.Sometimes(args.freq_sharpen, iaa.Sharpen(alpha=args.sigma_sharpen)) )
-    if len(seq)>0:    
-        seq = iaa.Sequential(seq, random_order=True)
-        print("Augmenting with color/brightness/noise")
-        print(seq)
-    else:
-        seq = None
+def create_homogenous_transform(args):
+    """ Create the photometric augmentation applied to each training image.
+
+    Args
+        args: parseargs object containing the augmentation frequencies and strengths.
+
+    Returns
+        A PhotometricAugmentation, or None if no photometric augmentation is requested.
+    """
+    chances = [args.freq_gaussian_noise, args.freq_gaussian_blur, args.freq_hue_sat, args.freq_sharpen]
+    if not any(chance > 0.0 for chance in chances):
+        return None
+
+    print("Augmenting with color/brightness/noise")
+    return PhotometricAugmentation(
+        noise_chance   = args.freq_gaussian_noise,
+        blur_chance    = args.freq_gaussian_blur,
+        blur_sigma     = args.sigma_gaussian_blur,
+        hue_sat_chance = args.freq_hue_sat,
+        hue_sat        = args.hue_sat,
+        sharpen_chance = args.freq_sharpen,
+        sharpen_alpha  = args.sigma_sharpen,
+    )
 
-    def homogenous_augm_wrapper(gen):
-        print('gen has next:', hasattr(gen, '__next__'))
-        #import ipdb; ipdb.set_trace()
-        for img, ann in gen:
-            if seq is not None:
-                img = seq.augment_images(img)
-            yield img, ann
-    return homogenous_augm_wrapper
 
 def create_generators(args, preprocess_image):
     """ Create generators for training and validation.
@@ -275,6 +294,12 @@ def create_generators(args, preprocess_image):
         'image_min_side'   : args.image_min_side,
         'image_max_side'   : args.image_max_side,
         'preprocess_image' : preprocess_image,
+        'seed'             : args.seed,
+        'compact_targets'  : args.compact_targets,
+        'in_graph_targets' : args.in_graph_targets,
+        'fused_preprocessing' : args.fused_preprocessing,
+        'uint8_inputs'     : args.uint8_inputs,
+        'reduced_decoding' : args.reduced_decoding,
     }
 
         
@@ -299,6 +324,23 @@ def create_generators(args, preprocess_image):
     else:
         transform_generator = random_transform_generator(flip_x_chance=0.5)
 
+    # photometric augmentation is applied per image, inside the (possibly parallel) generator
+    homogenous_transform = create_homogenous_transform(args)
+
+    # optionally keep decoded training images in memory
+    train_args = dict(common_args)
+    if args.buffer_pool and (args.shared_memory or args.prefetch):
+        train_args['buffer_pool'] = BufferPool(max_bytes=args.buffer_pool * 2 ** 20)
+    if args.image_cache_size:
+        if args.multiprocessing and not (args.shared_memory or args.prefetch):
+            warnings.warn('--image-cache-size has no effect with --multiprocessing: keras starts new worker processes every epoch, each with an empty cache.')
+        train_args['image_cache'] = ImageCache(
+            max_bytes         = args.image_cache_size * 2 ** 20,
+            max_encoded_bytes = args.encoded_cache_size * 2 ** 20,
+            min_side          = args.image_min_side,
+            max_side          = args.image_max_side,
+        )
+
     if args.dataset_type == 'coco':
         # import here to prevent unnecessary dependency on cocoapi
         from ..preprocessing.coco import CocoGenerator
@@ -307,8 +349,9 @@ def create_generators(args, preprocess_image):
             args.coco_path,
             'train2017',
             transform_generator=transform_generator,
+            homogenous_transform=homogenous_transform,
             order=args.order,
-            **common_args
+            **train_args
         )
 
         validation_generator = CocoGenerator(
@@ -324,7 +367,8 @@ def create_generators(args, preprocess_image):
             args.pascal_path,
             'trainval',
             transform_generator=transform_generator,
-            **common_args
+            homogenous_transform=homogenous_transform,
+            **train_args
         )
 
         validation_generator = PascalVocGenerator(
@@ -337,7 +381,8 @@ def create_generators(args, preprocess_image):
             args.annotations,
             args.classes,
             transform_generator=transform_generator,
-            **common_args
+            homogenous_transform=homogenous_transform,
+            **train_args
         )
 
         if args.val_annotations:
@@ -357,7 +402,8 @@ def create_generators(args, preprocess_image):
             annotation_cache_dir=args.annotation_cache_dir,
             parent_label=args.parent_label,
             transform_generator=transform_generator,
-            **common_args
+            homogenous_transform=homogenous_transform,
+            **train_args
         )
 
         validation_generator = OpenImagesGenerator(
@@ -374,7 +420,8 @@ def create_generators(args, preprocess_image):
             args.kitti_path,
             subset='train',
             transform_generator=transform_generator,
-            **common_args
+            homogenous_transform=homogenous_transform,
+            **train_args
         )
 
         validation_generator = KittiGenerator(
@@ -382,6 +429,21 @@ def create_generators(args, preprocess_image):
             subset='val',
             **common_args
         )
+    elif args.dataset_type == 'pack':
+        train_generator = PackGenerator(
+            args.pack_path,
+            transform_generator=transform_generator,
+            homogenous_transform=homogenous_transform,
+            **train_args
+        )
+
+        if args.val_pack:
+            validation_generator = PackGenerator(
+                args.val_pack,
+                **common_args
+            )
+        else:
+            validation_generator = None
     else:
         raise ValueError('Invalid data type received: {}'.format(args.dataset_type))
 
@@ -450,6 +512,10 @@ def parse_args(args):
     csv_parser.add_argument('classes', help='Path to a CSV file containing class label mapping.')
     csv_parser.add_argument('--val-annotations', help='Path to CSV file containing annotations for validation (optional).')
 
+    pack_parser = subparsers.add_parser('pack')
+    pack_parser.add_argument('pack_path', help='Path to a pack written by retinanet-pack.')
+    pack_parser.add_argument('--val-pack', help='Path to a pack for validation (optional).')
+
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--snapshot',          help='Resume training from a snapshot.')
     group.add_argument('--imagenet-weights',  help='Initialize the model with pretrained imagenet weights. This is the default behaviour.', action='store_const', const=True, default=True)
@@ -489,13 +555,28 @@ def parse_args(args):
     parser.add_argument('--score-threshold',      help='', type=float, default=0.05)
     parser.add_argument('--nms-threshold',      help='', type=float, default=0.5)
     parser.add_argument('--max-detections',      help='', type=int, default=300)
+    parser.add_argument('--seed',             help='Seed for the data order and augmentation (defaults to a random seed).', type=int, default=None)
+    parser.add_argument('--workers',          help='Number of generator workers.', type=int, default=1)
+    parser.add_argument('--multiprocessing',  help='Use processes instead of threads for the generator workers.', action='store_true')
+    parser.add_argument('--max-queue-size',   help='Maximum number of batches queued by the generator workers.', type=int, default=10)
+    parser.add_argument('--image-cache-size', help='Size in MB of the in-memory cache of decoded training images (0 disables the cache). The cache lives per worker process, so it is lost every epoch with --multiprocessing.', type=int, default=0)
+    parser.add_argument('--encoded-cache-size', help='Size in MB of the second cache tier holding images re-encoded at the training resolution.', type=int, default=0)
+    parser.add_argument('--shared-memory',    help='Transfer batches from the worker processes through shared memory instead of pickling them (requires Python 3.8 or newer).', action='store_true')
+    parser.add_argument('--buffer-pool',      help='Size in MB of the pool of recycled batch arrays, used with --shared-memory or --prefetch (0 disables the pool).', type=int, default=0)
+    parser.add_argument('--compact-targets',  help='Transfer class indices instead of one-hot classification targets, expanded inside the loss.', action='store_true')
+    parser.add_argument('--in-graph-targets', help='Transfer the annotations instead of anchor targets and assign the targets in-graph. Every image needs an overlap matrix of anchors x annotations on the device, for example 240 MB for 120k anchors and 500 annotations.', action='store_true')
+    parser.add_argument('--fused-preprocessing', help='Augment and resize uint8 images with a single warp before normalizing them.', action='store_true')
+    parser.add_argument('--uint8-inputs',     help='Feed uint8 images to the model and normalize them in-graph.', action='store_true')
+    parser.add_argument('--reduced-decoding', help='Decode JPEG images at the lowest power of two reduction that still meets --image-min-side / --image-max-side.', action='store_true')
+    parser.add_argument('--prefetch',         help='Prefetch training batches with a threaded pipeline (read, augment, targets).', action='store_true')
+    parser.add_argument('--prefetch-workers', help='Number of threads for the read, augment and targets stages of the prefetch pipeline.', type=int, nargs=3, default=[4, 2, 1])
     parser.add_argument('--freq-gaussian-noise', help='frequency of random augmentation: noise', type=float, default=0.0)  
     parser.add_argument('--freq-gaussian-blur',  help='frequency of random augmentation: blur',  type=float, default=0.0) 
     parser.add_argument('--freq-hue-sat',        help='frequency of random augmentation: hue/saturation', type=float, default=0.0)
     parser.add_argument('--freq-sharpen',        help='frequency of random augmentation: sharpening', type=float, default=0.0) 
-    parser.add_argument('--hue-sat',             help='', type=float, default=30.0) 
-    parser.add_argument('--sigma-gaussian-blur', help='', type=float, default=[0.0, 2.0], nargs='+')
-    parser.add_argument('--sigma-sharpen',       help='', type=float, default=[0.0, 1.0], nargs='+')
+    parser.add_argument('--hue-sat',             help='maximum shift of hue and saturation, in [0, 255]', type=float, default=30.0) 
+    parser.add_argument('--sigma-gaussian-blur', help='range (min, max) or value of the blur sigma', type=float, default=[0.0, 2.0], nargs='+')
+    parser.add_argument('--sigma-sharpen',       help='range (min, max) or value of the sharpening alpha', type=float, default=[0.0, 1.0], nargs='+')
 
     return check_args(parser.parse_args(args))
 
@@ -538,8 +619,26 @@ def main(args=None):
     if args.snapshot is not None:
         print('Loading model, this may take a second...')
         model            = models.load_model(args.snapshot, backbone_name=args.backbone)
+        # the generators already produce uint8 or normalized images depending on --uint8-inputs
+        uint8_inputs = keras.backend.dtype(model.inputs[0]) == 'uint8'
+        if uint8_inputs != args.uint8_inputs:
+            raise ValueError('The snapshot {} takes {} inputs, resume it {} --uint8-inputs.'.format(
+                args.snapshot, 'uint8' if uint8_inputs else 'float', 'with' if uint8_inputs else 'without'))
         training_model   = model
         prediction_model = retinanet_bbox(model=model)
+        if args.in_graph_targets:
+            training_model = retinanet_targets(model, train_generator.num_classes(), alpha=args.loss_alpha, gamma=args.loss_gamma, compact=args.compact_targets)
+            loss = {'regression_loss': losses.passthrough(), 'classification_loss': losses.passthrough()}
+        else:
+            # the saved compile config holds the dense focal loss (or no loss at all), so compile with the loss matching the targets
+            loss = {
+                'regression'    : losses.smooth_l1(),
+                'classification': losses.focal(alpha=args.loss_alpha, gamma=args.loss_gamma, compact=args.compact_targets)
+            }
+        training_model.compile(
+            loss=loss,
+            optimizer=keras.optimizers.adam(lr=args.lr, clipnorm=0.001)
+        )
     else:
         weights = args.weights
         # default to imagenet if nothing else is specified
@@ -564,6 +663,9 @@ def main(args=None):
             regr_feature_sizes    = args.regr_feature_sizes,
             common_feature_sizes  = args.common_feature_sizes,
             coordconv             = args.coordconv,
+            compact_targets       = args.compact_targets,
+            uint8_inputs          = args.uint8_inputs,
+            in_graph_targets      = args.in_graph_targets,
         )
 
     # print model summary
@@ -586,17 +688,41 @@ def main(args=None):
         lr_drop_factor=args.lr_drop_factor,
     )
 
+    # optionally let worker processes write batches into shared memory or prefetch with a threaded pipeline, consumed on the main thread
+    workers = args.workers
+    if args.shared_memory:
+        from ..preprocessing.shared_memory import SharedMemoryLoader
+        train_generator = SharedMemoryLoader(train_generator, workers=args.workers, num_slots=args.max_queue_size)
+        workers         = 0
+    elif args.prefetch:
+        from ..preprocessing.prefetch import Prefetcher
+        read_workers, augment_workers, target_workers = args.prefetch_workers
+        train_generator = Prefetcher(
+            train_generator,
+            read_workers    = read_workers,
+            augment_workers = augment_workers,
+            target_workers  = target_workers,
+            queue_size      = args.max_queue_size,
+        )
+        workers         = 0
+
     # start training
-    homogenous_augm_wrapper = create_homogenous_augm_wrapper(args)
-    training_model.fit_generator(
-        generator=homogenous_augm_wrapper(train_generator),
-        steps_per_epoch=args.steps,
-        validation_data=validation_generator,
-        validation_steps=len(validation_generator),
-        epochs=args.epochs,
-        verbose=1,
-        callbacks=callbacks,
-    )
+    try:
+        training_model.fit_generator(
+            generator=train_generator,
+            steps_per_epoch=args.steps,
+            validation_data=validation_generator,
+            validation_steps=len(validation_generator) if validation_generator else None,
+            epochs=args.epochs,
+            verbose=1,
+            callbacks=callbacks,
+            workers=workers,
+            use_multiprocessing=args.multiprocessing,
+            max_queue_size=args.max_queue_size,
+        )
+    finally:
+        if args.shared_memory or args.prefetch:
+            train_generator.close()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,3 @@
-from ._misc import RegressBoxes, UpsampleLike, Anchors, ClipBoxes  # noqa: F401
+from ._misc import RegressBoxes, UpsampleLike, Anchors, ClipBoxes, Normalize, AnchorTargets, TargetLoss  # noqa: F401
 from .filter_detections import FilterDetections  # noqa: F401
 from . import coord
@@ -93,6 +93,42 @@ class Anchors(keras.layers.Layer):
         return config
 
 
+class Normalize(keras.layers.Layer):
+    """ Keras layer to cast uint8 images to floatx and normalize them in-graph (see utils.image.preprocess_image).
+    """
+
+    def __init__(self, mode='caffe', *args, **kwargs):
+        """ Initializer for the Normalize layer.
+
+        Args
+            mode: One of "caffe" or "tf", see utils.image.preprocess_image.
+        """
+        self.mode = mode
+        super(Normalize, self).__init__(*args, **kwargs)
+
+    def call(self, inputs, **kwargs):
+        x = keras.backend.cast(inputs, keras.backend.floatx())
+        if self.mode == 'tf':
+            return x / 127.5 - 1.
+        elif self.mode == 'caffe':
+            mean = np.array([103.939, 116.779, 123.68], dtype=keras.backend.floatx())
+            if keras.backend.image_data_format() == 'channels_first':
+                mean = mean.reshape((3, 1, 1))
+            return x - keras.backend.constant(mean)
+        return x
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = super(Normalize, self).get_config()
+        config.update({
+            'mode': self.mode,
+        })
+
+        return config
+
+
 class UpsampleLike(keras.layers.Layer):
     """ Keras layer for upsampling a Tensor to be the same shape as another Tensor.
     """
@@ -184,3 +220,166 @@ class ClipBoxes(keras.layers.Layer):
 
     def compute_output_shape(self, input_shape):
         return input_shape[1]
+
+
+class AnchorTargets(keras.layers.Layer):
+    """ Keras layer for assigning annotations to anchors in-graph, like utils.anchors.anchor_targets_bbox.
+
+    Every image computes the dense (N, M) overlaps of its N anchors with its M (padded) annotations, so the peak memory
+    grows with parallel_iterations * N * M. Images are therefore processed one at a time by default.
+    """
+
+    def __init__(
+        self,
+        num_classes,
+        negative_overlap    = 0.4,
+        positive_overlap    = 0.5,
+        compact             = False,
+        mean                = None,
+        std                 = None,
+        parallel_iterations = 1,
+        *args,
+        **kwargs
+    ):
+        """ Initializer for the AnchorTargets layer.
+
+        Args
+            num_classes         : Number of classes to predict.
+            negative_overlap    : IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
+            positive_overlap    : IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+            compact             : If True, output (class index, anchor state) labels instead of one-hot labels (see losses.focal).
+            mean                : The mean value to normalize the regression targets with.
+            std                 : The standard deviation to normalize the regression targets with.
+            parallel_iterations : Number of images to process in parallel, every one holds an (N, M) overlap matrix.
+        """
+        if mean is None:
+            mean = np.array([0, 0, 0, 0])
+        if std is None:
+            std = np.array([0.2, 0.2, 0.2, 0.2])
+
+        self.num_classes         = num_classes
+        self.negative_overlap    = negative_overlap
+        self.positive_overlap    = positive_overlap
+        self.compact             = compact
+        self.mean                = np.array(mean)
+        self.std                 = np.array(std)
+        self.parallel_iterations = parallel_iterations
+        super(AnchorTargets, self).__init__(*args, **kwargs)
+
+    def image_targets(self, anchors, annotations, image_shape):
+        """ Compute the targets of the anchors of a single image.
+
+        Args
+            anchors     : Tensor of shape (N, 4) with the anchors of the image.
+            annotations : Tensor of shape (M, 5) with the annotations (x1, y1, x2, y2, label), padding has label -1.
+            image_shape : Tensor of shape (2,) with the (rows, cols) of the image, anchors with their center outside are ignored.
+
+        Returns
+            regression, labels: see call.
+        """
+        floatx = keras.backend.floatx()
+
+        # overlaps with padding are -1, so anchors of images without annotations are negative
+        valid    = keras.backend.cast(keras.backend.greater_equal(annotations[:, 4], 0), floatx)
+        overlaps = backend.overlap(anchors, annotations[:, :4]) * valid - (1 - valid)
+
+        argmax_overlaps = keras.backend.argmax(overlaps, axis=1)
+        max_overlaps    = keras.backend.max(overlaps, axis=1)
+
+        positive = keras.backend.cast(keras.backend.greater_equal(max_overlaps, self.positive_overlap), floatx)
+        ignore   = keras.backend.cast(keras.backend.greater(max_overlaps, self.negative_overlap), floatx) * (1 - positive)
+
+        # ignore anchors with their center outside of the image
+        centers_x = (anchors[:, 0] + anchors[:, 2]) / 2
+        centers_y = (anchors[:, 1] + anchors[:, 3]) / 2
+        outside   = keras.backend.greater(
+            keras.backend.cast(keras.backend.greater_equal(centers_x, image_shape[1]), floatx) +
+            keras.backend.cast(keras.backend.greater_equal(centers_y, image_shape[0]), floatx),
+            0
+        )
+        states = backend.where(outside, -keras.backend.ones_like(positive), positive - ignore)
+
+        assigned   = keras.backend.gather(annotations, argmax_overlaps)
+        regression = backend.bbox_transform(anchors, assigned[:, :4], mean=self.mean, std=self.std)
+        regression = keras.backend.concatenate([regression, keras.backend.expand_dims(states, axis=1)], axis=1)
+
+        if self.compact:
+            labels = keras.backend.stack([assigned[:, 4] * positive, states], axis=1)
+        else:
+            labels = keras.backend.one_hot(keras.backend.cast(assigned[:, 4], 'int32'), self.num_classes)
+            labels = labels * keras.backend.expand_dims(positive, axis=1)
+            labels = keras.backend.concatenate([labels, keras.backend.expand_dims(states, axis=1)], axis=1)
+
+        return [regression, labels]
+
+    def call(self, inputs, **kwargs):
+        """ Compute the targets of a batch.
+
+        Args
+            inputs : List of [anchors, annotations, image_shapes] tensors of shape (B, N, 4), (B, M, 5) and (B, 2).
+                     Annotations are padded with label -1, M has to be at least 1.
+
+        Returns
+            regression, labels: tensors of shape (B, N, 4 + 1) and (B, N, num_classes + 1), or (B, N, 2) if compact,
+                                the same targets anchor_targets_bbox generates (regression targets only matter for positive anchors).
+        """
+        anchors, annotations, image_shapes = inputs
+
+        def _image_targets(args):
+            return self.image_targets(*args)
+
+        return backend.map_fn(
+            _image_targets,
+            elems=[anchors, annotations, image_shapes],
+            dtype=[keras.backend.floatx(), keras.backend.floatx()],
+            parallel_iterations=self.parallel_iterations
+        )
+
+    def compute_output_shape(self, input_shape):
+        anchors_shape = input_shape[0]
+        labels        = 2 if self.compact else self.num_classes + 1
+        return [anchors_shape[:2] + (4 + 1,), anchors_shape[:2] + (labels,)]
+
+    def compute_mask(self, inputs, mask=None):
+        """ This is required in Keras when there is more than 1 output.
+        """
+        return 2 * [None]
+
+    def get_config(self):
+        config = super(AnchorTargets, self).get_config()
+        config.update({
+            'num_classes'         : self.num_classes,
+            'negative_overlap'    : self.negative_overlap,
+            'positive_overlap'    : self.positive_overlap,
+            'compact'             : self.compact,
+            'mean'                : self.mean.tolist(),
+            'std'                 : self.std.tolist(),
+            'parallel_iterations' : self.parallel_iterations,
+        })
+
+        return config
+
+
+class TargetLoss(keras.layers.Layer):
+    """ Keras layer computing a loss (see keras_retinanet.losses) of predictions w.r.t. targets computed in-graph.
+
+    The loss is output once per image, a model is trained on it with losses.passthrough.
+    The layer holds a loss function, so it can't be serialized, save the model it is built on instead.
+    """
+
+    def __init__(self, loss, *args, **kwargs):
+        """ Initializer for the TargetLoss layer.
+
+        Args
+            loss: Loss function of (y_true, y_pred), like losses.focal() or losses.smooth_l1().
+        """
+        self.loss = loss
+        super(TargetLoss, self).__init__(*args, **kwargs)
+
+    def call(self, inputs, **kwargs):
+        targets, predictions = inputs
+        loss = self.loss(targets, predictions)
+        return keras.backend.ones_like(predictions[:, :1, 0]) * loss
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[1][0], 1)
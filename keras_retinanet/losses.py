@@ -18,12 +18,13 @@ import keras
 from . import backend
 
 
-def focal(alpha=0.25, gamma=2.0):
+def focal(alpha=0.25, gamma=2.0, compact=False):
     """ Create a functor for computing the focal loss.
 
     Args
         alpha: Scale the focal weight with alpha.
         gamma: Take the power of the focal weight with gamma.
+        compact: If True, y_true holds (class index, anchor state) per anchor instead of one-hot labels and the anchor state.
 
     Returns
         A functor that computes the focal loss using the alpha and gamma.
@@ -34,21 +35,29 @@ def focal(alpha=0.25, gamma=2.0):
         As defined in https://arxiv.org/abs/1708.02002
 
         Args
-            y_true: Tensor of target data from the generator with shape (B, N, num_classes).
+            y_true: Tensor of target data from the generator with shape (B, N, num_classes + 1), or (B, N, 2) if compact.
             y_pred: Tensor of predicted data from the network with shape (B, N, num_classes).
 
         Returns
             The focal loss of y_pred w.r.t. y_true.
         """
-        labels         = y_true[:, :, :-1]
         anchor_state   = y_true[:, :, -1]  # -1 for ignore, 0 for background, 1 for object
         classification = y_pred
 
         # filter out "ignore" anchors
         indices        = backend.where(keras.backend.not_equal(anchor_state, -1))
-        labels         = backend.gather_nd(labels, indices)
         classification = backend.gather_nd(classification, indices)
 
+        if compact:
+            # expand the class index of positive anchors to one-hot labels, other anchors have all zero labels
+            num_classes = keras.backend.int_shape(y_pred)[-1] or keras.backend.shape(y_pred)[-1]
+            labels      = backend.gather_nd(y_true, indices)
+            positive    = keras.backend.cast(keras.backend.equal(labels[:, 1], 1), keras.backend.floatx())
+            labels      = keras.backend.one_hot(keras.backend.cast(labels[:, 0], 'int32'), num_classes)
+            labels      = labels * keras.backend.expand_dims(positive, axis=-1)
+        else:
+            labels = backend.gather_nd(y_true[:, :, :-1], indices)
+
         # compute the focal loss
         alpha_factor = keras.backend.ones_like(labels) * alpha
         alpha_factor = backend.where(keras.backend.equal(labels, 1), alpha_factor, 1 - alpha_factor)
@@ -115,3 +124,15 @@ def smooth_l1(sigma=3.0):
         return keras.backend.sum(regression_loss) / normalizer
 
     return _smooth_l1
+
+
+def passthrough():
+    """ Create a functor for training on a loss the model computes itself (see layers.TargetLoss).
+
+    Returns
+        A functor that returns the mean of y_pred, the (dummy) y_true is ignored.
+    """
+    def _passthrough(y_true, y_pred):
+        return keras.backend.mean(y_pred)
+
+    return _passthrough
@@ -13,6 +13,7 @@ class Backbone(object):
             'FilterDetections' : layers.FilterDetections,
             'Anchors'          : layers.Anchors,
             'ClipBoxes'        : layers.ClipBoxes,
+            'Normalize'        : layers.Normalize,
             '_smooth_l1'       : losses.smooth_l1(),
             '_focal'           : losses.focal(),
         }
@@ -22,9 +23,18 @@ class Backbone(object):
 
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
+
+        Passing uint8_inputs=True creates a model that takes uint8 images and normalizes them in-graph.
         """
         raise NotImplementedError('retinanet method not implemented.')
 
+    def normalize_kwargs(self, kwargs, mode):
+        """ Translate the uint8_inputs argument of retinanet to the normalize argument of the model constructors.
+        """
+        if kwargs.pop('uint8_inputs', False):
+            kwargs['normalize'] = mode
+        return kwargs
+
     def download_imagenet(self):
         """ Downloads ImageNet weights and returns path to weights file.
         """
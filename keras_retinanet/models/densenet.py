@@ -20,6 +20,7 @@ from keras.utils import get_file
 
 from . import retinanet
 from . import Backbone
+from .. import layers
 from ..utils.image import preprocess_image
 
 allowed_backbones = {'densenet121': [6, 12, 24, 16], 'densenet169': [6, 12, 32, 32], 'densenet201': [6, 12, 48, 32]}
@@ -32,7 +33,7 @@ class DenseNetBackbone(Backbone):
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
         """
-        return densenet_retinanet(*args, backbone=self.backbone, **kwargs)
+        return densenet_retinanet(*args, backbone=self.backbone, **self.normalize_kwargs(kwargs, 'tf'))
 
     def download_imagenet(self):
         """ Download pre-trained weights for the specified backbone name.
@@ -65,7 +66,7 @@ class DenseNetBackbone(Backbone):
         return preprocess_image(inputs, mode='tf')
 
 
-def densenet_retinanet(num_classes, backbone='densenet121', inputs=None, modifier=None, **kwargs):
+def densenet_retinanet(num_classes, backbone='densenet121', inputs=None, modifier=None, normalize=None, **kwargs):
     """ Constructs a retinanet model using a densenet backbone.
 
     Args
@@ -73,16 +74,18 @@ def densenet_retinanet(num_classes, backbone='densenet121', inputs=None, modifie
         backbone: Which backbone to use (one of ('densenet121', 'densenet169', 'densenet201')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize: If set, the model takes uint8 images and normalizes them in-graph with this preprocessing mode ("caffe" or "tf").
 
     Returns
         RetinaNet model with a DenseNet backbone.
     """
     # choose default input
     if inputs is None:
-        inputs = keras.layers.Input((None, None, 3))
+        inputs = keras.layers.Input((None, None, 3), dtype='uint8' if normalize else None)
+    backbone_inputs = layers.Normalize(mode=normalize, name='normalize')(inputs) if normalize else inputs
 
     blocks = allowed_backbones[backbone]
-    backbone = densenet.DenseNet(blocks=blocks, input_tensor=inputs, include_top=False, pooling=None, weights=None)
+    backbone = densenet.DenseNet(blocks=blocks, input_tensor=backbone_inputs, include_top=False, pooling=None, weights=None)
 
     # get last conv layer from the end of each dense block
     layer_outputs = [backbone.get_layer(name='conv{}_block{}_concat'.format(idx + 2, block_num)).output for idx, block_num in enumerate(blocks)]
@@ -21,6 +21,7 @@ from ..utils.image import preprocess_image
 
 from . import retinanet
 from . import Backbone
+from .. import layers
 
 
 class MobileNetBackbone(Backbone):
@@ -32,7 +33,7 @@ class MobileNetBackbone(Backbone):
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
         """
-        return mobilenet_retinanet(*args, backbone=self.backbone, **kwargs)
+        return mobilenet_retinanet(*args, backbone=self.backbone, **self.normalize_kwargs(kwargs, 'tf'))
 
     def download_imagenet(self):
         """ Download pre-trained weights for the specified backbone name.
@@ -77,7 +78,7 @@ class MobileNetBackbone(Backbone):
         return preprocess_image(inputs, mode='tf')
 
 
-def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, modifier=None, **kwargs):
+def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, modifier=None, normalize=None, **kwargs):
     """ Constructs a retinanet model using a mobilenet backbone.
 
     Args
@@ -85,6 +86,7 @@ def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, m
         backbone: Which backbone to use (one of ('mobilenet128', 'mobilenet160', 'mobilenet192', 'mobilenet224')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize: If set, the model takes uint8 images and normalizes them in-graph with this preprocessing mode ("caffe" or "tf").
 
     Returns
         RetinaNet model with a MobileNet backbone.
@@ -93,9 +95,10 @@ def mobilenet_retinanet(num_classes, backbone='mobilenet224_1.0', inputs=None, m
 
     # choose default input
     if inputs is None:
-        inputs = keras.layers.Input((None, None, 3))
+        inputs = keras.layers.Input((None, None, 3), dtype='uint8' if normalize else None)
+    backbone_inputs = layers.Normalize(mode=normalize, name='normalize')(inputs) if normalize else inputs
 
-    backbone = mobilenet.MobileNet(input_tensor=inputs, alpha=alpha, include_top=False, pooling=None, weights=None)
+    backbone = mobilenet.MobileNet(input_tensor=backbone_inputs, alpha=alpha, include_top=False, pooling=None, weights=None)
 
     # create the full model
     layer_names = ['conv_pw_5_relu', 'conv_pw_11_relu', 'conv_pw_13_relu']
@@ -21,6 +21,7 @@ import keras_resnet.models
 
 from . import retinanet
 from . import Backbone
+from .. import layers
 from ..utils.image import preprocess_image
 
 
@@ -36,7 +37,7 @@ class ResNetBackbone(Backbone):
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
         """
-        return resnet_retinanet(*args, backbone=self.backbone, **kwargs)
+        return resnet_retinanet(*args, backbone=self.backbone, **self.normalize_kwargs(kwargs, self.preprocess_mode))
 
     def download_imagenet(self):
         """ Downloads ImageNet weights and returns path to weights file.
@@ -76,7 +77,7 @@ class ResNetBackbone(Backbone):
         return preprocess_image(inputs, mode=self.preprocess_mode)
 
 
-def resnet_retinanet(num_classes, backbone='resnet50', inputs=None, modifier=None, **kwargs):
+def resnet_retinanet(num_classes, backbone='resnet50', inputs=None, modifier=None, normalize=None, **kwargs):
     """ Constructs a retinanet model using a resnet backbone.
 
     Args
@@ -84,24 +85,27 @@ def resnet_retinanet(num_classes, backbone='resnet50', inputs=None, modifier=Non
         backbone: Which backbone to use (one of ('resnet50', 'resnet101', 'resnet152')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize: If set, the model takes uint8 images and normalizes them in-graph with this preprocessing mode ("caffe" or "tf").
 
     Returns
         RetinaNet model with a ResNet backbone.
     """
     # choose default input
     if inputs is None:
+        dtype = 'uint8' if normalize else None
         if keras.backend.image_data_format() == 'channels_first':
-            inputs = keras.layers.Input(shape=(3, None, None))
+            inputs = keras.layers.Input(shape=(3, None, None), dtype=dtype)
         else:
-            inputs = keras.layers.Input(shape=(None, None, 3))
+            inputs = keras.layers.Input(shape=(None, None, 3), dtype=dtype)
+    backbone_inputs = layers.Normalize(mode=normalize, name='normalize')(inputs) if normalize else inputs
 
     # create the resnet backbone
     if backbone == 'resnet50':
-        resnet = keras_resnet.models.ResNet50(inputs, include_top=False, freeze_bn=True)
+        resnet = keras_resnet.models.ResNet50(backbone_inputs, include_top=False, freeze_bn=True)
     elif backbone == 'resnet101':
-        resnet = keras_resnet.models.ResNet101(inputs, include_top=False, freeze_bn=True)
+        resnet = keras_resnet.models.ResNet101(backbone_inputs, include_top=False, freeze_bn=True)
     elif backbone == 'resnet152':
-        resnet = keras_resnet.models.ResNet152(inputs, include_top=False, freeze_bn=True)
+        resnet = keras_resnet.models.ResNet152(backbone_inputs, include_top=False, freeze_bn=True)
     else:
         raise ValueError('Backbone (\'{}\') is invalid.'.format(backbone))
 
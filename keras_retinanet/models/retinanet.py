@@ -17,6 +17,7 @@ limitations under the License.
 import keras
 from .. import initializers
 from .. import layers
+from .. import losses
 from ..layers import coord
 
 import numpy as np
@@ -561,6 +562,9 @@ def retinanet_bbox(
         name                  : Name of the model.
         *kwargs               : Additional kwargs to pass to the minimal retinanet model.
 
+    The input of the model is the input of the retinanet model, so a retinanet model built with
+    uint8_inputs=True results in a model that takes uint8 images.
+
     Returns
         A keras.models.Model which takes an image as input and outputs the detections on the image.
 
@@ -603,3 +607,57 @@ def retinanet_bbox(
 
     # construct the model
     return keras.models.Model(inputs=model.inputs, outputs=outputs, name=name)
+
+
+def retinanet_targets(
+    model,
+    num_classes,
+    anchor_parameters = AnchorParameters.default,
+    negative_overlap  = 0.4,
+    positive_overlap  = 0.5,
+    alpha             = 0.25,
+    gamma             = 2.0,
+    compact           = False,
+    name              = 'retinanet-targets',
+):
+    """ Construct a training model that assigns anchor targets in-graph and outputs the losses.
+
+    Instead of dense targets per anchor, the model takes the annotations of every image as input, which
+    keeps the batches small (see Generator(in_graph_targets=True)). The targets are assigned with
+    layers.AnchorTargets to the anchors of layers.Anchors, like utils.anchors.anchor_targets_bbox does.
+
+    Args
+        model             : RetinaNet model to train.
+        num_classes       : Number of classes to classify.
+        anchor_parameters : Struct containing configuration for anchor generation (sizes, strides, ratios, scales).
+        negative_overlap  : IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
+        positive_overlap  : IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        alpha             : Alpha of the focal loss.
+        gamma             : Gamma of the focal loss.
+        compact           : If True, assign (class index, anchor state) labels instead of one-hot labels.
+        name              : Name of the model.
+
+    Returns
+        A keras.models.Model which takes the inputs of model, the annotations of shape (B, M, 5) padded with label -1 and
+        the (rows, cols) of every image of shape (B, 2) as input, and outputs the regression and classification loss.
+        Compile it with losses.passthrough() for both outputs.
+    """
+    annotations  = keras.layers.Input(shape=(None, 5), name='annotations')
+    image_shapes = keras.layers.Input(shape=(2,), name='image_shapes')
+
+    # compute the anchors
+    features = [model.get_layer(p_name).output for p_name in ['P3', 'P4', 'P5', 'P6', 'P7']]
+    anchors  = __build_anchors(anchor_parameters, features)
+
+    regression_targets, labels = layers.AnchorTargets(
+        num_classes      = num_classes,
+        negative_overlap = negative_overlap,
+        positive_overlap = positive_overlap,
+        compact          = compact,
+        name             = 'anchor_targets',
+    )([anchors, annotations, image_shapes])
+
+    regression_loss     = layers.TargetLoss(losses.smooth_l1(), name='regression_loss')([regression_targets, model.outputs[0]])
+    classification_loss = layers.TargetLoss(losses.focal(alpha=alpha, gamma=gamma, compact=compact), name='classification_loss')([labels, model.outputs[1]])
+
+    return keras.models.Model(inputs=model.inputs + [annotations, image_shapes], outputs=[regression_loss, classification_loss], name=name)
@@ -20,6 +20,7 @@ from keras.utils import get_file
 
 from . import retinanet
 from . import Backbone
+from .. import layers
 from ..utils.image import preprocess_image
 
 
@@ -30,7 +31,7 @@ class VGGBackbone(Backbone):
     def retinanet(self, *args, **kwargs):
         """ Returns a retinanet model using the correct backbone.
         """
-        return vgg_retinanet(*args, backbone=self.backbone, **kwargs)
+        return vgg_retinanet(*args, backbone=self.backbone, **self.normalize_kwargs(kwargs, 'caffe'))
 
     def download_imagenet(self):
         """ Downloads ImageNet weights and returns path to weights file.
@@ -66,7 +67,7 @@ class VGGBackbone(Backbone):
         return preprocess_image(inputs, mode='caffe')
 
 
-def vgg_retinanet(num_classes, backbone='vgg16', inputs=None, modifier=None, **kwargs):
+def vgg_retinanet(num_classes, backbone='vgg16', inputs=None, modifier=None, normalize=None, **kwargs):
     """ Constructs a retinanet model using a vgg backbone.
 
     Args
@@ -74,19 +75,21 @@ def vgg_retinanet(num_classes, backbone='vgg16', inputs=None, modifier=None, **k
         backbone: Which backbone to use (one of ('vgg16', 'vgg19')).
         inputs: The inputs to the network (defaults to a Tensor of shape (None, None, 3)).
         modifier: A function handler which can modify the backbone before using it in retinanet (this can be used to freeze backbone layers for example).
+        normalize: If set, the model takes uint8 images and normalizes them in-graph with this preprocessing mode ("caffe" or "tf").
 
     Returns
         RetinaNet model with a VGG backbone.
     """
     # choose default input
     if inputs is None:
-        inputs = keras.layers.Input(shape=(None, None, 3))
+        inputs = keras.layers.Input(shape=(None, None, 3), dtype='uint8' if normalize else None)
+    backbone_inputs = layers.Normalize(mode=normalize, name='normalize')(inputs) if normalize else inputs
 
     # create the vgg backbone
     if backbone == 'vgg16':
-        vgg = keras.applications.VGG16(input_tensor=inputs, include_top=False)
+        vgg = keras.applications.VGG16(input_tensor=backbone_inputs, include_top=False)
     elif backbone == 'vgg19':
-        vgg = keras.applications.VGG19(input_tensor=inputs, include_top=False)
+        vgg = keras.applications.VGG19(input_tensor=backbone_inputs, include_top=False)
     else:
         raise ValueError("Backbone '{}' not recognized.".format(backbone))
 
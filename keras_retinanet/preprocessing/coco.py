@@ -15,17 +15,101 @@ limitations under the License.
 """
 
 from ..preprocessing.generator import Generator
-from ..utils.image import read_image_bgr, read_image_rgb
+from ..utils.image import read_image_bgr, read_image_bgr_reduced, read_image_rgb
+from ..utils.image_index import load_npz, save_npz
 
+import json
 import os
 import numpy as np
 
-from pycocotools.coco import COCO
+# arrays of a COCO index (see build_coco_index)
+_INDEX_KEYS = ['image_ids', 'file_names', 'sizes', 'offsets', 'boxes', 'category_ids', 'categories', 'category_names']
+
+
+def build_coco_index(annotation_file):
+    """ Build a compact index of a COCO annotation file.
+
+    Crowd annotations and annotations with a width or height below one pixel are left out, like the generator always did.
+
+    Args
+        annotation_file: Path to the COCO instances json file.
+
+    Returns
+        A dictionary of arrays:
+            image_ids      : (N,) COCO id of every image, in the order of the file.
+            file_names     : (N,) file name of every image.
+            sizes          : (N, 2) (height, width) of every image.
+            offsets        : (N + 1,) the annotations of image i are offsets[i]:offsets[i + 1].
+            boxes          : (K, 4) boxes (x1, y1, x2, y2) of all annotations.
+            category_ids   : (K,) COCO category id of every annotation.
+            categories     : (C,) ids of all categories, sorted.
+            category_names : (C,) name of every category.
+    """
+    with open(annotation_file) as f:
+        dataset = json.load(f)
+
+    # images listed more than once keep their first position
+    positions = {}
+    images    = []
+    for image in dataset['images']:
+        if image['id'] not in positions:
+            positions[image['id']] = len(images)
+            images.append(image)
+
+    annotations = [
+        a for a in dataset.get('annotations', [])
+        if not a.get('iscrowd', 0) and a['bbox'][2] >= 1 and a['bbox'][3] >= 1 and a['image_id'] in positions
+    ]
+    image_of     = np.array([positions[a['image_id']] for a in annotations], dtype=np.int64)
+    boxes        = np.array([a['bbox'] for a in annotations], dtype=np.float64).reshape(-1, 4)
+    category_ids = np.array([a['category_id'] for a in annotations], dtype=np.int64)
+
+    # transform from [x, y, w, h] to [x1, y1, x2, y2] and group per image, keeping the order of the file
+    boxes[:, 2:] += boxes[:, :2]
+    order = np.argsort(image_of, kind='mergesort')
+
+    categories = sorted(dataset.get('categories', []), key=lambda c: c['id'])
+    return {
+        'image_ids'      : np.array([image['id'] for image in images], dtype=np.int64),
+        'file_names'     : np.array([image['file_name'] for image in images], dtype=np.str_),
+        'sizes'          : np.array([(image['height'], image['width']) for image in images], dtype=np.int64).reshape(-1, 2),
+        'offsets'        : np.concatenate([[0], np.cumsum(np.bincount(image_of, minlength=len(images)))]).astype(np.int64),
+        'boxes'          : boxes[order],
+        'category_ids'   : category_ids[order],
+        'categories'     : np.array([c['id'] for c in categories], dtype=np.int64),
+        'category_names' : np.array([c['name'] for c in categories], dtype=np.str_),
+    }
+
+
+def load_coco_index(annotation_file, cache_path=None):
+    """ Load the compact index of a COCO annotation file (see build_coco_index).
+
+    The index is stored in cache_path and reused as long as the modification time and size of the annotation file don't change.
+
+    Args
+        annotation_file : Path to the COCO instances json file.
+        cache_path      : Path of the .npz file to persist the index in (None to not persist it).
+    """
+    source = np.array([os.path.getmtime(annotation_file), os.path.getsize(annotation_file)], dtype=np.float64)
+
+    stored = load_npz(cache_path, keys=['source'] + _INDEX_KEYS, name='COCO index')
+    if stored is not None and np.array_equal(stored['source'], source):
+        return {key: stored[key] for key in _INDEX_KEYS}
+
+    index = build_coco_index(annotation_file)
+
+    if cache_path is not None:
+        save_npz(cache_path, dict(index, source=source), name='COCO index')
+
+    return index
 
 
 class CocoGenerator(Generator):
     """ Generate data from the COCO dataset.
 
+    Annotations are served from a compact index of the annotation file, pycocotools is only loaded
+    when the COCO API is needed for evaluation (see the coco property).
+
     See https://github.com/cocodataset/cocoapi/tree/master/PythonAPI for more information.
     """
 
@@ -40,29 +124,41 @@ class CocoGenerator(Generator):
         self.set_name  = set_name
         cocofile = os.path.join(data_dir, 'annotations', 'instances_' + set_name + '.json')
         print('COCOFILE', cocofile)
-        self.coco      = COCO(cocofile)
-        self.image_ids = self.coco.getImgIds()
+        self.annotation_file = cocofile
+        self.index     = load_coco_index(cocofile, os.path.join(data_dir, 'annotations', 'instances_' + set_name + '.index.npz'))
+        self.image_ids = self.index['image_ids'].tolist()
         self.order = order
         self.save_path = save_path
+        self._coco     = None
 
         self.load_classes()
 
+        # label of every annotation in the index
+        label_of               = dict((coco_label, label) for label, coco_label in self.coco_labels.items())
+        self.annotation_labels = np.array([label_of[c] for c in self.index['category_ids']], dtype=np.int64)
+
         super(CocoGenerator, self).__init__(**kwargs)
 
+    @property
+    def coco(self):
+        """ The pycocotools COCO API for the annotation file, loaded on first use.
+        """
+        if self._coco is None:
+            from pycocotools.coco import COCO
+            self._coco = COCO(self.annotation_file)
+        return self._coco
+
     def load_classes(self):
         """ Loads the class to label mapping (and inverse) for COCO.
         """
-        # load class names (name -> label)
-        categories = self.coco.loadCats(self.coco.getCatIds())
-        categories.sort(key=lambda x: x['id'])
-
+        # load class names (name -> label), the index holds the categories sorted by id
         self.classes             = {}
         self.coco_labels         = {}
         self.coco_labels_inverse = {}
-        for c in categories:
-            self.coco_labels[len(self.classes)] = c['id']
-            self.coco_labels_inverse[c['id']] = len(self.classes)
-            self.classes[c['name']] = len(self.classes)
+        for category_id, name in zip(self.index['categories'].tolist(), self.index['category_names'].tolist()):
+            self.coco_labels[len(self.classes)] = category_id
+            self.coco_labels_inverse[category_id] = len(self.classes)
+            self.classes[name] = len(self.classes)
 
         # also load the reverse (label -> name)
         self.labels = {}
@@ -105,48 +201,44 @@ class CocoGenerator(Generator):
         """
         return self.coco_labels[label]
 
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
+        """
+        return os.path.join(self.data_dir, 'images', self.set_name, self.index['file_names'][image_index])
+
+    def image_size(self, image_index):
+        """ Size (rows, cols) of the image at image_index, from the annotation file.
+        """
+        return self.index['sizes'][image_index]
+
     def image_aspect_ratio(self, image_index):
         """ Compute the aspect ratio for an image with image_index.
         """
-        image = self.coco.loadImgs(self.image_ids[image_index])[0]
-        return float(image['width']) / float(image['height'])
+        height, width = self.image_size(image_index)
+        return float(width) / float(height)
 
     def load_image(self, image_index):
         """ Load an image at the image_index.
         """
-        image_info = self.coco.loadImgs(self.image_ids[image_index])[0]
-        path       = os.path.join(self.data_dir, 'images', self.set_name, image_info['file_name'])
+        path = self.image_path(image_index)
         if self.order == 'bgr':
             return read_image_bgr(path)
         else:
             return read_image_rgb(path)
 
+    def load_reduced_image(self, image_index, scale):
+        """ Load an image at the image_index, at a reduced resolution for resizing with scale.
+        """
+        image, scale = read_image_bgr_reduced(self.image_path(image_index), scale)
+        if self.order != 'bgr':
+            image = image[:, :, ::-1].copy()
+        return image, scale
 
     def load_annotations(self, image_index):
         """ Load annotations for an image_index.
         """
-        # get ground truth annotations
-        annotations_ids = self.coco.getAnnIds(imgIds=self.image_ids[image_index], iscrowd=False)
-        annotations     = np.zeros((0, 5))
-
-        # some images appear to miss annotations (like image with id 257034)
-        if len(annotations_ids) == 0:
-            return annotations
-
-        # parse annotations
-        coco_annotations = self.coco.loadAnns(annotations_ids)
-        for idx, a in enumerate(coco_annotations):
-            # some annotations have basically no width / height, skip them
-            if a['bbox'][2] < 1 or a['bbox'][3] < 1:
-                continue
-
-            annotation        = np.zeros((1, 5))
-            annotation[0, :4] = a['bbox']
-            annotation[0, 4]  = self.coco_label_to_label(a['category_id'])
-            annotations       = np.append(annotations, annotation, axis=0)
-
-        # transform from [x, y, w, h] to [x1, y1, x2, y2]
-        annotations[:, 2] = annotations[:, 0] + annotations[:, 2]
-        annotations[:, 3] = annotations[:, 1] + annotations[:, 3]
-
+        start, end  = self.index['offsets'][image_index:image_index + 2]
+        annotations = np.zeros((end - start, 5))
+        annotations[:, :4] = self.index['boxes'][start:end]
+        annotations[:, 4]  = self.annotation_labels[start:end]
         return annotations
@@ -16,13 +16,15 @@ limitations under the License.
 """
 
 from .generator import Generator
-from ..utils.image import read_image_bgr
+from ..utils.image import read_image_bgr, read_image_bgr_reduced
+from ..utils.image_index import load_npz, save_npz
 
 import numpy as np
-from PIL import Image
 from six import raise_from
 
+import collections
 import csv
+import itertools
 import sys
 import os.path
 
@@ -60,13 +62,11 @@ def _read_classes(csv_reader):
     return result
 
 
-def _read_annotations(csv_reader, classes):
+def _read_annotations(csv_reader, classes, first_line=1):
     """ Read annotations from the csv_reader.
     """
     result = {}
-    for line, row in enumerate(csv_reader):
-        line += 1
-
+    for line, row in enumerate(csv_reader, first_line):
         try:
             img_file, x1, y1, x2, y2, class_name = row[:6]
         except ValueError:
@@ -98,6 +98,75 @@ def _read_annotations(csv_reader, classes):
     return result
 
 
+def _read_annotations_chunk(rows, classes, image_ids):
+    """ Parse a chunk of annotation rows into columns.
+
+    Raises a ValueError without details if any row is invalid, see _read_annotations_columnar.
+    """
+    if any(len(row) < 6 for row in rows):
+        raise ValueError('malformed row')
+
+    # every image gets an index in order of appearance, also images without annotations
+    ids    = [image_ids.setdefault(row[0], len(image_ids)) for row in rows]
+    fields = [row[1:6] for row in rows]
+    keep   = [field != ['', '', '', '', ''] for field in fields]
+    fields = [field for field, k in zip(fields, keep) if k]
+
+    boxes  = np.array(list(map(int, itertools.chain.from_iterable(field[:4] for field in fields))), dtype=np.int64).reshape(-1, 4)
+    labels = np.array([classes.get(field[4], -1) for field in fields], dtype=np.int64)
+    ids    = np.array(ids, dtype=np.int64)[np.array(keep, dtype=bool)]
+
+    if np.any(boxes[:, 2] <= boxes[:, 0]) or np.any(boxes[:, 3] <= boxes[:, 1]) or np.any(labels < 0):
+        raise ValueError('invalid row')
+
+    return ids, boxes, labels
+
+
+def _read_annotations_columnar(csv_reader, classes, chunk_size=65536):
+    """ Read annotations from the csv_reader into flat columns, in chunks of chunk_size rows.
+
+    Accepts the same files and raises the same errors as _read_annotations.
+
+    Returns
+        image_names : List of image files, in order of appearance.
+        offsets     : np.array of shape (len(image_names) + 1,), the annotations of image i are offsets[i]:offsets[i + 1].
+        boxes       : np.array of shape (K, 4) holding (x1, y1, x2, y2) of all annotations, grouped per image.
+        labels      : np.array of shape (K,) holding the class id of all annotations.
+    """
+    image_ids = collections.OrderedDict()
+    columns   = []
+    line      = 1
+    while True:
+        rows = list(itertools.islice(csv_reader, chunk_size))
+        if not rows:
+            break
+
+        try:
+            columns.append(_read_annotations_chunk(rows, classes, image_ids))
+        except ValueError as e:
+            # the row by row parser raises the error with its line number
+            _read_annotations(rows, classes, first_line=line)
+
+            # if it accepts the rows after all, report the first row the columnar parser rejects
+            for index, row in enumerate(rows):
+                try:
+                    _read_annotations_chunk([row], classes, {})
+                except ValueError:
+                    raise_from(ValueError('line {}: {}'.format(line + index, e)), None)
+            raise_from(ValueError('lines {}-{}: {}'.format(line, line + len(rows) - 1, e)), None)
+        line += len(rows)
+
+    ids    = np.concatenate([c[0] for c in columns]) if columns else np.zeros((0,), dtype=np.int64)
+    boxes  = np.concatenate([c[1] for c in columns]) if columns else np.zeros((0, 4), dtype=np.int64)
+    labels = np.concatenate([c[2] for c in columns]) if columns else np.zeros((0,), dtype=np.int64)
+
+    # group the annotations per image, keeping the order within an image
+    order   = np.argsort(ids, kind='mergesort')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(ids, minlength=len(image_ids)))]).astype(np.int64)
+
+    return list(image_ids.keys()), offsets, boxes[order], labels[order]
+
+
 def _open_for_csv(path):
     """ Open a file with flags suitable for csv.reader.
 
@@ -121,6 +190,7 @@ class CSVGenerator(Generator):
         csv_data_file,
         csv_class_file,
         base_dir=None,
+        cache_annotations=False,
         **kwargs
     ):
         """ Initialize a CSV data generator.
@@ -129,10 +199,12 @@ class CSVGenerator(Generator):
             csv_data_file: Path to the CSV annotations file.
             csv_class_file: Path to the CSV classes file.
             base_dir: Directory w.r.t. where the files are to be searched (defaults to the directory containing the csv_data_file).
+            cache_annotations: If True, store the parsed annotations in a binary sidecar file (csv_data_file + '.npz'),
+                which is used as long as both CSV files are unchanged.
         """
-        self.image_names = []
-        self.image_data  = {}
-        self.base_dir    = base_dir
+        self.image_names   = []
+        self.base_dir      = base_dir
+        self.csv_data_file = csv_data_file
 
         # Take base_dir from annotations file if not explicitly specified.
         if self.base_dir is None:
@@ -150,12 +222,27 @@ class CSVGenerator(Generator):
             self.labels[value] = key
 
         # csv with img_path, x1, y1, x2, y2, class_name
-        try:
-            with _open_for_csv(csv_data_file) as file:
-                self.image_data = _read_annotations(csv.reader(file, delimiter=','), self.classes)
-        except ValueError as e:
-            raise_from(ValueError('invalid CSV annotations file: {}: {}'.format(csv_data_file, e)), None)
-        self.image_names = list(self.image_data.keys())
+        source = np.array([value for path in [csv_data_file, csv_class_file] for value in (os.path.getmtime(path), os.path.getsize(path))])
+        stored = load_npz(csv_data_file + '.npz', keys=['source', 'image_names', 'offsets', 'boxes', 'labels'], name='annotation cache') if cache_annotations else None
+        if stored is not None and np.array_equal(stored['source'], source):
+            cache = list(stored['image_names']), stored['offsets'], stored['boxes'], stored['labels']
+        else:
+            try:
+                with _open_for_csv(csv_data_file) as file:
+                    cache = _read_annotations_columnar(csv.reader(file, delimiter=','), self.classes)
+            except ValueError as e:
+                raise_from(ValueError('invalid CSV annotations file: {}: {}'.format(csv_data_file, e)), None)
+
+            if cache_annotations:
+                image_names, offsets, boxes, labels = cache
+                save_npz(csv_data_file + '.npz', {
+                    'source'      : source,
+                    'image_names' : np.array(image_names, dtype=np.str_),
+                    'offsets'     : offsets,
+                    'boxes'       : boxes,
+                    'labels'      : labels,
+                }, name='annotation cache')
+        self.image_names, self.annotation_offsets, self.annotation_boxes, self.annotation_labels = cache
 
         super(CSVGenerator, self).__init__(**kwargs)
 
@@ -184,31 +271,33 @@ class CSVGenerator(Generator):
         """
         return os.path.join(self.base_dir, self.image_names[image_index])
 
+    def image_size_index_path(self):
+        """ Path of the persistent image size index, next to the annotations file.
+        """
+        return self.csv_data_file + '.sizes.npz'
+
     def image_aspect_ratio(self, image_index):
         """ Compute the aspect ratio for an image with image_index.
         """
-        # PIL is fast for metadata
-        image = Image.open(self.image_path(image_index))
-        return float(image.width) / float(image.height)
+        rows, cols = self.image_size(image_index)
+        return float(cols) / float(rows)
 
     def load_image(self, image_index):
         """ Load an image at the image_index.
         """
         return read_image_bgr(self.image_path(image_index))
 
+    def load_reduced_image(self, image_index, scale):
+        """ Load an image at the image_index, at a reduced resolution for resizing with scale.
+        """
+        return read_image_bgr_reduced(self.image_path(image_index), scale)
+
     def load_annotations(self, image_index):
         """ Load annotations for an image_index.
         """
-        path   = self.image_names[image_index]
-        annots = self.image_data[path]
-        boxes  = np.zeros((len(annots), 5))
-
-        for idx, annot in enumerate(annots):
-            class_name = annot['class']
-            boxes[idx, 0] = float(annot['x1'])
-            boxes[idx, 1] = float(annot['y1'])
-            boxes[idx, 2] = float(annot['x2'])
-            boxes[idx, 3] = float(annot['y2'])
-            boxes[idx, 4] = self.name_to_label(class_name)
+        start, end = self.annotation_offsets[image_index:image_index + 2]
+        boxes      = np.zeros((end - start, 5))
+        boxes[:, :4] = self.annotation_boxes[start:end]
+        boxes[:, 4]  = self.annotation_labels[start:end]
 
         return boxes
@@ -14,30 +14,53 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import inspect
 import numpy as np
-import random
 import threading
 import warnings
 
 import keras
 
 from ..utils.anchors import (
-    anchor_targets_bbox,
-    anchors_for_shape,
-    guess_shapes
+    anchor_cache,
+    anchor_targets_bbox_batched,
+    guess_shapes,
+    labels_dtype,
+    labels_shape,
+    pad_annotations
 )
 from ..utils.image import (
     TransformParameters,
     adjust_transform_for_image,
     apply_transform,
+    compute_resize_scale,
     preprocess_image,
+    preprocess_image_uint8,
     resize_image,
 )
-from ..utils.transform import transform_aabb
+from ..utils.image_index import image_sizes
+from ..utils.photometric import PhotometricAugmentation
+from ..utils.transform import change_transform_origin, scaling, transform_aabbs
 
 
-class Generator(object):
+def _accepts_keyword(function, name):
+    """ Check whether function can be called with the keyword argument name.
+    """
+    try:
+        parameters = inspect.signature(function).parameters
+    except AttributeError:
+        # Python 2 has no inspect.signature
+        spec = inspect.getargspec(function)
+        return name in spec.args or spec.keywords is not None
+    return name in parameters or any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values())
+
+
+class Generator(keras.utils.Sequence):
     """ Abstract generator class.
+
+    Batches are addressed by index through `__getitem__`, so the generator can be consumed by
+    `fit_generator(workers=N, use_multiprocessing=True)`. Each batch draws its random augmentation from
+    a PRNG seeded with (seed, epoch, index), which keeps results independent of the worker that computes it.
     """
 
     def __init__(
@@ -50,10 +73,18 @@ class Generator(object):
         image_min_side=800,
         image_max_side=1333,
         transform_parameters=None,
-        compute_anchor_targets=anchor_targets_bbox,
+        compute_anchor_targets=anchor_targets_bbox_batched,
         compute_shapes=guess_shapes,
         preprocess_image=preprocess_image,
         save_path=None,
+        seed=None,
+        image_cache=None,
+        compact_targets=False,
+        fused_preprocessing=False,
+        uint8_inputs=False,
+        reduced_decoding=False,
+        buffer_pool=None,
+        in_graph_targets=False,
     ):
         """ Initialize Generator object.
 
@@ -68,6 +99,15 @@ class Generator(object):
             compute_anchor_targets : Function handler for computing the targets of anchors for an image and its annotations.
             compute_shapes         : Function handler for computing the shapes of the pyramid for a given input.
             preprocess_image       : Function handler for preprocessing an image (scaling / normalizing) for passing through a network.
+            homogenous_transform   : Photometric augmentation applied per uint8 image (PhotometricAugmentation, callable or imgaug augmenter).
+            seed                   : Seed for group order and augmentation PRNG streams (defaults to a random seed).
+            image_cache            : Optional ImageCache (see keras_retinanet.utils.image_cache) for decoded images.
+            compact_targets        : If True, generate (class index, anchor state) labels instead of one-hot labels (compute_anchor_targets is called with compact=True).
+            fused_preprocessing    : If True, augment and resize images with a single warp on the uint8 image and normalize afterwards (see fused_preprocess_group_entry).
+            uint8_inputs           : If True, generate uint8 image batches for models that normalize in-graph (preprocess_image is ignored).
+            reduced_decoding       : If True, decode images at the lowest resolution that still meets the resize target (see load_reduced_image).
+            buffer_pool            : Optional BufferPool (see keras_retinanet.utils.buffer_pool) to take batch arrays from, see release_batch.
+            in_graph_targets       : If True, generate batches for models that assign anchor targets in-graph (see models.retinanet.retinanet_targets).
         """
         self.transform_generator    = transform_generator
         self.homogenous_transform   = homogenous_transform
@@ -79,13 +119,31 @@ class Generator(object):
         self.transform_parameters   = transform_parameters or TransformParameters()
         self.compute_anchor_targets = compute_anchor_targets
         self.compute_shapes         = compute_shapes
-        self.preprocess_image       = preprocess_image
+        self.preprocess_image       = preprocess_image_uint8 if uint8_inputs else preprocess_image
         self.save_path              = save_path
-
+        self.seed                   = seed if seed is not None else np.random.randint(0, 2 ** 31 - 1)
+        self.image_cache            = image_cache
+        self.compact_targets        = compact_targets
+        self.fused_preprocessing    = fused_preprocessing
+        self.uint8_inputs           = uint8_inputs
+        self.reduced_decoding       = reduced_decoding
+        self.buffer_pool            = buffer_pool
+        self.in_graph_targets       = in_graph_targets
+
+        if compact_targets and not _accepts_keyword(compute_anchor_targets, 'compact'):
+            raise ValueError('compact_targets requires a compute_anchor_targets that accepts compact=True, like anchor_targets_bbox_batched.')
+        if buffer_pool is not None and not _accepts_keyword(compute_anchor_targets, 'out'):
+            raise ValueError('buffer_pool requires a compute_anchor_targets that accepts out=, like anchor_targets_bbox_batched.')
+
+        self.image_sizes    = None
+        self.decoded_scales = {}
+        self.started_transform_generator = None
+        self.epoch       = 0
         self.group_index = 0
         self.lock        = threading.Lock()
 
         self.group_images()
+        self.group_order = self.epoch_order(self.epoch)
 
     def __iter__(self):
         return self
@@ -115,6 +173,28 @@ class Generator(object):
         """
         raise NotImplementedError('image_aspect_ratio method not implemented')
 
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
+        """
+        raise NotImplementedError('image_path method not implemented')
+
+    def image_size_index_path(self):
+        """ Path of the persistent image size index (see keras_retinanet.utils.image_index), None to not store it.
+        """
+        return None
+
+    def image_size(self, image_index):
+        """ Size (rows, cols) of the image at image_index, without decoding it.
+
+        The sizes of all images are read from their headers once, through the persistent image size index.
+        """
+        if self.image_sizes is None:
+            self.image_sizes = image_sizes(
+                [self.image_path(i) for i in range(self.size())],
+                index_path=self.image_size_index_path()
+            )
+        return self.image_sizes[image_index]
+
     def load_image(self, image_index):
         """ Load an image at the image_index.
         """
@@ -163,20 +243,107 @@ class Generator(object):
         """
         return [self.load_image(image_index) for image_index in group]
 
-    def random_transform_group_entry(self, image, annotations):
+    def load_reduced_image(self, image_index, scale):
+        """ Load an image that is going to be resized with scale, at a reduced resolution if the image format allows it.
+
+        Generators that can decode at a reduced resolution override this method, by default the full image is loaded.
+
+        Returns
+            image, scale: the image and its scale w.r.t. the image returned by load_image.
+        """
+        return self.load_image(image_index), 1.0
+
+    def load_decoded_image(self, image_index):
+        """ Decode an image, at a reduced resolution if reduced_decoding is set.
+
+        The resize scale is computed from the image size in the header, so the image is decoded only once.
+
+        Returns
+            image, scale: the image and its scale w.r.t. the coordinates of the annotations.
+        """
+        if not self.reduced_decoding:
+            return self.load_image(image_index), 1.0
+        return self.load_reduced_image(image_index, self.resize_scale(self.image_size(image_index)))
+
+    def load_scaled_image(self, image_index):
+        """ Load an image, possibly at a reduced resolution.
+
+        Returns
+            image, scale: the image and its scale w.r.t. the coordinates of the annotations.
+        """
+        if self.image_cache is None:
+            return self.load_decoded_image(image_index)
+
+        # the cache is per process, like decoded_scales, which remembers the scale images were decoded at
+        def load():
+            image, self.decoded_scales[image_index] = self.load_decoded_image(image_index)
+            return image
+
+        image, scale = self.image_cache.get(image_index, load)
+        return image, scale * self.decoded_scales.get(image_index, 1.0)
+
+    def load_scaled_image_group(self, group):
+        """ Load images for all images in a group, together with their scales.
+        """
+        return zip(*[self.load_scaled_image(image_index) for image_index in group])
+
+    def scale_annotations_group(self, annotations_group, scale_group):
+        """ Scale annotations to match the scale their images were loaded at.
+        """
+        for index, (annotations, scale) in enumerate(zip(annotations_group, scale_group)):
+            if scale != 1:
+                annotations = annotations.copy()
+                annotations[:, :4] *= scale
+                annotations_group[index] = annotations
+        return annotations_group
+
+    def next_transform(self, prng=None):
+        """ Draw the next transformation from the transform generator.
+
+        If a PRNG is given it is sent to the transform generator (see `random_transform_generator`),
+        so that the transformation depends only on the PRNG and not on the state shared between workers.
+        """
+        with self.lock:
+            if prng is None or not inspect.isgenerator(self.transform_generator):
+                return next(self.transform_generator)
+
+            # a generator has to be started before it accepts a value
+            if self.started_transform_generator is not self.transform_generator:
+                next(self.transform_generator)
+                self.started_transform_generator = self.transform_generator
+            return self.transform_generator.send(prng)
+
+    def apply_homogenous_transform(self, image, prng=None):
+        """ Apply the photometric (homogenous) transformation to an image.
+
+        imgaug augmenters keep their own random state, so a deterministic copy seeded from prng is used instead.
+        """
+        transform = self.homogenous_transform
+        if isinstance(transform, PhotometricAugmentation):
+            return transform(image, prng)
+        if not hasattr(transform, 'augment_image'):
+            return transform(image)
+
+        if prng is not None:
+            transform = transform.to_deterministic()
+            transform.reseed(prng.randint(0, 2 ** 31 - 1), deterministic_too=True)
+        return transform.augment_image(image)
+
+    def random_transform_group_entry(self, image, annotations, prng=None, homogenous=True):
         """ Randomly transforms image and annotation.
+
+        The photometric augmentation is left out if homogenous is False.
         """
         # randomly transform both image and annotations
         if self.transform_generator:
-            transform = adjust_transform_for_image(next(self.transform_generator), image, self.transform_parameters.relative_translation)
+            transform = adjust_transform_for_image(self.next_transform(prng), image, self.transform_parameters.relative_translation)
             image     = apply_transform(transform, image, self.transform_parameters)
 
             # Transform the bounding boxes in the annotations.
             annotations = annotations.copy()
-            for index in range(annotations.shape[0]):
-                annotations[index, :4] = transform_aabb(transform, annotations[index, :4])
-        if self.homogenous_transform:
-            image = self.homogenous_transform(image)
+            annotations[:, :4] = transform_aabbs(transform, annotations[:, :4])
+        if self.homogenous_transform and homogenous:
+            image = self.apply_homogenous_transform(image, prng)
 
         return image, annotations
 
@@ -185,14 +352,51 @@ class Generator(object):
         """
         return resize_image(image, min_side=self.image_min_side, max_side=self.image_max_side)
 
-    def preprocess_group_entry(self, image, annotations):
+    def resize_scale(self, image_shape):
+        """ Scale with which resize_image resizes an image of image_shape.
+        """
+        return compute_resize_scale(image_shape, min_side=self.image_min_side, max_side=self.image_max_side)
+
+    def fused_preprocess_group_entry(self, image, annotations, prng=None):
+        """ Preprocess image and its annotations with a single warp.
+
+        The random transformation and the resize scale are composed into one matrix, which is applied to the uint8
+        image directly at the target size and to the annotations. The image is normalized afterwards, at the target size.
+        """
+        transform = np.identity(3)
+        if self.transform_generator:
+            transform = adjust_transform_for_image(self.next_transform(prng), image, self.transform_parameters.relative_translation)
+
+        image_scale = self.resize_scale(image.shape)
+        resize      = scaling((image_scale, image_scale))
+
+        # cv2.resize maps pixel centers (x + 0.5 -> scale * (x + 0.5)) while warpAffine maps pixel indices,
+        # so the image is scaled around (-0.5, -0.5) to stay aligned with its annotations, like in the unfused path
+        image_transform = change_transform_origin(resize, (-0.5, -0.5)).dot(transform)
+
+        output_shape = (int(round(image.shape[0] * image_scale)), int(round(image.shape[1] * image_scale)))
+        image        = apply_transform(image_transform, image, self.transform_parameters, output_shape=output_shape)
+
+        annotations = annotations.copy()
+        annotations[:, :4] = transform_aabbs(resize.dot(transform), annotations[:, :4])
+
+        if self.homogenous_transform:
+            image = self.apply_homogenous_transform(image, prng)
+
+        return self.preprocess_image(image), annotations
+
+    def preprocess_group_entry(self, image, annotations, prng=None):
         """ Preprocess image and its annotations.
         """
-        # preprocess the image
-        image = self.preprocess_image(image)
+        if self.fused_preprocessing:
+            return self.fused_preprocess_group_entry(image, annotations, prng)
+
+        # photometric augmentation needs the uint8 image, so it is only normalized up front without augmentation
+        if not self.homogenous_transform:
+            image = self.preprocess_image(image)
 
         # randomly transform image and annotations
-        image, annotations = self.random_transform_group_entry(image, annotations)
+        image, annotations = self.random_transform_group_entry(image, annotations, prng, homogenous=False)
 
         # resize image
         image, image_scale = self.resize_image(image)
@@ -200,14 +404,18 @@ class Generator(object):
         # apply resizing to annotations too
         annotations[:, :4] *= image_scale
 
+        # augment at the target size, like the fused path, since blur and sharpen kernels are in pixels
+        if self.homogenous_transform:
+            image = self.preprocess_image(self.apply_homogenous_transform(image, prng))
+
         return image, annotations
 
-    def preprocess_group(self, image_group, annotations_group):
+    def preprocess_group(self, image_group, annotations_group, prng=None):
         """ Preprocess each image and its annotations in its group.
         """
         for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
             # preprocess a single group entry
-            image, annotations = self.preprocess_group_entry(image, annotations)
+            image, annotations = self.preprocess_group_entry(image, annotations, prng)
 
             # copy processed data back to group
             image_group[index]       = image
@@ -221,7 +429,7 @@ class Generator(object):
         # determine the order of the images
         order = list(range(self.size()))
         if self.group_method == 'random':
-            random.shuffle(order)
+            np.random.RandomState(self.seed).shuffle(order)
         elif self.group_method == 'ratio':
             order.sort(key=lambda x: self.image_aspect_ratio(x))
 
@@ -233,72 +441,161 @@ class Generator(object):
         """
         # get the max image shape
         max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
+        dtype     = np.uint8 if self.uint8_inputs else keras.backend.floatx()
 
-        # construct an image batch object
-        image_batch = np.zeros((self.batch_size,) + max_shape, dtype=keras.backend.floatx())
+        # construct an image batch object, channels_first batches are filled through a channels_last view
+        channels_first = keras.backend.image_data_format() == 'channels_first'
+        batch_shape    = (self.batch_size, max_shape[2], max_shape[0], max_shape[1]) if channels_first else (self.batch_size,) + max_shape
+        if self.buffer_pool is None:
+            image_batch = np.zeros(batch_shape, dtype=dtype)
+        else:
+            image_batch = self.buffer_pool.acquire(batch_shape, dtype)
+        images = image_batch.transpose((0, 2, 3, 1)) if channels_first else image_batch
 
         # copy all images to the upper left part of the image batch object
         for image_index, image in enumerate(image_group):
-            image_batch[image_index, :image.shape[0], :image.shape[1], :image.shape[2]] = image
+            images[image_index, :image.shape[0], :image.shape[1], :image.shape[2]] = image
 
-        if keras.backend.image_data_format() == 'channels_first':
-            image_batch = image_batch.transpose((0, 3, 1, 2))
+            # recycled buffers hold an earlier batch, clear the padding
+            if self.buffer_pool is not None:
+                images[image_index, image.shape[0]:] = 0
+                images[image_index, :image.shape[0], image.shape[1]:] = 0
+                images[image_index, :image.shape[0], :image.shape[1], image.shape[2]:] = 0
+        if self.buffer_pool is not None:
+            images[len(image_group):] = 0
 
         return image_batch
 
     def generate_anchors(self, image_shape):
-        return anchors_for_shape(image_shape, shapes_callback=self.compute_shapes)
+        """ Generate (cached) anchors for a padded image shape.
+        """
+        return anchor_cache.anchors_for_shape(image_shape, shapes_callback=self.compute_shapes)
+
+    def compute_annotation_inputs(self, image_group, annotations_group):
+        """ Compute the additional inputs of a model that assigns anchor targets in-graph.
+
+        Returns
+            annotations  : np.array of shape (batch_size, M, 5) with the annotations of every image, padded with label -1.
+            image_shapes : np.array of shape (batch_size, 2) with the (rows, cols) of every image.
+        """
+        annotations, valid = pad_annotations([annotations[:, :5] for annotations in annotations_group])
+        if not annotations.shape[1]:
+            annotations, valid = np.zeros((len(annotations_group), 1, 5)), np.zeros((len(annotations_group), 1), dtype=bool)
+        annotations[~valid, 4] = -1
+
+        image_shapes = np.array([image.shape[:2] for image in image_group])
+        return [annotations.astype(keras.backend.floatx()), image_shapes.astype(keras.backend.floatx())]
 
     def compute_targets(self, image_group, annotations_group):
         """ Compute target outputs for the network using images and their annotations.
+
+        With in_graph_targets the model outputs its losses, which are trained on with dummy targets.
         """
+        if self.in_graph_targets:
+            return [np.zeros((len(image_group), 1), dtype=keras.backend.floatx()) for _ in range(2)]
+
         # get the max image shape
         max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
         anchors   = self.generate_anchors(max_shape)
 
+        kwargs = {'compact': True} if self.compact_targets else {}
+        if self.buffer_pool is not None:
+            batch_size    = len(image_group)
+            kwargs['out'] = (
+                self.buffer_pool.acquire((batch_size, anchors.shape[0]) + labels_shape(self.num_classes(), self.compact_targets), labels_dtype(self.num_classes(), self.compact_targets)),
+                self.buffer_pool.acquire((batch_size, anchors.shape[0], 4 + 1), keras.backend.floatx()),
+                None,
+            )
+
         labels_batch, regression_batch, _ = self.compute_anchor_targets(
             anchors,
             image_group,
             annotations_group,
-            self.num_classes()
+            self.num_classes(),
+            **kwargs
         )
 
         return [regression_batch, labels_batch]
 
-    def compute_input_output(self, group):
+    def release_batch(self, batch):
+        """ Give the arrays of a batch (inputs, targets) back to the buffer pool.
+
+        Only call this once the batch is no longer used, the arrays are overwritten by later batches.
+        """
+        if self.buffer_pool is None:
+            return
+        for part in batch:
+            for array in (part if isinstance(part, (list, tuple)) else [part]):
+                self.buffer_pool.release(array)
+
+    def epoch_order(self, epoch):
+        """ Deterministic permutation of the groups for a given epoch.
+        """
+        if not self.shuffle_groups:
+            return np.arange(len(self.groups))
+        return np.random.RandomState([self.seed, epoch]).permutation(len(self.groups))
+
+    def group_prng(self, index, epoch=None):
+        """ PRNG for the augmentation of the batch at index in epoch (defaults to the current epoch).
+        """
+        return np.random.RandomState([self.seed, self.epoch if epoch is None else epoch, index])
+
+    def compute_input_output(self, group, prng=None):
         """ Compute inputs and target outputs for the network.
         """
         # load images and annotations
-        image_group       = self.load_image_group(group)
-        annotations_group = self.load_annotations_group(group)
+        image_group, scale_group = self.load_scaled_image_group(group)
+        image_group              = list(image_group)
+        annotations_group        = self.load_annotations_group(group)
+
+        # bring annotations to the resolution the images were loaded at
+        annotations_group = self.scale_annotations_group(annotations_group, scale_group)
 
         # check validity of annotations
         image_group, annotations_group = self.filter_annotations(image_group, annotations_group, group)
 
         # perform preprocessing steps
-        image_group, annotations_group = self.preprocess_group(image_group, annotations_group)
+        image_group, annotations_group = self.preprocess_group(image_group, annotations_group, prng)
 
         # compute network inputs
         inputs = self.compute_inputs(image_group)
+        if self.in_graph_targets:
+            inputs = [inputs] + self.compute_annotation_inputs(image_group, annotations_group)
 
         # compute network targets
         targets = self.compute_targets(image_group, annotations_group)
 
         return inputs, targets
 
-    def __next__(self):
-        return self.next()
-
     def __len__(self):
+        """ Number of batches in an epoch.
+        """
         return len(self.groups)
 
+    def __getitem__(self, index):
+        """ Compute the batch at index in the current epoch.
+        """
+        group = self.groups[self.group_order[index]]
+        return self.compute_input_output(group, self.group_prng(index))
+
+    def on_epoch_end(self):
+        """ Advance to the next epoch and reorder the groups.
+        """
+        self.epoch      += 1
+        self.group_order = self.epoch_order(self.epoch)
+
+    def __next__(self):
+        return self.next()
+
     def next(self):
         # advance the group index
         with self.lock:
-            if self.group_index == 0 and self.shuffle_groups:
-                # shuffle groups at start of epoch
-                random.shuffle(self.groups)
-            group = self.groups[self.group_index]
+            group = self.groups[self.group_order[self.group_index]]
+            prng  = self.group_prng(self.group_index)
             self.group_index = (self.group_index + 1) % len(self.groups)
 
-        return self.compute_input_output(group)
+            # reorder groups at the end of an epoch
+            if self.group_index == 0:
+                self.on_epoch_end()
+
+        return self.compute_input_output(group, prng)
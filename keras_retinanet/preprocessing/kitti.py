@@ -18,10 +18,9 @@ import csv
 import os.path
 
 import numpy as np
-from PIL import Image
 
 from .generator import Generator
-from ..utils.image import read_image_bgr
+from ..utils.image import read_image_bgr, read_image_bgr_reduced
 
 kitti_classes = {
     'Car': 0,
@@ -55,6 +54,7 @@ class KittiGenerator(Generator):
             subset: The subset to generate data for (defaults to 'train').
         """
         self.base_dir = base_dir
+        self.subset   = subset
 
         label_dir = os.path.join(self.base_dir, subset, 'labels')
         image_dir = os.path.join(self.base_dir, subset, 'images')
@@ -124,18 +124,32 @@ class KittiGenerator(Generator):
         """
         return self.id_to_labels[label]
 
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
+        """
+        return self.images[image_index]
+
+    def image_size_index_path(self):
+        """ Path of the persistent image size index, next to the labels of the subset.
+        """
+        return os.path.join(self.base_dir, self.subset, 'image_sizes.npz')
+
     def image_aspect_ratio(self, image_index):
         """ Compute the aspect ratio for an image with image_index.
         """
-        # PIL is fast for metadata
-        image = Image.open(self.images[image_index])
-        return float(image.width) / float(image.height)
+        rows, cols = self.image_size(image_index)
+        return float(cols) / float(rows)
 
     def load_image(self, image_index):
         """ Load an image at the image_index.
         """
         return read_image_bgr(self.images[image_index])
 
+    def load_reduced_image(self, image_index, scale):
+        """ Load an image at the image_index, at a reduced resolution for resizing with scale.
+        """
+        return read_image_bgr_reduced(self.images[image_index], scale)
+
     def load_annotations(self, image_index):
         """ Load annotations for an image_index.
         """
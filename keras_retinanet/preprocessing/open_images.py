@@ -16,14 +16,16 @@ limitations under the License.
 
 import csv
 import json
+import multiprocessing
 import os
+import shutil
 import warnings
 
 import numpy as np
-from PIL import Image
 
 from .generator import Generator
-from ..utils.image import read_image_bgr
+from ..utils.image import read_image_bgr, read_image_bgr_reduced
+from ..utils.image_index import image_sizes
 
 
 def load_hierarchy(metadata_dir, version='v4'):
@@ -107,107 +109,248 @@ def get_labels(metadata_dir, version='v4'):
     return id_to_labels, cls_index
 
 
-def generate_images_annotations_json(main_dir, metadata_dir, subset, cls_index, version='v4'):
-    validation_image_ids = {}
+# arrays of the annotations, see generate_images_annotations
+_ANNOTATION_ARRAYS = ['image_ids', 'sizes', 'offsets', 'boxes', 'labels']
+
+# state of the annotation ingest workers, set by _init_ingest
+_ingest = None
+
 
+def _annotations_path(metadata_dir, subset, version):
     if version == 'v4':
-        annotations_path = os.path.join(metadata_dir, subset, '{}-annotations-bbox.csv'.format(subset))
+        return os.path.join(metadata_dir, subset, '{}-annotations-bbox.csv'.format(subset))
     elif version == 'challenge2018':
-        validation_image_ids_path = os.path.join(metadata_dir, 'challenge-2018-image-ids-valset-od.csv')
+        return os.path.join(metadata_dir, 'challenge-2018-train-annotations-bbox.csv')
+    else:
+        return os.path.join(metadata_dir, subset, 'annotations-human-bbox.csv')
 
-        with open(validation_image_ids_path, 'r') as csv_file:
-            reader = csv.DictReader(csv_file, fieldnames=['ImageID'])
-            next(reader)
-            for line, row in enumerate(reader):
-                image_id = row['ImageID']
-                validation_image_ids[image_id] = True
 
-        annotations_path = os.path.join(metadata_dir, 'challenge-2018-train-annotations-bbox.csv')
-    else:
-        annotations_path = os.path.join(metadata_dir, subset, 'annotations-human-bbox.csv')
-
-    fieldnames = ['ImageID', 'Source', 'LabelName', 'Confidence',
-                  'XMin', 'XMax', 'YMin', 'YMax',
-                  'IsOccluded', 'IsTruncated', 'IsGroupOf', 'IsDepiction', 'IsInside']
-
-    id_annotations = dict()
-    with open(annotations_path, 'r') as csv_file:
-        reader = csv.DictReader(csv_file, fieldnames=fieldnames)
-        next(reader)
-
-        images_sizes = {}
-        for line, row in enumerate(reader):
-            frame = row['ImageID']
-
-            if version == 'challenge2018':
-                if subset == 'train':
-                    if frame in validation_image_ids:
-                        continue
-                elif subset == 'validation':
-                    if frame not in validation_image_ids:
-                        continue
-                else:
-                    raise NotImplementedError('This generator handles only the train and validation subsets')
-
-            class_name = row['LabelName']
-
-            if class_name not in cls_index:
-                continue
-
-            cls_id = cls_index[class_name]
-
-            if version == 'challenge2018':
-                # We recommend participants to use the provided subset of the training set as a validation set.
-                # This is preferable over using the V4 val/test sets, as the training set is more densely annotated.
-                img_path = os.path.join(main_dir, 'images', 'train', frame + '.jpg')
-            else:
-                img_path = os.path.join(main_dir, 'images', subset, frame + '.jpg')
+def _init_ingest(annotations_path, cls_index, validation_image_ids, subset, version):
+    global _ingest
+    _ingest = (annotations_path, cls_index, validation_image_ids, subset, version)
 
-            if frame in images_sizes:
-                width, height = images_sizes[frame]
-            else:
-                try:
-                    with Image.open(img_path) as img:
-                        width, height = img.width, img.height
-                        images_sizes[frame] = (width, height)
-                except Exception as ex:
-                    if version == 'challenge2018':
-                        raise ex
-                    continue
 
-            x1 = float(row['XMin'])
-            x2 = float(row['XMax'])
-            y1 = float(row['YMin'])
-            y2 = float(row['YMax'])
+def _read_annotations_chunk(byte_range):
+    """ Parse the rows of the annotations csv between two byte offsets (at line boundaries).
 
-            x1_int = int(round(x1 * width))
-            x2_int = int(round(x2 * width))
-            y1_int = int(round(y1 * height))
-            y2_int = int(round(y2 * height))
+    Returns
+        The number of rows in the chunk, the position of the rows of known classes and their image ids, class ids and (x1, x2, y1, y2).
+    """
+    annotations_path, cls_index, validation_image_ids, subset, version = _ingest
+    with open(annotations_path, 'rb') as f:
+        f.seek(byte_range[0])
+        data = f.read(byte_range[1] - byte_range[0]).decode('utf-8')
 
-            # Check that the bounding box is valid.
-            if x2 <= x1:
-                raise ValueError('line {}: x2 ({}) must be higher than x1 ({})'.format(line, x2, x1))
-            if y2 <= y1:
-                raise ValueError('line {}: y2 ({}) must be higher than y1 ({})'.format(line, y2, y1))
+    num_rows  = 0
+    positions = []
+    image_ids = []
+    cls_ids   = []
+    coords    = []
+    for row in csv.reader(data.splitlines()):
+        if not row:
+            continue
+        line      = num_rows
+        num_rows += 1
+        frame     = row[0]
 
-            if y2_int == y1_int:
-                warnings.warn('filtering line {}: rounding y2 ({}) and y1 ({}) makes them equal'.format(line, y2, y1))
-                continue
+        if version == 'challenge2018':
+            if subset == 'train':
+                if frame in validation_image_ids:
+                    continue
+            elif subset == 'validation':
+                if frame not in validation_image_ids:
+                    continue
+            else:
+                raise NotImplementedError('This generator handles only the train and validation subsets')
+
+        cls_id = cls_index.get(row[2])
+        if cls_id is None:
+            continue
+
+        positions.append(line)
+        image_ids.append(frame)
+        cls_ids.append(cls_id)
+        coords.append(row[4:8])
+
+    return (
+        num_rows,
+        np.array(positions, dtype=np.int64),
+        np.array(image_ids, dtype=np.str_),
+        np.array(cls_ids, dtype=np.int64),
+        np.array(coords, dtype=np.str_).astype(np.float64).reshape(-1, 4),
+    )
+
+
+def _chunk_ranges(path, chunk_size):
+    """ Split a csv file without its header line into byte ranges of about chunk_size, at line boundaries.
+    """
+    ranges = []
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        end   = os.fstat(f.fileno()).st_size
+        while start < end:
+            f.seek(min(start + chunk_size, end))
+            f.readline()
+            ranges.append((start, f.tell()))
+            start = f.tell()
+    return ranges
+
+
+def _first_appearance(values):
+    """ Unique values in order of first appearance and the index of every value into them.
+    """
+    unique, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank  = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return unique[order], rank[inverse]
+
+
+def generate_images_annotations(main_dir, metadata_dir, subset, cls_index, version='v4', workers=None, chunk_size=64 * 1024 * 1024, size_index_path=None):
+    """ Read the bounding box annotations of a subset into flat arrays.
+
+    The annotations csv is parsed in chunks by a pool of processes, image sizes are read from the image headers
+    by a pool of threads (see keras_retinanet.utils.image_index).
+
+    Args
+        main_dir        : The OpenImages directory.
+        metadata_dir    : The directory with the metadata of the version.
+        subset          : The subset to read.
+        cls_index       : Mapping of label name to class id, annotations of other labels are skipped.
+        version         : The OpenImages version.
+        workers         : Number of processes parsing the csv (defaults to the number of CPUs).
+        chunk_size      : Size in bytes of the parts of the csv given to a worker.
+        size_index_path : Path of the persistent image size index (None to not persist it).
+
+    Returns
+        A dictionary of arrays:
+            image_ids : (N,) id of every image with annotations, in order of appearance.
+            sizes     : (N, 2) (height, width) of every image.
+            offsets   : (N + 1,) the annotations of image i are offsets[i]:offsets[i + 1].
+            boxes     : (K, 4) relative (x1, y1, x2, y2) of all annotations.
+            labels    : (K,) class id of every annotation.
+    """
+    annotations_path     = _annotations_path(metadata_dir, subset, version)
+    validation_image_ids = {}
 
-            if x2_int == x1_int:
-                warnings.warn('filtering line {}: rounding x2 ({}) and x1 ({}) makes them equal'.format(line, x2, x1))
-                continue
+    if version == 'challenge2018':
+        validation_image_ids_path = os.path.join(metadata_dir, 'challenge-2018-image-ids-valset-od.csv')
 
-            img_id = row['ImageID']
-            annotation = {'cls_id': cls_id, 'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2}
+        with open(validation_image_ids_path, 'r') as csv_file:
+            reader = csv.DictReader(csv_file, fieldnames=['ImageID'])
+            next(reader)
+            for line, row in enumerate(reader):
+                image_id = row['ImageID']
+                validation_image_ids[image_id] = True
 
-            if img_id in id_annotations:
-                annotations = id_annotations[img_id]
-                annotations['boxes'].append(annotation)
-            else:
-                id_annotations[img_id] = {'w': width, 'h': height, 'boxes': [annotation]}
-    return id_annotations
+    # parse the csv, columns are ImageID, Source, LabelName, Confidence, XMin, XMax, YMin, YMax, ...
+    ranges = _chunk_ranges(annotations_path, chunk_size)
+    pool   = multiprocessing.Pool(workers, initializer=_init_ingest, initargs=(annotations_path, cls_index, validation_image_ids, subset, version))
+    try:
+        chunks = pool.map(_read_annotations_chunk, ranges, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    # line numbers count the rows after the header, like csv.DictReader
+    first_lines = np.cumsum([0] + [chunk[0] for chunk in chunks])
+    lines       = np.concatenate([np.zeros((0,), dtype=np.int64)] + [chunk[1] + first_line for chunk, first_line in zip(chunks, first_lines)])
+    frames      = np.concatenate([np.zeros((0,), dtype=np.str_)] + [chunk[2] for chunk in chunks])
+    cls_ids     = np.concatenate([np.zeros((0,), dtype=np.int64)] + [chunk[3] for chunk in chunks])
+    coords      = np.concatenate([np.zeros((0, 4))] + [chunk[4] for chunk in chunks])
+
+    # read the image sizes from their headers
+    frame_ids, frame_of = _first_appearance(frames)
+    if version == 'challenge2018':
+        # We recommend participants to use the provided subset of the training set as a validation set.
+        # This is preferable over using the V4 val/test sets, as the training set is more densely annotated.
+        image_dir = os.path.join(main_dir, 'images', 'train')
+    else:
+        image_dir = os.path.join(main_dir, 'images', subset)
+    paths = [os.path.join(image_dir, frame + '.jpg') for frame in frame_ids]
+    sizes = image_sizes(paths, index_path=size_index_path, ignore_errors=version != 'challenge2018').reshape(-1, 2)
+
+    # skip annotations of images that can't be read
+    keep = sizes[frame_of, 0] >= 0
+    lines, frame_of, cls_ids, coords = lines[keep], frame_of[keep], cls_ids[keep], coords[keep]
+    x1, x2, y1, y2 = coords.T
+
+    # Check that the bounding boxes are valid.
+    invalid = np.flatnonzero((x2 <= x1) | (y2 <= y1))
+    if len(invalid):
+        i = invalid[0]
+        if x2[i] <= x1[i]:
+            raise ValueError('line {}: x2 ({}) must be higher than x1 ({})'.format(lines[i], x2[i], x1[i]))
+        raise ValueError('line {}: y2 ({}) must be higher than y1 ({})'.format(lines[i], y2[i], y1[i]))
+
+    # filter boxes that become empty when rounded to pixels
+    height, width = sizes[frame_of, 0], sizes[frame_of, 1]
+    empty_y = np.round(y2 * height) == np.round(y1 * height)
+    empty_x = np.round(x2 * width) == np.round(x1 * width)
+    for i in np.flatnonzero(empty_y | empty_x):
+        if empty_y[i]:
+            warnings.warn('filtering line {}: rounding y2 ({}) and y1 ({}) makes them equal'.format(lines[i], y2[i], y1[i]))
+        else:
+            warnings.warn('filtering line {}: rounding x2 ({}) and x1 ({}) makes them equal'.format(lines[i], x2[i], x1[i]))
+    keep = ~(empty_y | empty_x)
+
+    # group the annotations per image, images without annotations are left out
+    images, image_of = _first_appearance(frame_of[keep])
+    order            = np.argsort(image_of, kind='mergesort')
+    return {
+        'image_ids' : frame_ids[images],
+        'sizes'     : sizes[images],
+        'offsets'   : np.concatenate([[0], np.cumsum(np.bincount(image_of, minlength=len(images)))]).astype(np.int64),
+        'boxes'     : np.stack([x1, y1, x2, y2], axis=1)[keep][order],
+        'labels'    : cls_ids[keep][order],
+    }
+
+
+def _source_meta(annotations_path):
+    return {'source': annotations_path, 'mtime': os.path.getmtime(annotations_path), 'size': os.path.getsize(annotations_path)}
+
+
+def _load_array(path):
+    """ Memory-map a stored array, numpy can't map arrays without elements.
+    """
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+def load_images_annotations(cache_dir, annotations_path):
+    """ Load annotations stored by save_images_annotations as memory-mapped arrays.
+
+    Returns None if there are no stored annotations, or if they were made from an older annotations csv.
+    """
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta != _source_meta(annotations_path):
+        return None
+    return {key: _load_array(os.path.join(cache_dir, key + '.npy')) for key in _ANNOTATION_ARRAYS}
+
+
+def save_images_annotations(cache_dir, annotations_path, annotations):
+    """ Store annotations as one .npy file per array, replacing earlier annotations in cache_dir.
+    """
+    temp_dir = cache_dir + '.tmp'
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.makedirs(temp_dir)
+
+    for key in _ANNOTATION_ARRAYS:
+        np.save(os.path.join(temp_dir, key + '.npy'), annotations[key])
+    with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+        json.dump(_source_meta(annotations_path), f)
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(temp_dir, cache_dir)
 
 
 class OpenImagesGenerator(Generator):
@@ -231,25 +374,29 @@ class OpenImagesGenerator(Generator):
         else:
             self.base_dir     = os.path.join(main_dir, 'images', subset)
 
-        metadata_dir          = os.path.join(main_dir, metadata)
-        annotation_cache_json = os.path.join(annotation_cache_dir, subset + '.json')
+        metadata_dir     = os.path.join(main_dir, metadata)
+        annotation_cache = os.path.join(annotation_cache_dir, subset + '_annotations')
+        annotations_path = _annotations_path(metadata_dir, subset, version)
 
         self.hierarchy          = load_hierarchy(metadata_dir, version=version)
         id_to_labels, cls_index = get_labels(metadata_dir, version=version)
 
-        if os.path.exists(annotation_cache_json):
-            with open(annotation_cache_json, 'r') as f:
-                self.annotations = json.loads(f.read())
-        else:
-            self.annotations = generate_images_annotations_json(main_dir, metadata_dir, subset, cls_index, version=version)
-            json.dump(self.annotations, open(annotation_cache_json, "w"))
+        # the annotations are memory-mapped, so processes forked from this generator share their pages
+        self.annotations = load_images_annotations(annotation_cache, annotations_path)
+        if self.annotations is None:
+            self.annotations = generate_images_annotations(
+                main_dir, metadata_dir, subset, cls_index, version=version,
+                size_index_path=os.path.join(annotation_cache_dir, subset + '_image_sizes.npz')
+            )
+            save_images_annotations(annotation_cache, annotations_path, self.annotations)
+            self.annotations = load_images_annotations(annotation_cache, annotations_path)
 
         if labels_filter is not None or parent_label is not None:
             self.id_to_labels, self.annotations = self.__filter_data(id_to_labels, cls_index, labels_filter, parent_label)
         else:
             self.id_to_labels = id_to_labels
 
-        self.id_to_image_id = dict([(i, k) for i, k in enumerate(self.annotations)])
+        self.id_to_image_id = self.annotations['image_ids']
 
         super(OpenImagesGenerator, self).__init__(**kwargs)
 
@@ -300,26 +447,32 @@ class OpenImagesGenerator(Generator):
 
         id_map = dict([(ind, i) for i, ind in enumerate(children_id_to_labels.keys())])
 
-        filtered_annotations = {}
-        for k in self.annotations:
-            img_ann = self.annotations[k]
-
-            filtered_boxes = []
-            for ann in img_ann['boxes']:
-                cls_id = ann['cls_id']
-                if cls_id in children_id_to_labels:
-                    ann['cls_id'] = id_map[cls_id]
-                    filtered_boxes.append(ann)
-
-            if len(filtered_boxes) > 0:
-                filtered_annotations[k] = {'w': img_ann['w'], 'h': img_ann['h'], 'boxes': filtered_boxes}
+        # map the labels of the annotations, -1 for annotations that are filtered
+        label_map = np.full(len(id_to_labels), -1, dtype=np.int64)
+        for ind, i in id_map.items():
+            label_map[ind] = i
+
+        offsets  = self.annotations['offsets']
+        labels   = label_map[self.annotations['labels']]
+        keep     = labels >= 0
+        image_of = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        counts   = np.bincount(image_of[keep], minlength=len(offsets) - 1)
+        images   = np.flatnonzero(counts > 0)
+
+        filtered_annotations = {
+            'image_ids' : self.annotations['image_ids'][images],
+            'sizes'     : self.annotations['sizes'][images],
+            'offsets'   : np.concatenate([[0], np.cumsum(counts[images])]).astype(np.int64),
+            'boxes'     : self.annotations['boxes'][keep],
+            'labels'    : labels[keep],
+        }
 
         children_id_to_labels = dict([(id_map[i], l) for (i, l) in children_id_to_labels.items()])
 
         return children_id_to_labels, filtered_annotations
 
     def size(self):
-        return len(self.annotations)
+        return len(self.annotations['image_ids'])
 
     def num_classes(self):
         return len(self.id_to_labels)
@@ -330,9 +483,11 @@ class OpenImagesGenerator(Generator):
     def label_to_name(self, label):
         return self.id_to_labels[label]
 
+    def image_size(self, image_index):
+        return self.annotations['sizes'][image_index]
+
     def image_aspect_ratio(self, image_index):
-        img_annotations = self.annotations[self.id_to_image_id[image_index]]
-        height, width = img_annotations['h'], img_annotations['w']
+        height, width = self.image_size(image_index)
         return float(width) / float(height)
 
     def image_path(self, image_index):
@@ -342,24 +497,15 @@ class OpenImagesGenerator(Generator):
     def load_image(self, image_index):
         return read_image_bgr(self.image_path(image_index))
 
+    def load_reduced_image(self, image_index, scale):
+        return read_image_bgr_reduced(self.image_path(image_index), scale)
+
     def load_annotations(self, image_index):
-        image_annotations = self.annotations[self.id_to_image_id[image_index]]
-
-        labels = image_annotations['boxes']
-        height, width = image_annotations['h'], image_annotations['w']
-
-        boxes = np.zeros((len(labels), 5))
-        for idx, ann in enumerate(labels):
-            cls_id = ann['cls_id']
-            x1 = ann['x1'] * width
-            x2 = ann['x2'] * width
-            y1 = ann['y1'] * height
-            y2 = ann['y2'] * height
-
-            boxes[idx, 0] = x1
-            boxes[idx, 1] = y1
-            boxes[idx, 2] = x2
-            boxes[idx, 3] = y2
-            boxes[idx, 4] = cls_id
+        start, end    = self.annotations['offsets'][image_index:image_index + 2]
+        height, width = self.image_size(image_index)
+
+        boxes = np.zeros((end - start, 5))
+        boxes[:, :4] = self.annotations['boxes'][start:end] * [width, height, width, height]
+        boxes[:, 4]  = self.annotations['labels'][start:end]
 
         return boxes
@@ -0,0 +1,268 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division, print_function
+
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from .generator import Generator
+from ..utils.image import resize_image
+
+# A pack is a directory holding a dataset that is already resized to image_min_side / image_max_side:
+#
+#   meta.json     : Classes, sides, number of images and whether the pack is complete.
+#   progress.json : Number of packed images and the length of every file after the last finished chunk.
+#   images.bin    : All images as one contiguous uint8 blob.
+#   index.bin     : int64 (offset, rows, cols, channels) per image.
+#   scales.bin    : float64 scale of every image w.r.t. its original resolution.
+#   counts.bin    : int64 number of annotations per image.
+#   boxes.bin     : float32 (x1, y1, x2, y2) per annotation, in packed image coordinates.
+#   labels.bin    : int32 label per annotation.
+#
+# All files except the json files are append-only, so an interrupted build resumes after the last finished chunk.
+_PACK_FILES = ['images.bin', 'index.bin', 'scales.bin', 'counts.bin', 'boxes.bin', 'labels.bin']
+
+# generator used by the pool workers, set by _init_pack
+_pack_generator = None
+
+
+def _fork_pool(workers, generator):
+    """ Create a pool of workers that share generator with the parent process.
+
+    Generators hold locks, caches and live transform generators, so they can not be pickled.
+    The workers are forked instead, which requires a platform that supports the fork start method.
+    """
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    return context.Pool(workers, initializer=_init_pack, initargs=(generator,))
+
+
+def _init_pack(generator):
+    global _pack_generator
+    _pack_generator = generator
+
+
+def _pack_image(image_index):
+    """ Load, resize and scale a single image and its annotations for packing.
+    """
+    image              = _pack_generator.load_image(image_index)
+    annotations        = _pack_generator.load_annotations(image_index)
+    image, image_scale = resize_image(image, min_side=_pack_generator.image_min_side, max_side=_pack_generator.image_max_side)
+
+    boxes  = (annotations[:, :4] * image_scale).astype(np.float32)
+    labels = annotations[:, 4].astype(np.int32)
+    return np.ascontiguousarray(image, dtype=np.uint8), image_scale, boxes, labels
+
+
+def _read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _memmap(path, dtype):
+    """ Memory-map a file read-only, numpy refuses to map empty files.
+    """
+    if os.path.getsize(path) == 0:
+        return np.zeros((0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def _write_json(path, data):
+    """ Write json atomically, so a crash never leaves a truncated file.
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.rename(path + '.tmp', path)
+
+
+def write_pack(generator, path, workers=None, chunk_size=256, verbose=1):
+    """ Write a dataset to a pack, resuming an earlier build in path if there is one.
+
+    The workers are forked from this process, so this requires a platform with the fork start method.
+
+    Args
+        generator  : The Generator to read images and annotations from, its image_min_side and image_max_side define the resolution.
+        path       : The directory to write the pack to.
+        workers    : Number of processes to decode and resize with (defaults to the number of CPUs).
+        chunk_size : Number of images written between progress checkpoints.
+        verbose    : Print progress if 1.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    meta = {
+        'num_images'     : generator.size(),
+        'image_min_side' : generator.image_min_side,
+        'image_max_side' : generator.image_max_side,
+        'labels'         : [generator.label_to_name(label) for label in range(generator.num_classes())],
+        'complete'       : False,
+    }
+
+    # resume from the last checkpoint if the existing pack was made with the same settings
+    old_meta = _read_json(os.path.join(path, 'meta.json'))
+    progress = _read_json(os.path.join(path, 'progress.json'))
+    if old_meta is not None and dict(old_meta, complete=False) != meta:
+        raise ValueError('pack in {} was built with different settings, remove it first'.format(path))
+    if progress is not None and any(_file_size(os.path.join(path, name)) < size for name, size in progress['sizes'].items()):
+        # a data file lost data that was checkpointed, start over
+        progress = None
+    if old_meta is None or progress is None:
+        progress = {'num_images': 0, 'sizes': {name: 0 for name in _PACK_FILES}}
+    _write_json(os.path.join(path, 'meta.json'), meta)
+
+    # drop data written after the last checkpoint
+    files = {}
+    for name in _PACK_FILES:
+        files[name] = open(os.path.join(path, name), 'ab')
+        files[name].truncate(progress['sizes'][name])
+        files[name].seek(progress['sizes'][name])
+
+    pool = _fork_pool(workers, generator)
+    try:
+        offset = progress['sizes']['images.bin']
+        for start in range(progress['num_images'], generator.size(), chunk_size):
+            indices = range(start, min(start + chunk_size, generator.size()))
+            for image, image_scale, boxes, labels in pool.imap(_pack_image, indices, chunksize=8):
+                files['images.bin'].write(image.tobytes())
+                files['index.bin'].write(np.array([offset, image.shape[0], image.shape[1], image.shape[2]], dtype=np.int64).tobytes())
+                files['scales.bin'].write(np.array([image_scale], dtype=np.float64).tobytes())
+                files['counts.bin'].write(np.array([boxes.shape[0]], dtype=np.int64).tobytes())
+                files['boxes.bin'].write(boxes.tobytes())
+                files['labels.bin'].write(labels.tobytes())
+                offset += image.nbytes
+
+            # checkpoint
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+            progress = {'num_images': indices[-1] + 1, 'sizes': {name: f.tell() for name, f in files.items()}}
+            _write_json(os.path.join(path, 'progress.json'), progress)
+
+            if verbose:
+                print('{}/{}'.format(progress['num_images'], generator.size()), end='\r')
+    finally:
+        pool.close()
+        pool.join()
+        for f in files.values():
+            f.close()
+
+    meta['complete'] = True
+    _write_json(os.path.join(path, 'meta.json'), meta)
+
+
+class PackGenerator(Generator):
+    """ Generate data from a pack written by `write_pack` (see `retinanet-pack`).
+
+    Images are served as read-only slices of a memory-mapped blob.
+    """
+
+    def __init__(self, path, **kwargs):
+        """ Initialize a pack data generator.
+
+        Args
+            path: Path to the pack directory.
+        """
+        self.path = path
+        self.meta = _read_json(os.path.join(path, 'meta.json'))
+        if self.meta is None or not self.meta['complete']:
+            raise ValueError('incomplete pack: {}'.format(path))
+
+        self.labels  = dict(enumerate(self.meta['labels']))
+        self.classes = dict((name, label) for label, name in self.labels.items())
+
+        self.images     = _memmap(os.path.join(path, 'images.bin'), np.uint8)
+        self.index      = np.fromfile(os.path.join(path, 'index.bin'), dtype=np.int64).reshape(-1, 4)
+        self.scales     = np.fromfile(os.path.join(path, 'scales.bin'), dtype=np.float64)
+        self.boxes      = _memmap(os.path.join(path, 'boxes.bin'), np.float32).reshape(-1, 4)
+        self.box_labels = _memmap(os.path.join(path, 'labels.bin'), np.int32)
+
+        counts = np.fromfile(os.path.join(path, 'counts.bin'), dtype=np.int64)
+        self.annotation_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        # default to the resolution the pack was built at
+        kwargs.setdefault('image_min_side', self.meta['image_min_side'])
+        kwargs.setdefault('image_max_side', self.meta['image_max_side'])
+
+        super(PackGenerator, self).__init__(**kwargs)
+
+    def size(self):
+        """ Size of the dataset.
+        """
+        return self.index.shape[0]
+
+    def num_classes(self):
+        """ Number of classes in the dataset.
+        """
+        return len(self.labels)
+
+    def name_to_label(self, name):
+        """ Map name to label.
+        """
+        return self.classes[name]
+
+    def label_to_name(self, label):
+        """ Map label to name.
+        """
+        return self.labels[label]
+
+    def image_aspect_ratio(self, image_index):
+        """ Compute the aspect ratio for an image with image_index.
+        """
+        _, rows, cols, _ = self.index[image_index]
+        return float(cols) / float(rows)
+
+    def image_size(self, image_index):
+        """ Size (rows, cols) of the packed image at image_index.
+        """
+        return self.index[image_index, 1:3]
+
+    def load_image(self, image_index):
+        """ Load an image at the image_index.
+        """
+        offset, rows, cols, channels = self.index[image_index]
+        return self.images[offset:offset + rows * cols * channels].reshape(rows, cols, channels)
+
+    def load_annotations(self, image_index):
+        """ Load annotations for an image_index.
+        """
+        start, end  = self.annotation_offsets[image_index:image_index + 2]
+        annotations = np.zeros((end - start, 5))
+        annotations[:, :4] = self.boxes[start:end]
+        annotations[:, 4]  = self.box_labels[start:end]
+        return annotations
+
+    def resize_image(self, image):
+        """ Resize an image, packed images at the requested resolution are returned as is.
+        """
+        if self.image_min_side == self.meta['image_min_side'] and self.image_max_side == self.meta['image_max_side']:
+            return image, 1.0
+        return super(PackGenerator, self).resize_image(image)
+
+    def resize_scale(self, image_shape):
+        """ Scale with which resize_image resizes an image of image_shape.
+        """
+        if self.image_min_side == self.meta['image_min_side'] and self.image_max_side == self.meta['image_max_side']:
+            return 1.0
+        return super(PackGenerator, self).resize_scale(image_shape)
@@ -15,12 +15,13 @@ limitations under the License.
 """
 
 from ..preprocessing.generator import Generator
-from ..utils.image import read_image_bgr
+from ..utils.image import read_image_bgr, read_image_bgr_reduced
+from ..utils.image_index import load_npz, save_npz
 
+import multiprocessing
 import os
 import numpy as np
 from six import raise_from
-from PIL import Image
 
 try:
     import xml.etree.cElementTree as ET
@@ -50,6 +51,9 @@ voc_classes = {
     'tvmonitor'   : 19
 }
 
+# arrays of an annotation cache (see load_annotation_cache)
+_CACHE_KEYS = ['files', 'mtimes', 'errors', 'offsets', 'boxes', 'names', 'truncated', 'difficult', 'class_names']
+
 
 def _findNode(parent, name, debug_name=None, parse=None):
     if debug_name is None:
@@ -66,6 +70,125 @@ def _findNode(parent, name, debug_name=None, parse=None):
     return result
 
 
+def _parse_object(element):
+    """ Parse an object given an XML element, returns (truncated, difficult, class name, (x1, y1, x2, y2)).
+    """
+    truncated = _findNode(element, 'truncated', parse=int)
+    difficult = _findNode(element, 'difficult', parse=int)
+
+    class_name = _findNode(element, 'name').text
+
+    bndbox = _findNode(element, 'bndbox')
+    box    = (
+        _findNode(bndbox, 'xmin', 'bndbox.xmin', parse=float) - 1,
+        _findNode(bndbox, 'ymin', 'bndbox.ymin', parse=float) - 1,
+        _findNode(bndbox, 'xmax', 'bndbox.xmax', parse=float) - 1,
+        _findNode(bndbox, 'ymax', 'bndbox.ymax', parse=float) - 1,
+    )
+
+    return truncated, difficult, class_name, box
+
+
+def _parse_annotation_file(path):
+    """ Parse all objects of an annotation file, for the annotation cache.
+
+    Returns
+        objects, error: a list of (truncated, difficult, class name, box) and an error message ('' if the file is valid).
+    """
+    objects = []
+    try:
+        for i, element in enumerate(ET.parse(path).getroot().iter('object')):
+            try:
+                objects.append(_parse_object(element))
+            except ValueError as e:
+                raise_from(ValueError('could not parse object #{}: {}'.format(i, e)), None)
+    except (ET.ParseError, ValueError) as e:
+        return [], str(e)
+    return objects, ''
+
+
+def load_annotation_cache(annotations_dir, cache_path=None, workers=None):
+    """ Parse all annotation files in a directory into flat arrays, reusing a cache of earlier parses.
+
+    A cached file is reused as long as its modification time didn't change, other files are parsed in parallel.
+    Class names are stored as indices into a vocabulary, so the cache doesn't depend on the classes of a generator.
+
+    Args
+        annotations_dir : The directory holding the .xml annotation files.
+        cache_path      : Path of the .npz file to persist the cache in (None to not persist it).
+        workers         : Number of processes used for parsing (defaults to the number of CPUs).
+
+    Returns
+        A dictionary of arrays:
+            files       : (F,) names of the annotation files without extension.
+            mtimes      : (F,) modification times of the files.
+            errors      : (F,) error message per file, '' for valid files.
+            offsets     : (F + 1,) the objects of file i are objects offsets[i]:offsets[i + 1].
+            boxes       : (K, 4) boxes (x1, y1, x2, y2) of all objects.
+            names       : (K,) class name of every object, as index into class_names.
+            truncated   : (K,) truncated flag of every object.
+            difficult   : (K,) difficult flag of every object.
+            class_names : (C,) vocabulary of class names.
+    """
+    files  = sorted(f[:-4] for f in os.listdir(annotations_dir) if f.endswith('.xml'))
+    mtimes = np.array([os.path.getmtime(os.path.join(annotations_dir, f + '.xml')) for f in files], dtype=np.float64)
+
+    cache = load_npz(cache_path, keys=_CACHE_KEYS, name='annotation cache')
+    if cache is not None and np.array_equal(cache['files'], files) and np.array_equal(cache['mtimes'], mtimes):
+        return cache
+
+    # reuse the parsed objects of unchanged files
+    parsed = {}
+    if cache is not None:
+        class_names = cache['class_names']
+        for i, (name, mtime) in enumerate(zip(cache['files'], cache['mtimes'])):
+            start, end = cache['offsets'][i:i + 2]
+            parsed[(name, mtime)] = ([
+                (cache['truncated'][k], cache['difficult'][k], class_names[cache['names'][k]], cache['boxes'][k]) for k in range(start, end)
+            ], cache['errors'][i])
+
+    missing = [(f, mtime) for f, mtime in zip(files, mtimes) if (f, mtime) not in parsed]
+    paths   = [os.path.join(annotations_dir, f + '.xml') for f, _ in missing]
+    if len(paths) > 256:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_parse_annotation_file, paths, chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_parse_annotation_file(path) for path in paths]
+    parsed.update(zip(missing, results))
+
+    # flatten to arrays
+    vocabulary = {}
+    offsets    = [0]
+    errors     = []
+    objects    = []
+    for f, mtime in zip(files, mtimes):
+        file_objects, error = parsed[(f, mtime)]
+        objects.extend(file_objects)
+        offsets.append(len(objects))
+        errors.append(error)
+
+    cache = {
+        'files'     : np.array(files, dtype=np.str_),
+        'mtimes'    : mtimes,
+        'errors'    : np.array(errors, dtype=np.str_),
+        'offsets'   : np.array(offsets, dtype=np.int64),
+        'boxes'     : np.array([o[3] for o in objects], dtype=np.float64).reshape(-1, 4),
+        'names'     : np.array([vocabulary.setdefault(o[2], len(vocabulary)) for o in objects], dtype=np.int32),
+        'truncated' : np.array([o[0] for o in objects], dtype=bool),
+        'difficult' : np.array([o[1] for o in objects], dtype=bool),
+    }
+    cache['class_names'] = np.array(sorted(vocabulary, key=vocabulary.get), dtype=np.str_)
+
+    if cache_path is not None:
+        save_npz(cache_path, cache, name='annotation cache')
+
+    return cache
+
+
 class PascalVocGenerator(Generator):
     """ Generate data for a Pascal VOC dataset.
 
@@ -80,6 +203,7 @@ class PascalVocGenerator(Generator):
         image_extension='.jpg',
         skip_truncated=False,
         skip_difficult=False,
+        annotation_cache=True,
         **kwargs
     ):
         """ Initialize a Pascal VOC data generator.
@@ -87,6 +211,7 @@ class PascalVocGenerator(Generator):
         Args
             base_dir: Directory w.r.t. where the files are to be searched (defaults to the directory containing the csv_data_file).
             csv_class_file: Path to the CSV classes file.
+            annotation_cache: If True, parse all annotations once into arrays, stored in Annotations.npz (see load_annotation_cache).
         """
         self.data_dir             = data_dir
         self.set_name             = set_name
@@ -100,6 +225,16 @@ class PascalVocGenerator(Generator):
         for key, value in self.classes.items():
             self.labels[value] = key
 
+        self.annotation_cache = None
+        if annotation_cache:
+            self.annotation_cache = load_annotation_cache(os.path.join(data_dir, 'Annotations'), os.path.join(data_dir, 'Annotations.npz'))
+
+            # position of the annotation file of every image and the label of every cached object (-1 for unknown classes)
+            positions                 = dict((name, i) for i, name in enumerate(self.annotation_cache['files']))
+            self.annotation_positions = [positions.get(name) for name in self.image_names]
+            class_labels              = np.array([self.classes.get(name, -1) for name in self.annotation_cache['class_names']], dtype=np.int64)
+            self.annotation_labels    = class_labels[self.annotation_cache['names']]
+
         super(PascalVocGenerator, self).__init__(**kwargs)
 
     def size(self):
@@ -122,40 +257,73 @@ class PascalVocGenerator(Generator):
         """
         return self.labels[label]
 
+    def image_path(self, image_index):
+        """ Returns the image path for image_index.
+        """
+        return os.path.join(self.data_dir, 'JPEGImages', self.image_names[image_index] + self.image_extension)
+
+    def image_size_index_path(self):
+        """ Path of the persistent image size index, next to the image set file.
+        """
+        return os.path.join(self.data_dir, 'ImageSets', 'Main', self.set_name + '.sizes.npz')
+
     def image_aspect_ratio(self, image_index):
         """ Compute the aspect ratio for an image with image_index.
         """
-        path  = os.path.join(self.data_dir, 'JPEGImages', self.image_names[image_index] + self.image_extension)
-        image = Image.open(path)
-        return float(image.width) / float(image.height)
+        rows, cols = self.image_size(image_index)
+        return float(cols) / float(rows)
 
     def load_image(self, image_index):
         """ Load an image at the image_index.
         """
-        path = os.path.join(self.data_dir, 'JPEGImages', self.image_names[image_index] + self.image_extension)
-        return read_image_bgr(path)
+        return read_image_bgr(self.image_path(image_index))
+
+    def load_reduced_image(self, image_index, scale):
+        """ Load an image at the image_index, at a reduced resolution for resizing with scale.
+        """
+        return read_image_bgr_reduced(self.image_path(image_index), scale)
 
     def __parse_annotation(self, element):
         """ Parse an annotation given an XML element.
         """
-        truncated = _findNode(element, 'truncated', parse=int)
-        difficult = _findNode(element, 'difficult', parse=int)
-
-        class_name = _findNode(element, 'name').text
+        truncated, difficult, class_name, bbox = _parse_object(element)
         if class_name not in self.classes:
             raise ValueError('class name \'{}\' not found in classes: {}'.format(class_name, list(self.classes.keys())))
 
         box = np.zeros((1, 5))
-        box[0, 4] = self.name_to_label(class_name)
-
-        bndbox    = _findNode(element, 'bndbox')
-        box[0, 0] = _findNode(bndbox, 'xmin', 'bndbox.xmin', parse=float) - 1
-        box[0, 1] = _findNode(bndbox, 'ymin', 'bndbox.ymin', parse=float) - 1
-        box[0, 2] = _findNode(bndbox, 'xmax', 'bndbox.xmax', parse=float) - 1
-        box[0, 3] = _findNode(bndbox, 'ymax', 'bndbox.ymax', parse=float) - 1
+        box[0, :4] = bbox
+        box[0, 4]  = self.name_to_label(class_name)
 
         return truncated, difficult, box
 
+    def __cached_annotations(self, image_index, filename):
+        """ Slice the annotations for an image_index from the annotation cache.
+        """
+        cache    = self.annotation_cache
+        position = self.annotation_positions[image_index]
+        if cache['errors'][position]:
+            raise ValueError('invalid annotations file: {}: {}'.format(filename, cache['errors'][position]))
+
+        start, end = cache['offsets'][position:position + 2]
+        labels     = self.annotation_labels[start:end]
+
+        unknown = np.flatnonzero(labels < 0)
+        if len(unknown):
+            class_name = cache['class_names'][cache['names'][start + unknown[0]]]
+            raise ValueError('invalid annotations file: {}: could not parse object #{}: class name \'{}\' not found in classes: {}'.format(
+                filename, unknown[0], class_name, list(self.classes.keys())))
+
+        keep = np.ones(end - start, dtype=bool)
+        if self.skip_truncated:
+            keep &= ~cache['truncated'][start:end]
+        if self.skip_difficult:
+            keep &= ~cache['difficult'][start:end]
+
+        boxes = np.zeros((np.count_nonzero(keep), 5))
+        boxes[:, :4] = cache['boxes'][start:end][keep]
+        boxes[:, 4]  = labels[keep]
+        return boxes
+
     def __parse_annotations(self, xml_root):
         """ Parse all annotations under the xml_root.
         """
@@ -178,6 +346,9 @@ class PascalVocGenerator(Generator):
         """ Load annotations for an image_index.
         """
         filename = self.image_names[image_index] + '.xml'
+        if self.annotation_cache is not None and self.annotation_positions[image_index] is not None:
+            return self.__cached_annotations(image_index, filename)
+
         try:
             tree = ET.parse(os.path.join(self.data_dir, 'Annotations', filename))
             return self.__parse_annotations(tree.getroot())
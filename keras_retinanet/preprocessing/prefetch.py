@@ -0,0 +1,267 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import time
+
+from six.moves import queue
+
+# interval at which blocked threads check whether the pipeline is closed
+_POLL_INTERVAL = 0.1
+
+
+class _Stage(object):
+    """ A pool of threads that apply a function to the items of an input queue and put the results on an output queue.
+
+    Items are tuples (position, value). If the function raises, the exception is passed on as the value.
+    """
+
+    def __init__(self, name, function, workers, input_queue, output_queue, stopped):
+        self.name         = name
+        self.function     = function
+        self.input_queue  = input_queue
+        self.output_queue = output_queue
+        self.stopped      = stopped
+        self.items        = 0
+        self.get_wait     = 0.0
+        self.put_wait     = 0.0
+        self.lock         = threading.Lock()
+
+        self.threads = [threading.Thread(target=self.run, name='{}-{}'.format(name, i)) for i in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.time()
+            try:
+                position, value = self.input_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            get_wait = time.time() - start
+
+            if not isinstance(value, Exception):
+                try:
+                    value = self.function(value)
+                except Exception as e:
+                    value = e
+
+            start = time.time()
+            _put(self.output_queue, (position, value), self.stopped)
+            put_wait = time.time() - start
+
+            with self.lock:
+                self.items    += 1
+                self.get_wait += get_wait
+                self.put_wait += put_wait
+
+    def stats(self):
+        """ Dictionary with the number of processed items, the current depth of the input queue and the time
+            the workers spent waiting for input (starved) and for room in the output queue (blocked).
+        """
+        with self.lock:
+            return {
+                'workers'     : len(self.threads),
+                'items'       : self.items,
+                'queue_depth' : self.input_queue.qsize(),
+                'get_wait'    : self.get_wait,
+                'put_wait'    : self.put_wait,
+            }
+
+
+def _put(output_queue, item, stopped):
+    """ Put an item on a bounded queue, giving up when the pipeline is closed.
+    """
+    while not stopped.is_set():
+        try:
+            output_queue.put(item, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            continue
+
+
+class Prefetcher(object):
+    """ Prefetch batches from a Generator with a threaded pipeline.
+
+    Every batch passes through three stages, each with its own pool of threads:
+
+        read    : read and decode the images and annotations, filter invalid annotations.
+        augment : random transformation, preprocessing and resizing, building the input batch.
+        targets : anchor target computation.
+
+    The stages are connected with bounded queues and the number of batches in flight is bounded too,
+    which caps the memory used by the pipeline. cv2 and NumPy release the GIL for the heavy parts of
+    every stage, so the stages overlap even though they run in threads.
+
+    Batches are delivered in index order, with the same augmentation as Generator.__getitem__.
+    If the generator has a buffer pool, a batch is only valid until the next batch is requested,
+    at that point its arrays go back to the pool.
+    """
+
+    def __init__(self, generator, read_workers=4, augment_workers=2, target_workers=1, queue_size=4, max_in_flight=None):
+        """ Initialize the pipeline and start its threads.
+
+        Args
+            generator       : The Generator to compute batches with.
+            read_workers    : Number of threads reading and decoding images.
+            augment_workers : Number of threads augmenting and resizing images.
+            target_workers  : Number of threads computing anchor targets.
+            queue_size      : Capacity of the queue in front of every stage.
+            max_in_flight   : Maximum number of batches in the pipeline (defaults to 4 * queue_size).
+        """
+        self.generator   = generator
+        self.stopped     = threading.Event()
+        self.in_flight   = threading.BoundedSemaphore(max_in_flight or 4 * queue_size)
+        self.epoch       = generator.epoch
+        self.next_index  = 0
+        self.consumed    = 0
+        self.submitted   = 0
+        self.get_wait    = 0.0
+        self.results     = {}
+        self.condition   = threading.Condition()
+        self.last_batch  = None
+
+        self.read_queue    = queue.Queue(queue_size)
+        self.augment_queue = queue.Queue(queue_size)
+        self.target_queue  = queue.Queue(queue_size)
+        self.output_queue  = queue.Queue()
+
+        self.stages = [
+            _Stage('read',    self._read,    read_workers,    self.read_queue,    self.augment_queue, self.stopped),
+            _Stage('augment', self._augment, augment_workers, self.augment_queue, self.target_queue,  self.stopped),
+            _Stage('targets', self._targets, target_workers,  self.target_queue,  self.output_queue,  self.stopped),
+        ]
+
+        self.feeder = threading.Thread(target=self._feed, name='prefetch-feeder')
+        self.feeder.daemon = True
+        self.feeder.start()
+
+        self.collector = threading.Thread(target=self._collect, name='prefetch-collector')
+        self.collector.daemon = True
+        self.collector.start()
+
+    def _feed(self):
+        """ Submit batch indices in order, for as long as the number of batches in flight allows it.
+        """
+        group_order = self.generator.epoch_order(self.epoch)
+        while not self.stopped.is_set():
+            # Python 2 has no timeout on acquire, so poll with a non-blocking acquire
+            if not self.in_flight.acquire(False):
+                time.sleep(_POLL_INTERVAL)
+                continue
+
+            group = self.generator.groups[group_order[self.next_index]]
+            prng  = self.generator.group_prng(self.next_index, epoch=self.epoch)
+            _put(self.read_queue, (self.submitted, (group, prng)), self.stopped)
+
+            self.submitted  += 1
+            self.next_index += 1
+            if self.next_index == len(self.generator):
+                self.next_index  = 0
+                self.epoch      += 1
+                group_order      = self.generator.epoch_order(self.epoch)
+
+    def _collect(self):
+        """ Move finished batches to the reorder buffer.
+        """
+        while not self.stopped.is_set():
+            try:
+                position, value = self.output_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            with self.condition:
+                self.results[position] = value
+                self.condition.notify_all()
+
+    def _read(self, task):
+        group, prng = task
+        generator   = self.generator
+
+        image_group, scale_group = generator.load_scaled_image_group(group)
+        image_group              = list(image_group)
+        annotations_group        = generator.load_annotations_group(group)
+        annotations_group        = generator.scale_annotations_group(annotations_group, scale_group)
+
+        image_group, annotations_group = generator.filter_annotations(image_group, annotations_group, group)
+        return image_group, annotations_group, prng
+
+    def _augment(self, task):
+        image_group, annotations_group, prng = task
+
+        image_group, annotations_group = self.generator.preprocess_group(image_group, annotations_group, prng)
+        inputs = self.generator.compute_inputs(image_group)
+        return inputs, image_group, annotations_group
+
+    def _targets(self, task):
+        inputs, image_group, annotations_group = task
+        if self.generator.in_graph_targets:
+            inputs = [inputs] + self.generator.compute_annotation_inputs(image_group, annotations_group)
+        return inputs, self.generator.compute_targets(image_group, annotations_group)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def next(self):
+        """ Get the next batch, in index order.
+        """
+        # the consumer is done with the previous batch
+        if self.last_batch is not None:
+            self.generator.release_batch(self.last_batch)
+            self.last_batch = None
+
+        start = time.time()
+        with self.condition:
+            while self.consumed not in self.results:
+                self.condition.wait()
+            value = self.results.pop(self.consumed)
+        self.get_wait += time.time() - start
+
+        self.consumed += 1
+        self.in_flight.release()
+
+        if isinstance(value, Exception):
+            raise value
+        self.last_batch = value
+        return value
+
+    def __len__(self):
+        return len(self.generator)
+
+    def stats(self):
+        """ Dictionary with the statistics of every stage and the time the consumer spent waiting for batches.
+        """
+        result = {stage.name: stage.stats() for stage in self.stages}
+        with self.condition:
+            result['consumer'] = {
+                'items'       : self.consumed,
+                'queue_depth' : len(self.results),
+                'get_wait'    : self.get_wait,
+            }
+        if self.generator.buffer_pool is not None:
+            result['buffers'] = self.generator.buffer_pool.stats()
+        return result
+
+    def close(self):
+        """ Stop all threads of the pipeline.
+        """
+        self.stopped.set()
+        for thread in [self.feeder, self.collector] + [thread for stage in self.stages for thread in stage.threads]:
+            thread.join()
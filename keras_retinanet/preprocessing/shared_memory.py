@@ -0,0 +1,265 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import multiprocessing
+import warnings
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from ..utils.anchors import anchors_for_shape, labels_shape
+
+# offsets of arrays inside a slot are aligned to a cache line
+_ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _flatten_batch(batch):
+    """ Flatten an (inputs, targets) batch to a list of arrays and a structure to rebuild it with.
+    """
+    arrays    = []
+    structure = []
+    for part in batch:
+        if isinstance(part, (list, tuple)):
+            structure.append(len(part))
+            arrays.extend(part)
+        else:
+            structure.append(None)
+            arrays.append(part)
+    return arrays, structure
+
+
+def _unflatten_batch(arrays, structure):
+    """ Inverse of _flatten_batch.
+    """
+    batch = []
+    index = 0
+    for length in structure:
+        if length is None:
+            batch.append(arrays[index])
+            index += 1
+        else:
+            batch.append(arrays[index:index + length])
+            index += length
+    return tuple(batch)
+
+
+def _worker(generator, slots, slot_bytes, index_queue, free_slots, ready_queue):
+    """ Worker loop that computes batches and writes them into shared memory slots.
+
+    Messages on the ready queue are tuples (slot, structure, layout), where layout lists (offset, shape, dtype) for every array.
+    If a batch does not fit in a slot, slot is None and layout holds the arrays themselves.
+    If computing a batch raises, slot and structure are None and layout holds the exception.
+    """
+    while True:
+        task = index_queue.get()
+        if task is None:
+            return
+        epoch, index = task
+
+        # follow the epoch of the main process, the workers have their own copy of the generator
+        if generator.epoch != epoch:
+            generator.epoch       = epoch
+            generator.group_order = generator.epoch_order(epoch)
+
+        try:
+            batch = generator[index]
+        except Exception as e:
+            ready_queue.put((None, None, e))
+            continue
+
+        arrays, structure = _flatten_batch(batch)
+
+        offsets = []
+        size    = 0
+        for array in arrays:
+            size = _align(size)
+            offsets.append(size)
+            size += array.nbytes
+
+        if size > slot_bytes:
+            ready_queue.put((None, structure, arrays))
+            continue
+
+        slot   = free_slots.get()
+        buffer = slots[slot].buf
+        layout = []
+        for offset, array in zip(offsets, arrays):
+            view    = np.ndarray(array.shape, dtype=array.dtype, buffer=buffer, offset=offset)
+            view[:] = array
+            layout.append((offset, array.shape, array.dtype.str))
+        ready_queue.put((slot, structure, layout))
+
+        # the batch is copied, its arrays can be reused for the next batch
+        generator.release_batch(batch)
+
+
+class SharedMemoryLoader(object):
+    """ Load batches from a Generator in worker processes and transfer them through shared memory.
+
+    Workers write inputs and targets straight into preallocated `multiprocessing.shared_memory` slots,
+    the consumer receives NumPy views on those slots instead of unpickled copies.
+    Batches are delivered in the order in which they finish, not in index order.
+    """
+
+    def __init__(self, generator, workers=4, num_slots=None, slot_bytes=None):
+        """ Initialize the loader and start the worker processes.
+
+        Args
+            generator  : The Generator to compute batches with.
+            workers    : Number of worker processes.
+            num_slots  : Number of shared memory slots (defaults to 2 * workers).
+            slot_bytes : Capacity of a slot in bytes (defaults to the size of a batch of images of image_max_side x image_max_side).
+        """
+        if shared_memory is None:
+            raise ImportError('SharedMemoryLoader requires multiprocessing.shared_memory (Python 3.8 or newer).')
+
+        # generators hold locks and live transform generators, so they can not be pickled into spawned workers
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError('SharedMemoryLoader requires a platform that supports the fork start method.')
+        context = multiprocessing.get_context('fork')
+
+        self.generator  = generator
+        self.workers    = workers
+        self.num_slots  = num_slots or 2 * workers
+        self.slot_bytes = slot_bytes or self.default_slot_bytes(generator)
+
+        self.slots       = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.num_slots)]
+        self.index_queue = context.Queue()
+        self.free_slots  = context.Queue()
+        self.ready_queue = context.Queue()
+        for slot in range(self.num_slots):
+            self.free_slots.put(slot)
+
+        self.epoch           = 0
+        self.next_index      = 0
+        self.current_release = None
+        self.oversized       = 0
+
+        self.processes = [
+            context.Process(
+                target=_worker,
+                args=(generator, self.slots, self.slot_bytes, self.index_queue, self.free_slots, self.ready_queue)
+            ) for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+        # keep every slot busy
+        for _ in range(self.num_slots):
+            self.submit()
+
+    @staticmethod
+    def default_slot_bytes(generator):
+        """ Number of bytes needed for a batch of images padded to image_max_side x image_max_side.
+        """
+        max_shape   = (generator.image_max_side, generator.image_max_side, 3)
+        num_anchors = anchors_for_shape(max_shape, shapes_callback=generator.compute_shapes).shape[0]
+        itemsize    = np.dtype(np.float32).itemsize
+        labels      = labels_shape(generator.num_classes(), getattr(generator, 'compact_targets', False))[0]
+        per_image   = np.prod(max_shape) + num_anchors * (4 + 1) + num_anchors * labels
+        return int(generator.batch_size * per_image * itemsize) + 8 * _ALIGNMENT
+
+    def submit(self):
+        """ Queue the next batch index for the workers.
+        """
+        self.index_queue.put((self.epoch, self.next_index))
+        self.next_index += 1
+        if self.next_index == len(self.generator):
+            self.next_index  = 0
+            self.epoch      += 1
+
+    def release(self, slot):
+        """ Return a slot to the workers. The views of the batch in that slot become invalid.
+        """
+        self.free_slots.put(slot)
+
+    def get(self):
+        """ Get the next batch, raising the exception of a worker that failed to compute it.
+
+        Returns
+            inputs, targets, release: the batch as views on shared memory and a callable that releases its slot.
+        """
+        slot, structure, layout = self.ready_queue.get()
+        self.submit()
+
+        # the worker failed to compute the batch
+        if structure is None:
+            raise layout
+
+        if slot is None:
+            self.oversized += 1
+            if self.oversized == 1:
+                warnings.warn('Batch exceeds the shared memory slot size ({} bytes), falling back to pickling.'.format(self.slot_bytes))
+            inputs, targets = _unflatten_batch(layout, structure)
+            return inputs, targets, lambda: None
+
+        buffer = self.slots[slot].buf
+        arrays = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset) for offset, shape, dtype in layout]
+        inputs, targets = _unflatten_batch(arrays, structure)
+
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self.release(slot)
+
+        return inputs, targets, release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def next(self):
+        """ Get the next batch, releasing the slot of the previous one.
+
+        The previous batch has to be consumed (copied to the device) before calling next.
+        """
+        if self.current_release is not None:
+            self.current_release()
+
+        inputs, targets, self.current_release = self.get()
+        return inputs, targets
+
+    def __len__(self):
+        return len(self.generator)
+
+    def close(self):
+        """ Stop the workers and free the shared memory.
+        """
+        for _ in self.processes:
+            self.index_queue.put(None)
+        for process in self.processes:
+            # workers waiting for a free slot never see the sentinel
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
@@ -1,2 +1,2 @@
-__all__ = ["anchors", "compute_overlap"]
+__all__ = ["anchors", "compute_overlap", "overlap"]
 
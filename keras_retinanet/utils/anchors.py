@@ -14,10 +14,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from collections import OrderedDict
+import threading
+
 import numpy as np
 import keras
 
-from ..utils.compute_overlap import compute_overlap
+from ..utils.overlap import compute_max_overlap
 
 
 def anchor_targets_bbox(
@@ -26,7 +29,9 @@ def anchor_targets_bbox(
     annotations_group,
     num_classes,
     negative_overlap=0.4,
-    positive_overlap=0.5
+    positive_overlap=0.5,
+    compute_annotations=False,
+    force_match=False
 ):
     """ Generate anchor targets for bbox detection.
 
@@ -38,6 +43,8 @@ def anchor_targets_bbox(
         mask_shape: If the image is padded with zeros, mask_shape can be used to mark the relevant part of the image.
         negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
         positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        compute_annotations: If True, also return the annotation assigned to every anchor (training doesn't use them).
+        force_match: If True, match every annotation to its best anchor, even below positive_overlap (see compute_gt_annotations).
 
     Returns
         labels_batch: batch that contains labels & anchor states (np.array of shape (batch_size, N, num_classes + 1),
@@ -45,7 +52,8 @@ def anchor_targets_bbox(
         regression_batch: batch that contains bounding-box regression targets for an image & anchor states (np.array of shape (batch_size, N, 4 + 1),
                       where N is the number of anchors for an image, the first 4 columns define regression targets for (x1, y1, x2, y2) and the
                       last column defines anchor states (-1 for ignore, 0 for bg, 1 for fg).
-        annotations_batch: annotations per anchor (np.array of shape (batch_size, N, annotations.shape[1]), where N is the number of anchors for an image)
+        annotations_batch: annotations per anchor (np.array of shape (batch_size, N, annotations.shape[1]), where N is the number of anchors for an image),
+                      None unless compute_annotations is True.
     """
 
     assert (len(image_group) == len(annotations_group)), "The length of the images and annotations need to be equal."
@@ -55,13 +63,15 @@ def anchor_targets_bbox(
 
     regression_batch  = np.zeros((batch_size, anchors.shape[0], 4 + 1), dtype=keras.backend.floatx())
     labels_batch      = np.zeros((batch_size, anchors.shape[0], num_classes + 1), dtype=keras.backend.floatx())
-    annotations_batch = np.zeros((batch_size, anchors.shape[0], annotations_group[0].shape[1]), dtype=keras.backend.floatx())
+    annotations_batch = None
+    if compute_annotations:
+        annotations_batch = np.zeros((batch_size, anchors.shape[0], annotations_group[0].shape[1]), dtype=keras.backend.floatx())
 
     # compute labels and regression targets
     for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
         if annotations.shape[0]:
             # obtain indices of gt annotations with the greatest overlap
-            positive_indices, ignore_indices, argmax_overlaps_inds = compute_gt_annotations(anchors, annotations, negative_overlap, positive_overlap)
+            positive_indices, ignore_indices, argmax_overlaps_inds = compute_gt_annotations(anchors, annotations, negative_overlap, positive_overlap, force_match)
 
             labels_batch[index, ignore_indices, -1]       = -1
             labels_batch[index, positive_indices, -1]     = 1
@@ -71,7 +81,8 @@ def anchor_targets_bbox(
 
             # compute box regression targets
             annotations = annotations[argmax_overlaps_inds]
-            annotations_batch[index, ...] = annotations
+            if annotations_batch is not None:
+                annotations_batch[index, ...] = annotations
 
             # compute target class labels
             labels_batch[index, positive_indices, annotations[positive_indices, 4].astype(int)] = 1
@@ -80,8 +91,7 @@ def anchor_targets_bbox(
 
         # ignore annotations outside of image
         if image.shape:
-            anchors_centers = np.vstack([(anchors[:, 0] + anchors[:, 2]) / 2, (anchors[:, 1] + anchors[:, 3]) / 2]).T
-            indices = np.logical_or(anchors_centers[:, 0] >= image.shape[1], anchors_centers[:, 1] >= image.shape[0])
+            indices = anchor_cache.outside_image(anchors, image.shape)
 
             labels_batch[index, indices, -1]     = - 1
             regression_batch[index, indices, -1] = -1
@@ -89,19 +99,188 @@ def anchor_targets_bbox(
     return labels_batch, regression_batch, annotations_batch
 
 
+def labels_shape(num_classes, compact=False):
+    """ Shape of the labels of a single anchor, (class index, state) if compact else (one-hot classes..., state).
+    """
+    return (2,) if compact else (num_classes + 1,)
+
+
+def labels_dtype(num_classes, compact=False):
+    """ Data type of the labels, compact labels use the smallest integer type that holds every class index.
+
+    The anchor state is stored in the same array as the class index, because keras passes the loss a single target
+    array per output. It is only stored as int8 when the class indices fit in int8 too.
+    """
+    if not compact:
+        return keras.backend.floatx()
+    for dtype in [np.int8, np.int16]:
+        if num_classes <= np.iinfo(dtype).max:
+            return dtype
+    return np.int32
+
+
+def pad_annotations(annotations_group):
+    """ Stack a group of annotations into one zero padded array.
+
+    Args
+        annotations_group: List of annotations (np.array of shape (M_i, C) for (x1, y1, x2, y2, label, ...)).
+
+    Returns
+        annotations: np.array of shape (batch_size, M, C), where M is the largest number of annotations in the group.
+        valid: Boolean np.array of shape (batch_size, M) marking the annotations that are not padding.
+    """
+    max_annotations = max(annotations.shape[0] for annotations in annotations_group)
+    columns         = annotations_group[0].shape[1]
+
+    padded = np.zeros((len(annotations_group), max_annotations, columns), dtype=np.float64)
+    valid  = np.zeros((len(annotations_group), max_annotations), dtype=bool)
+    for index, annotations in enumerate(annotations_group):
+        padded[index, :annotations.shape[0]] = annotations
+        valid[index, :annotations.shape[0]]  = True
+
+    return padded, valid
+
+
+def anchor_targets_bbox_batched(
+    anchors,
+    image_group,
+    annotations_group,
+    num_classes,
+    negative_overlap=0.4,
+    positive_overlap=0.5,
+    out=None,
+    compact=False,
+    compute_annotations=False,
+    force_match=False,
+    grid=None
+):
+    """ Generate anchor targets for bbox detection for a whole batch at once.
+
+    Drop-in replacement for anchor_targets_bbox: the assigned annotations of all images are gathered from the padded
+    annotations in one pass and regression targets are only computed for positive anchors (they are zero for all other anchors,
+    which the regression loss ignores anyway).
+
+    If the grid of the anchors is known (anchors from anchor_cache), anchors are only matched with nearby annotations (see
+    compute_max_overlap_grid). The targets are the same, only the annotations assigned to negative anchors would differ, so
+    the grid isn't used with compute_annotations.
+
+    With compact=True the labels are not one-hot encoded, instead labels_batch has shape (batch_size, N, 2) and holds
+    the class index and the anchor state of every anchor (see losses.focal(compact=True)).
+
+    Args
+        anchors: np.array of annotations of shape (N, 4) for (x1, y1, x2, y2).
+        image_group: List of BGR images.
+        annotations_group: List of annotations (np.array of shape (N, 5) for (x1, y1, x2, y2, label)).
+        num_classes: Number of classes to predict.
+        negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
+        positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        out: Optional tuple (labels_batch, regression_batch, annotations_batch) of arrays to write the targets into,
+             annotations_batch is only used with compute_annotations.
+        compact: If True, generate compact labels (see above).
+        compute_annotations: If True, also return the annotation assigned to every anchor (training doesn't use them).
+        force_match: If True, match every annotation to its best anchor, even below positive_overlap (see compute_gt_annotations).
+        grid: Grid of the anchors (see anchor_grid_for_shape), looked up in anchor_cache if None.
+
+    Returns
+        labels_batch, regression_batch, annotations_batch: see anchor_targets_bbox.
+    """
+    assert (len(image_group) == len(annotations_group)), "The length of the images and annotations need to be equal."
+    assert (len(annotations_group) > 0), "No data received to compute anchor targets for."
+
+    batch_size  = len(image_group)
+    num_anchors = anchors.shape[0]
+
+    if out is None:
+        regression_batch  = np.zeros((batch_size, num_anchors, 4 + 1), dtype=keras.backend.floatx())
+        labels_batch      = np.zeros((batch_size, num_anchors) + labels_shape(num_classes, compact), dtype=labels_dtype(num_classes, compact))
+        annotations_batch = None
+        if compute_annotations:
+            annotations_batch = np.zeros((batch_size, num_anchors, annotations_group[0].shape[1]), dtype=keras.backend.floatx())
+    else:
+        labels_batch, regression_batch, annotations_batch = out
+        labels_batch[...]      = 0
+        regression_batch[...]  = 0
+        if not compute_annotations:
+            annotations_batch = None
+        elif annotations_batch is None:
+            annotations_batch = np.zeros((batch_size, num_anchors, annotations_group[0].shape[1]), dtype=keras.backend.floatx())
+        else:
+            annotations_batch[...] = 0
+
+    if compute_annotations:
+        grid = None
+    elif grid is None:
+        grid = anchor_cache.grid(anchors)
+
+    annotations, _ = pad_annotations(annotations_group)
+    if annotations.shape[1]:
+        # best annotation of every anchor, without storing the overlaps of all anchors with all annotations
+        max_overlaps         = np.zeros((batch_size, num_anchors))
+        argmax_overlaps_inds = np.zeros((batch_size, num_anchors), dtype=np.int64)
+        best_anchors         = [None] * batch_size
+        for index, image_annotations in enumerate(annotations_group):
+            if not image_annotations.shape[0]:
+                continue
+            if grid is not None:
+                max_overlaps[index], argmax_overlaps_inds[index], best_anchors[index] = compute_max_overlap_grid(
+                    grid, anchors, image_annotations[:, :4], min_overlap=min(negative_overlap, positive_overlap), all_best_boxes=force_match)
+            else:
+                max_overlaps[index], argmax_overlaps_inds[index], best_anchors[index] = compute_max_overlap(anchors, image_annotations[:, :4])
+
+        positive_indices = max_overlaps >= positive_overlap
+        ignore_indices   = (max_overlaps > negative_overlap) & ~positive_indices
+
+        if force_match:
+            for index, image_annotations in enumerate(annotations_group):
+                if image_annotations.shape[0]:
+                    force_match_annotations(anchors, image_annotations, best_anchors[index], positive_indices[index], ignore_indices[index], argmax_overlaps_inds[index])
+
+        # annotation assigned to every anchor, shape (batch_size, N, C)
+        assigned = annotations[np.arange(batch_size)[:, None], argmax_overlaps_inds]
+        if annotations_batch is not None:
+            annotations_batch[...] = assigned
+
+        states = positive_indices.astype(labels_batch.dtype) - ignore_indices
+        labels_batch[..., -1]     = states
+        regression_batch[..., -1] = states
+
+        # compute target class labels and regression targets for the positive anchors only
+        batch_indices, anchor_indices = np.nonzero(positive_indices)
+        positives = assigned[batch_indices, anchor_indices]
+        if compact:
+            labels_batch[batch_indices, anchor_indices, 0] = positives[:, 4]
+        else:
+            labels_batch[batch_indices, anchor_indices, positives[:, 4].astype(int)] = 1
+        regression_batch[batch_indices, anchor_indices, :-1] = bbox_transform(anchors[anchor_indices], positives)
+
+    # ignore annotations outside of image
+    for index, image in enumerate(image_group):
+        if image.shape:
+            indices = anchor_cache.outside_image(anchors, image.shape)
+
+            labels_batch[index, indices, -1]     = -1
+            regression_batch[index, indices, -1] = -1
+
+    return labels_batch, regression_batch, annotations_batch
+
+
 def compute_gt_annotations(
     anchors,
     annotations,
     negative_overlap=0.4,
-    positive_overlap=0.5
+    positive_overlap=0.5,
+    force_match=False
 ):
     """ Obtain indices of gt annotations with the greatest overlap.
 
+    The overlaps are reduced while they are computed (see compute_max_overlap), so memory stays O(N + K).
+
     Args
         anchors: np.array of annotations of shape (N, 4) for (x1, y1, x2, y2).
         annotations: np.array of shape (N, 5) for (x1, y1, x2, y2, label).
         negative_overlap: IoU overlap for negative anchors (all anchors with overlap < negative_overlap are negative).
         positive_overlap: IoU overlap or positive anchors (all anchors with overlap > positive_overlap are positive).
+        force_match: If True, the best anchor of every annotation is positive for that annotation, even below positive_overlap.
 
     Returns
         positive_indices: indices of positive anchors
@@ -109,17 +288,31 @@ def compute_gt_annotations(
         argmax_overlaps_inds: ordered overlaps indices
     """
 
-    overlaps = compute_overlap(anchors.astype(np.float64), annotations.astype(np.float64))
-    argmax_overlaps_inds = np.argmax(overlaps, axis=1)
-    max_overlaps = overlaps[np.arange(overlaps.shape[0]), argmax_overlaps_inds]
+    max_overlaps, argmax_overlaps_inds, best_anchors = compute_max_overlap(anchors, annotations[:, :4])
 
     # assign "dont care" labels
     positive_indices = max_overlaps >= positive_overlap
     ignore_indices = (max_overlaps > negative_overlap) & ~positive_indices
 
+    if force_match:
+        force_match_annotations(anchors, annotations, best_anchors, positive_indices, ignore_indices, argmax_overlaps_inds)
+
     return positive_indices, ignore_indices, argmax_overlaps_inds
 
 
+def force_match_annotations(anchors, annotations, best_anchors, positive_indices, ignore_indices, argmax_overlaps_inds):
+    """ Assign every annotation to its best anchor (see compute_max_overlap), also if their overlap is below the positive threshold.
+
+    Annotations that don't overlap any anchor are not matched. The arrays of an image are updated in place.
+    """
+    overlaps = _pairwise_overlap(anchors[best_anchors], annotations[:, :4])
+    matched  = np.flatnonzero(overlaps > 0)
+
+    positive_indices[best_anchors[matched]]     = True
+    ignore_indices[best_anchors[matched]]       = False
+    argmax_overlaps_inds[best_anchors[matched]] = matched
+
+
 def layer_shapes(image_shape, model):
     """Compute layer shapes given input image shape and the model.
 
@@ -145,12 +338,32 @@ def layer_shapes(image_shape, model):
     return shape
 
 
-def make_shapes_callback(model):
+def make_shapes_callback(model, max_entries=1024):
     """ Make a function for getting the shape of the pyramid levels.
+
+    The shapes are memoized per (image_shape, pyramid_levels), since computing them walks the whole model.
+
+    Args
+        model: The model to use for computing how the image shape is transformed in the pyramid.
+        max_entries: The maximum number of memoized shapes.
     """
+    cache = OrderedDict()
+    lock  = threading.Lock()
+
     def get_shapes(image_shape, pyramid_levels):
-        shape = layer_shapes(image_shape, model)
+        key = (tuple(image_shape), tuple(pyramid_levels))
+        with lock:
+            if key in cache:
+                cache[key] = cache.pop(key)  # mark as most recently used
+                return cache[key]
+
+        shape = layer_shapes(tuple(image_shape), model)
         image_shapes = [shape["P{}".format(level)][1:3] for level in pyramid_levels]
+
+        with lock:
+            cache[key] = image_shapes
+            if len(cache) > max_entries:
+                cache.popitem(last=False)
         return image_shapes
 
     return get_shapes
@@ -194,6 +407,33 @@ def anchors_for_shape(
     Returns
         np.array of shape (N, 4) containing the (x1, y1, x2, y2) coordinates for the anchors.
     """
+    grid = anchor_grid_for_shape(image_shape, pyramid_levels, ratios, scales, strides, sizes, shapes_callback)
+
+    # compute anchors over all pyramid levels
+    all_anchors = np.zeros((0, 4))
+    for _, shape, stride, anchors in grid:
+        shifted_anchors = shift(shape, stride, anchors)
+        all_anchors     = np.append(all_anchors, shifted_anchors, axis=0)
+
+    return all_anchors
+
+
+def anchor_grid_for_shape(
+    image_shape,
+    pyramid_levels=None,
+    ratios=None,
+    scales=None,
+    strides=None,
+    sizes=None,
+    shapes_callback=None,
+):
+    """ Describe the regular grid of anchors that anchors_for_shape generates, see anchors_for_shape for the arguments.
+
+    Returns
+        A list with a tuple (offset, shape, stride, anchors) per pyramid level, where offset is the index of the first anchor
+        of the level, shape the (rows, cols) of the level, stride its stride and anchors the (A, 4) anchors shifted over the level.
+        Anchor (row, col, a) of a level has index offset + (row * cols + col) * A + a.
+    """
     if pyramid_levels is None:
         pyramid_levels = [3, 4, 5, 6, 7]
     if strides is None:
@@ -209,14 +449,250 @@ def anchors_for_shape(
         shapes_callback = guess_shapes
     image_shapes = shapes_callback(image_shape, pyramid_levels)
 
-    # compute anchors over all pyramid levels
-    all_anchors = np.zeros((0, 4))
+    grid   = []
+    offset = 0
     for idx, p in enumerate(pyramid_levels):
-        anchors         = generate_anchors(base_size=sizes[idx], ratios=ratios, scales=scales)
-        shifted_anchors = shift(image_shapes[idx], strides[idx], anchors)
-        all_anchors     = np.append(all_anchors, shifted_anchors, axis=0)
+        anchors = generate_anchors(base_size=sizes[idx], ratios=ratios, scales=scales)
+        shape   = (int(image_shapes[idx][0]), int(image_shapes[idx][1]))
+        grid.append((offset, shape, strides[idx], anchors))
+        offset += shape[0] * shape[1] * anchors.shape[0]
 
-    return all_anchors
+    return grid
+
+
+def _grid_range(low, high, stride, size):
+    """ Range [start, end) of the cells of a level whose center lies within (low, high), with a margin of one cell.
+    """
+    start = np.clip(np.floor(low / stride - 0.5), 0, size).astype(np.int64)
+    end   = np.clip(np.ceil(high / stride - 0.5) + 1, 0, size).astype(np.int64)
+    return start, np.maximum(end, start)
+
+
+def _grid_candidates(grid, boxes, min_overlap):
+    """ Pairs of anchors and boxes that can have an overlap of at least min_overlap, according to the anchor grid.
+
+    An overlap (IoU) of at least min_overlap needs an intersection of at least min_overlap times the area of the larger box,
+    which bounds the range of anchor centers that can reach it for every anchor shape.
+
+    Returns
+        anchor_indices, box_indices: (P,) indices of the candidate pairs.
+    """
+    # empty boxes don't overlap any anchor
+    valid       = np.flatnonzero((boxes[:, 2] - boxes[:, 0] + 1 > 0) & (boxes[:, 3] - boxes[:, 1] + 1 > 0))
+    boxes       = boxes[valid]
+    box_widths  = boxes[:, 2] - boxes[:, 0] + 1
+    box_heights = boxes[:, 3] - boxes[:, 1] + 1
+    box_areas   = box_widths * box_heights
+
+    anchor_indices = [np.zeros((0,), dtype=np.int64)]
+    box_indices    = [np.zeros((0,), dtype=np.int64)]
+    for offset, (rows, cols), stride, anchors in grid:
+        num_anchors    = anchors.shape[0]
+        anchor_widths  = anchors[:, 2] - anchors[:, 0] + 1
+        anchor_heights = anchors[:, 3] - anchors[:, 1] + 1
+        anchor_areas   = anchor_widths * anchor_heights
+
+        # minimum intersection width and height for every (box, anchor shape) pair, shape (K, A)
+        min_area   = min_overlap * np.maximum(box_areas[:, None], anchor_areas[None, :])
+        min_width  = np.maximum(min_area / np.minimum(box_heights[:, None], anchor_heights[None, :]), 0)
+        min_height = np.maximum(min_area / np.minimum(box_widths[:, None], anchor_widths[None, :]), 0)
+
+        col_start, col_end = _grid_range(
+            boxes[:, 0, None] - anchors[None, :, 2] - 1 + min_width,
+            boxes[:, 2, None] - anchors[None, :, 0] + 1 - min_width,
+            stride,
+            cols
+        )
+        row_start, row_end = _grid_range(
+            boxes[:, 1, None] - anchors[None, :, 3] - 1 + min_height,
+            boxes[:, 3, None] - anchors[None, :, 1] + 1 - min_height,
+            stride,
+            rows
+        )
+
+        # enumerate the cells of every (box, anchor shape) pair
+        num_cols = (col_end - col_start).ravel()
+        counts   = num_cols * (row_end - row_start).ravel()
+        pairs    = np.repeat(np.arange(counts.size), counts)
+        cells    = np.arange(pairs.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        row      = row_start.ravel()[pairs] + cells // num_cols[pairs]
+        col      = col_start.ravel()[pairs] + cells % num_cols[pairs]
+
+        anchor_indices.append(offset + (row * cols + col) * num_anchors + pairs % num_anchors)
+        box_indices.append(valid[pairs // num_anchors])
+
+    return np.concatenate(anchor_indices), np.concatenate(box_indices)
+
+
+def _pairwise_overlap(boxes, query_boxes):
+    """ Overlap (IoU) of every box with the query box at the same position, computed like compute_overlap.
+    """
+    iw = np.minimum(boxes[:, 2], query_boxes[:, 2]) - np.maximum(boxes[:, 0], query_boxes[:, 0]) + 1
+    ih = np.minimum(boxes[:, 3], query_boxes[:, 3]) - np.maximum(boxes[:, 1], query_boxes[:, 1]) + 1
+
+    box_areas   = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    query_areas = (query_boxes[:, 2] - query_boxes[:, 0] + 1) * (query_boxes[:, 3] - query_boxes[:, 1] + 1)
+
+    overlaps  = np.zeros(boxes.shape[0], dtype=boxes.dtype)
+    intersect = (iw > 0) & (ih > 0)
+    iw, ih    = iw[intersect], ih[intersect]
+    overlaps[intersect] = iw * ih / (box_areas[intersect] + query_areas[intersect] - iw * ih)
+    return overlaps
+
+
+def compute_max_overlap_grid(grid, anchors, boxes, min_overlap=0.0, all_best_boxes=True):
+    """ Spatially indexed version of compute_max_overlap for anchors that lie on a grid (see anchor_grid_for_shape).
+
+    Only the anchors near a box, with a shape that can reach an overlap of min_overlap, are tested against it,
+    so the cost grows with the number of candidate anchors instead of with N * K.
+
+    Args
+        grid        : The grid of anchors, as returned by anchor_grid_for_shape.
+        anchors     : (N, 4) anchors of the grid, as returned by anchors_for_shape.
+        boxes       : (K, 4) boxes to match the anchors with.
+        min_overlap    : Overlaps below min_overlap are treated as zero.
+        all_best_boxes : If True, boxes without an anchor above min_overlap are matched with all anchors to find their best anchor.
+                         Only needed to force match annotations, tiny boxes otherwise bring back the cost of the dense overlaps.
+
+    Returns
+        max_overlaps, argmax_overlaps, best_boxes: see compute_max_overlap, which gives the same result for anchors with a maximum
+        overlap of at least min_overlap. The other anchors have a maximum overlap of 0 and argmax 0.
+        best_boxes (the best anchor of every box) is the same as with compute_max_overlap if all_best_boxes is True,
+        otherwise it is 0 for boxes without an anchor above min_overlap.
+    """
+    dtype   = np.float32 if anchors.dtype == np.float32 and boxes.dtype == np.float32 else np.float64
+    anchors = np.asarray(anchors, dtype=dtype)
+    boxes   = np.asarray(boxes, dtype=dtype)
+
+    max_overlaps    = np.zeros((anchors.shape[0],), dtype=dtype)
+    argmax_overlaps = np.zeros((anchors.shape[0],), dtype=np.int64)
+    best_anchors    = np.zeros((boxes.shape[0],), dtype=np.int64)
+
+    anchor_indices, box_indices = _grid_candidates(grid, boxes, min_overlap)
+    overlaps = _pairwise_overlap(anchors[anchor_indices], boxes[box_indices])
+    keep     = (overlaps > 0) & (overlaps >= min_overlap)
+    anchor_indices, box_indices, overlaps = anchor_indices[keep], box_indices[keep], overlaps[keep]
+
+    # the best box of every anchor, the lowest index wins ties
+    order = np.lexsort((box_indices, -overlaps, anchor_indices))
+    first = order[np.r_[True, anchor_indices[order[1:]] != anchor_indices[order[:-1]]]] if order.size else order
+    max_overlaps[anchor_indices[first]]    = overlaps[first]
+    argmax_overlaps[anchor_indices[first]] = box_indices[first]
+
+    # the best anchor of every box, the lowest index wins ties
+    order = np.lexsort((anchor_indices, -overlaps, box_indices))
+    first = order[np.r_[True, box_indices[order[1:]] != box_indices[order[:-1]]]] if order.size else order
+    best_anchors[box_indices[first]] = anchor_indices[first]
+
+    # boxes without an anchor above min_overlap are matched with all anchors
+    if all_best_boxes:
+        unmatched = np.ones((boxes.shape[0],), dtype=bool)
+        unmatched[box_indices[first]] = False
+        if unmatched.any():
+            _, _, best_anchors[unmatched] = compute_max_overlap(anchors, boxes[unmatched])
+
+    return max_overlaps, argmax_overlaps, best_anchors
+
+
+def _parameters_key(value):
+    """ Hashable representation of an anchor parameter.
+    """
+    if value is None:
+        return None
+    return tuple(np.asarray(value).ravel().tolist())
+
+
+class AnchorCache(object):
+    """ Bounded LRU cache of anchors per padded image shape and anchor parameters.
+
+    For every cached set of anchors it also keeps their grid, their centers and the "outside image" masks per image shape.
+    Anchors returned by the cache are read-only, since they are shared between batches.
+
+    Args
+        max_entries : The maximum number of cached anchor sets.
+        max_masks   : The maximum number of cached masks per anchor set.
+    """
+    def __init__(self, max_entries=512, max_masks=64):
+        self.max_entries = max_entries
+        self.max_masks   = max_masks
+        self.entries     = OrderedDict()
+        self.keys        = {}
+        self.lock        = threading.Lock()
+
+    def anchors_for_shape(self, image_shape, shapes_callback=None, **kwargs):
+        """ Cached version of anchors_for_shape, see anchors_for_shape for the arguments.
+        """
+        key = (tuple(image_shape), shapes_callback) + tuple((name, _parameters_key(value)) for name, value in sorted(kwargs.items()))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = self.entries.pop(key)  # mark as most recently used
+                return entry['anchors']
+
+        anchors = anchors_for_shape(image_shape, shapes_callback=shapes_callback, **kwargs)
+        anchors.flags.writeable = False
+        grid    = anchor_grid_for_shape(image_shape, shapes_callback=shapes_callback, **kwargs)
+        centers = np.stack([(anchors[:, 0] + anchors[:, 2]) / 2, (anchors[:, 1] + anchors[:, 3]) / 2], axis=1)
+
+        with self.lock:
+            self.entries[key]      = {'anchors': anchors, 'grid': grid, 'centers': centers, 'masks': OrderedDict()}
+            self.keys[id(anchors)] = key
+            if len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                del self.keys[id(evicted['anchors'])]
+
+        return anchors
+
+    def _entry(self, anchors):
+        """ Entry holding anchors, if anchors came from this cache.
+        """
+        key   = self.keys.get(id(anchors))
+        entry = self.entries.get(key) if key is not None else None
+        if entry is not None and entry['anchors'] is anchors:
+            return entry
+        return None
+
+    def grid(self, anchors):
+        """ Grid of anchors (see anchor_grid_for_shape), None if anchors didn't come from this cache.
+        """
+        with self.lock:
+            entry = self._entry(anchors)
+        return entry['grid'] if entry is not None else None
+
+    def centers(self, anchors):
+        """ Centers (x, y) of anchors, shape (N, 2).
+        """
+        with self.lock:
+            entry = self._entry(anchors)
+        if entry is not None:
+            return entry['centers']
+        return np.stack([(anchors[:, 0] + anchors[:, 2]) / 2, (anchors[:, 1] + anchors[:, 3]) / 2], axis=1)
+
+    def outside_image(self, anchors, image_shape):
+        """ Mask of anchors whose center lies outside of an image of image_shape.
+        """
+        key = tuple(image_shape[:2])
+        with self.lock:
+            entry = self._entry(anchors)
+            if entry is not None and key in entry['masks']:
+                entry['masks'][key] = entry['masks'].pop(key)  # mark as most recently used
+                return entry['masks'][key]
+
+        centers = entry['centers'] if entry is not None else self.centers(anchors)
+        mask    = np.logical_or(centers[:, 0] >= image_shape[1], centers[:, 1] >= image_shape[0])
+
+        if entry is not None:
+            mask.flags.writeable = False
+            with self.lock:
+                entry['masks'][key] = mask
+                if len(entry['masks']) > self.max_masks:
+                    entry['masks'].popitem(last=False)
+
+        return mask
+
+
+# anchor cache shared by all generators in a process
+anchor_cache = AnchorCache()
 
 
 def shift(shape, stride, anchors):
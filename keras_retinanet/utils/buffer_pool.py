@@ -0,0 +1,100 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import threading
+import weakref
+
+import numpy as np
+
+
+class BufferPool(object):
+    """ Pool of reusable arrays, keyed by shape and dtype.
+
+    Arrays handed out by acquire are owned by the caller until they are given back with release,
+    after which a later acquire of the same shape and dtype returns them again instead of allocating.
+    Free arrays of the least recently used shapes are dropped when they exceed max_bytes.
+    The pool only keeps weak references to the arrays it handed out, arrays that are never released are freed as usual.
+
+    Args
+        max_bytes: Maximum number of bytes held by free arrays.
+    """
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes   = max_bytes
+        self.free        = collections.OrderedDict()
+        self.free_bytes  = 0
+        self.owned       = weakref.WeakValueDictionary()
+        self.lock        = threading.Lock()
+        self.allocations = 0
+        self.reuses      = 0
+
+    def acquire(self, shape, dtype):
+        """ Get an (uninitialized) array of shape and dtype.
+        """
+        dtype = np.dtype(dtype)
+        key   = (tuple(shape), dtype.str)
+        with self.lock:
+            arrays = self.free.get(key)
+            if arrays:
+                self.free[key] = self.free.pop(key)  # mark as most recently used
+                array = arrays.pop()
+                self.free_bytes -= array.nbytes
+                self.reuses     += 1
+                return array
+            self.allocations += 1
+
+        array = np.empty(shape, dtype=dtype)
+        with self.lock:
+            self.owned[id(array)] = array
+        return array
+
+    def release(self, array):
+        """ Give an array (or a view on it) back to the pool, arrays that don't belong to the pool are ignored.
+        """
+        while array.base is not None and id(array) not in self.owned:
+            array = array.base
+
+        with self.lock:
+            if self.owned.get(id(array)) is not array:
+                return
+
+            key    = (array.shape, array.dtype.str)
+            arrays = self.free.setdefault(key, [])
+            if any(free is array for free in arrays):
+                return
+            arrays.append(array)
+            self.free[key] = self.free.pop(key)  # mark as most recently used
+            self.free_bytes += array.nbytes
+
+            # drop free arrays of the least recently used shapes
+            while self.free_bytes > self.max_bytes:
+                oldest, arrays = next(iter(self.free.items()))
+                dropped = arrays.pop(0)
+                del self.owned[id(dropped)]
+                self.free_bytes -= dropped.nbytes
+                if not arrays:
+                    del self.free[oldest]
+
+    def stats(self):
+        """ Dictionary with the number of allocations, reuses and the free arrays of the pool.
+        """
+        with self.lock:
+            return {
+                'allocations' : self.allocations,
+                'reuses'      : self.reuses,
+                'free_arrays' : sum(len(arrays) for arrays in self.free.values()),
+                'free_bytes'  : self.free_bytes,
+            }
@@ -16,12 +16,12 @@ limitations under the License.
 
 from __future__ import print_function
 
-from pycocotools.cocoeval import COCOeval
-
 import keras
 import numpy as np
 import json
 
+from .image import preprocess_image_uint8
+
 
 def evaluate_coco(generator, model, threshold=0.05,
                   resdir='.'):
@@ -35,9 +35,13 @@ def evaluate_coco(generator, model, threshold=0.05,
     # start collecting results
     results = []
     image_ids = []
+
+    # models built with uint8_inputs normalize the images themselves
+    uint8_inputs = keras.backend.dtype(model.inputs[0]) == 'uint8'
+
     for index in range(generator.size()):
         image = generator.load_image(index)
-        image = generator.preprocess_image(image)
+        image = preprocess_image_uint8(image) if uint8_inputs else generator.preprocess_image(image)
         image, scale = generator.resize_image(image)
 
         if keras.backend.image_data_format() == 'channels_first':
@@ -83,6 +87,9 @@ def evaluate_coco(generator, model, threshold=0.05,
     json.dump(results, open('{}/{}_bbox_results.json'.format(resdir, generator.set_name), 'w'), indent=4)
     json.dump(image_ids, open('{}/{}_processed_image_ids.json'.format(resdir, generator.set_name), 'w'), indent=4)
 
+    # pycocotools is only needed for the evaluation itself
+    from pycocotools.cocoeval import COCOeval
+
     # load results in COCO evaluation tool
     coco_true = generator.coco
     coco_pred = coco_true.loadRes('{}/{}_bbox_results.json'.format(resdir, generator.set_name))
@@ -6,34 +6,54 @@
 # --------------------------------------------------------
 
 cimport cython
+from cython cimport floating
+from cython.parallel cimport prange
 import numpy as np
-cimport numpy as np
 
 
-def compute_overlap(
-    np.ndarray[double, ndim=2] boxes,
-    np.ndarray[double, ndim=2] query_boxes
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def compute_overlap_fused(
+    const floating[:, ::1] boxes,
+    const floating[:, ::1] query_boxes
 ):
-    """
+    """ Compute the overlap (IoU) of every box with every query box, in parallel over the boxes.
+
+    Both arrays have to be C-contiguous and of the same floating point type (float32 or float64),
+    the overlaps are computed in that type without converting the inputs.
+
     Args
-        a: (N, 4) ndarray of float
-        b: (K, 4) ndarray of float
+        boxes       : (N, 4) ndarray of float32 or float64
+        query_boxes : (K, 4) ndarray of the same type
 
     Returns
-        overlaps: (N, K) ndarray of overlap between boxes and query_boxes
+        overlaps: (N, K) ndarray of overlap between boxes and query_boxes, of the type of the inputs
     """
-    cdef unsigned int N = boxes.shape[0]
-    cdef unsigned int K = query_boxes.shape[0]
-    cdef np.ndarray[double, ndim=2] overlaps = np.zeros((N, K), dtype=np.float64)
-    cdef double iw, ih, box_area
-    cdef double ua
-    cdef unsigned int k, n
+    cdef Py_ssize_t N = boxes.shape[0]
+    cdef Py_ssize_t K = query_boxes.shape[0]
+
+    dtype = np.float32 if floating is float else np.float64
+    overlaps_array = np.zeros((N, K), dtype=dtype)
+    query_areas_array = np.empty((K,), dtype=dtype)
+
+    cdef floating[:, ::1] overlaps = overlaps_array
+    cdef floating[::1] query_areas = query_areas_array
+    cdef floating iw, ih, box_area
+    cdef Py_ssize_t k, n
+
     for k in range(K):
-        box_area = (
+        query_areas[k] = (
             (query_boxes[k, 2] - query_boxes[k, 0] + 1) *
             (query_boxes[k, 3] - query_boxes[k, 1] + 1)
         )
-        for n in range(N):
+
+    for n in prange(N, nogil=True, schedule='static'):
+        box_area = (
+            (boxes[n, 2] - boxes[n, 0] + 1) *
+            (boxes[n, 3] - boxes[n, 1] + 1)
+        )
+        for k in range(K):
             iw = (
                 min(boxes[n, 2], query_boxes[k, 2]) -
                 max(boxes[n, 0], query_boxes[k, 0]) + 1
@@ -44,10 +64,124 @@ def compute_overlap(
                     max(boxes[n, 1], query_boxes[k, 1]) + 1
                 )
                 if ih > 0:
-                    ua = np.float64(
-                        (boxes[n, 2] - boxes[n, 0] + 1) *
-                        (boxes[n, 3] - boxes[n, 1] + 1) +
-                        box_area - iw * ih
-                    )
-                    overlaps[n, k] = iw * ih / ua
-    return overlaps
+                    overlaps[n, k] = iw * ih / (box_area + query_areas[k] - iw * ih)
+
+    return overlaps_array
+
+
+def compute_overlap(boxes, query_boxes):
+    """ Compatibility wrapper around compute_overlap_fused that accepts any (N, 4) and (K, 4) arrays.
+
+    Inputs that are already C-contiguous float32 (both) or float64 are used without a copy.
+
+    Args
+        a: (N, 4) ndarray of float
+        b: (K, 4) ndarray of float
+
+    Returns
+        overlaps: (N, K) ndarray of overlap between boxes and query_boxes
+    """
+    dtype = np.float32 if boxes.dtype == np.float32 and query_boxes.dtype == np.float32 else np.float64
+    return compute_overlap_fused(
+        np.ascontiguousarray(boxes, dtype=dtype),
+        np.ascontiguousarray(query_boxes, dtype=dtype)
+    )
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def compute_max_overlap_fused(
+    const floating[:, ::1] boxes,
+    const floating[:, ::1] query_boxes
+):
+    """ Compute the maximum overlap of every box over all query boxes without storing the (N, K) overlaps.
+
+    Boxes are processed in blocks in parallel. Ties resolve to the lowest index, like np.argmax on the overlap matrix.
+
+    Args
+        boxes       : (N, 4) ndarray of float32 or float64
+        query_boxes : (K, 4) ndarray of the same type
+
+    Returns
+        max_overlaps    : (N,) maximum overlap of every box, of the type of the inputs.
+        argmax_overlaps : (N,) index of the query box with the maximum overlap for every box.
+        best_boxes      : (K,) index of the box with the maximum overlap for every query box.
+    """
+    cdef Py_ssize_t N = boxes.shape[0]
+    cdef Py_ssize_t K = query_boxes.shape[0]
+    cdef Py_ssize_t num_blocks = min(N, 64) if K else 0
+    cdef Py_ssize_t block_size = (N + num_blocks - 1) // num_blocks if num_blocks else 0
+
+    dtype = np.float32 if floating is float else np.float64
+    max_overlaps_array    = np.zeros((N,), dtype=dtype)
+    argmax_overlaps_array = np.zeros((N,), dtype=np.int64)
+    query_areas_array     = np.empty((K,), dtype=dtype)
+    block_best_array      = np.zeros((num_blocks, K), dtype=dtype)
+    block_argmax_array    = np.zeros((num_blocks, K), dtype=np.int64)
+
+    cdef floating[::1] max_overlaps        = max_overlaps_array
+    cdef long long[::1] argmax_overlaps    = argmax_overlaps_array
+    cdef floating[::1] query_areas         = query_areas_array
+    cdef floating[:, ::1] block_best       = block_best_array
+    cdef long long[:, ::1] block_argmax    = block_argmax_array
+    cdef floating iw, ih, box_area, overlap
+    cdef Py_ssize_t k, n, b
+
+    for k in range(K):
+        query_areas[k] = (
+            (query_boxes[k, 2] - query_boxes[k, 0] + 1) *
+            (query_boxes[k, 3] - query_boxes[k, 1] + 1)
+        )
+
+    for b in prange(num_blocks, nogil=True, schedule='static'):
+        for k in range(K):
+            block_argmax[b, k] = b * block_size
+
+        for n in range(b * block_size, min(N, (b + 1) * block_size)):
+            box_area = (
+                (boxes[n, 2] - boxes[n, 0] + 1) *
+                (boxes[n, 3] - boxes[n, 1] + 1)
+            )
+            for k in range(K):
+                iw = (
+                    min(boxes[n, 2], query_boxes[k, 2]) -
+                    max(boxes[n, 0], query_boxes[k, 0]) + 1
+                )
+                if iw <= 0:
+                    continue
+                ih = (
+                    min(boxes[n, 3], query_boxes[k, 3]) -
+                    max(boxes[n, 1], query_boxes[k, 1]) + 1
+                )
+                if ih <= 0:
+                    continue
+
+                overlap = iw * ih / (box_area + query_areas[k] - iw * ih)
+                if overlap > max_overlaps[n]:
+                    max_overlaps[n]    = overlap
+                    argmax_overlaps[n] = k
+                if overlap > block_best[b, k]:
+                    block_best[b, k]   = overlap
+                    block_argmax[b, k] = n
+
+    # reduce the best boxes of the blocks, in order so the lowest index wins ties
+    best_boxes_array = np.zeros((K,), dtype=np.int64)
+    if num_blocks:
+        best = np.argmax(block_best_array, axis=0)
+        best_boxes_array = np.where(block_best_array.max(axis=0) > 0, block_argmax_array[best, np.arange(K)], 0)
+
+    return max_overlaps_array, argmax_overlaps_array, best_boxes_array
+
+
+def compute_max_overlap(boxes, query_boxes):
+    """ Compatibility wrapper around compute_max_overlap_fused that accepts any (N, 4) and (K, 4) arrays.
+
+    Returns
+        max_overlaps, argmax_overlaps, best_boxes: see compute_max_overlap_fused.
+    """
+    dtype = np.float32 if boxes.dtype == np.float32 and query_boxes.dtype == np.float32 else np.float64
+    return compute_max_overlap_fused(
+        np.ascontiguousarray(boxes, dtype=dtype),
+        np.ascontiguousarray(query_boxes, dtype=dtype)
+    )
@@ -16,7 +16,8 @@ limitations under the License.
 
 from __future__ import print_function
 
-from .anchors import compute_overlap
+from .overlap import compute_overlap
+from .image import preprocess_image_uint8
 from .visualization import draw_detections, draw_annotations
 
 import keras
@@ -72,9 +73,12 @@ def _get_detections(generator, model, score_threshold=0.05, max_detections=100,
     """
     all_detections = [[None for i in range(generator.num_classes())] for j in range(generator.size())]
 
+    # models built with uint8_inputs normalize the images themselves
+    uint8_inputs = keras.backend.dtype(model.inputs[0]) == 'uint8'
+
     for i in range(generator.size()):
         raw_image    = generator.load_image(i)
-        image        = generator.preprocess_image(raw_image.copy())
+        image        = preprocess_image_uint8(raw_image) if uint8_inputs else generator.preprocess_image(raw_image.copy())
         image, scale = generator.resize_image(image)
 
         if keras.backend.image_data_format() == 'channels_first':
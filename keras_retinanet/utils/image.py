@@ -20,7 +20,7 @@ import numpy as np
 import cv2
 from PIL import Image
 
-from .transform import change_transform_origin
+from .transform import change_transform_origin, classify_transform
 
 
 def read_image_bgr(path):
@@ -33,6 +33,30 @@ def read_image_bgr(path):
     return image[:, :, ::-1].copy()
 
 
+def read_image_bgr_reduced(path, scale):
+    """ Read an image in BGR format, at a reduced resolution if it is going to be resized with scale.
+
+    JPEG images are decoded in the DCT domain at 1/2, 1/4 or 1/8 of their resolution, picking the largest
+    reduction for which the image is still at least as large as after resizing. Other images are read at full resolution.
+
+    Args
+        path  : Path to the image.
+        scale : The scale the image is going to be resized with.
+
+    Returns
+        image, scale: the image and its scale w.r.t. the full resolution image.
+    """
+    image      = Image.open(path)
+    full_width = image.size[0]
+    if scale < 0.5 and image.format == 'JPEG':
+        image.draft('RGB', (int(np.ceil(image.size[0] * scale)), int(np.ceil(image.size[1] * scale))))
+
+    # reduced JPEG images are rounded up to whole pixels, the reduction itself is a power of two
+    reduction = int(round(float(full_width) / image.size[0]))
+    image     = np.asarray(image.convert('RGB'))
+    return image[:, :, ::-1].copy(), 1.0 / reduction
+
+
 def read_image_rgb(path):
     """ Read an image in BGR format.
 
@@ -69,6 +93,18 @@ def preprocess_image(x, mode='caffe'):
     return x
 
 
+def preprocess_image_uint8(x):
+    """ Keep an image as uint8, for models that normalize their inputs in-graph (see layers.Normalize).
+
+    Args
+        x: np.array of shape (None, None, 3) or (3, None, None).
+
+    Returns
+        The input as uint8.
+    """
+    return np.asarray(x, dtype=np.uint8)
+
+
 def adjust_transform_for_image(transform, image, relative_translation):
     """ Adjust a transformation for a specific image.
 
@@ -134,7 +170,19 @@ class TransformParameters:
             return cv2.INTER_LANCZOS4
 
 
-def apply_transform(matrix, image, params):
+def _translate_image(image, tx, ty, params):
+    """ Translate an image by a whole number of pixels, filling the border like cv2.warpAffine would.
+    """
+    top, bottom = max(ty, 0), max(-ty, 0)
+    left, right = max(tx, 0), max(-tx, 0)
+
+    padded = cv2.copyMakeBorder(image, top, bottom, left, right, params.cvBorderMode(), value=params.cval)
+    if padded.ndim < image.ndim:
+        padded = padded[..., np.newaxis]
+    return padded[bottom:bottom + image.shape[0], right:right + image.shape[1]]
+
+
+def apply_transform(matrix, image, params, output_shape=None):
     """
     Apply a transformation to an image.
 
@@ -143,15 +191,34 @@ def apply_transform(matrix, image, params):
     The matrix is interpreted such that a point (x, y) on the original image is moved to transform * (x, y) in the generated image.
     Mathematically speaking, that means that the matrix is a transformation from the transformed image space to the original image space.
 
+    Identity transformations return a copy of the image, flips and whole pixel translations are done
+    without interpolation (see classify_transform). The input can be a read-only cached or memory-mapped image,
+    so the result never shares its memory.
+
     Args
-      matrix: A homogeneous 3 by 3 matrix holding representing the transformation to apply.
-      image:  The image to transform.
-      params: The transform parameters (see TransformParameters)
+      matrix:       A homogeneous 3 by 3 matrix holding representing the transformation to apply.
+      image:        The image to transform.
+      params:       The transform parameters (see TransformParameters)
+      output_shape: The (rows, cols) of the output image (defaults to the shape of the input image).
     """
+    rows, cols = output_shape if output_shape is not None else image.shape[:2]
+
+    if (rows, cols) == image.shape[:2]:
+        kind = classify_transform(matrix, image.shape)
+        if kind == 'identity':
+            return image.copy()
+        if kind == 'flip':
+            # cv2.flip is several times faster than copying a reversed view, it drops a single channel axis though
+            flip_x, flip_y = matrix[0, 0] < 0, matrix[1, 1] < 0
+            flip_code      = (-1 if flip_x else 0) if flip_y else 1
+            return cv2.flip(np.ascontiguousarray(image), flip_code).reshape(image.shape)
+        if kind == 'translation':
+            return _translate_image(image, int(round(matrix[0, 2])), int(round(matrix[1, 2])), params)
+
     output = cv2.warpAffine(
         image,
         matrix[:2, :],
-        dsize       = (image.shape[1], image.shape[0]),
+        dsize       = (cols, rows),
         flags       = params.cvInterpolation(),
         borderMode  = params.cvBorderMode(),
         borderValue = params.cval,
@@ -159,17 +226,18 @@ def apply_transform(matrix, image, params):
     return output
 
 
-def resize_image(img, min_side=800, max_side=1333):
-    """ Resize an image such that the size is constrained to min_side and max_side.
+def compute_resize_scale(image_shape, min_side=800, max_side=1333):
+    """ Compute the scale with which an image of image_shape is resized.
 
     Args
+        image_shape: The shape of the image (rows, cols, ...).
         min_side: The image's min side will be equal to min_side after resizing.
         max_side: If after resizing the image's max side is above max_side, resize until the max side is equal to max_side.
 
     Returns
-        A resized image.
+        The scale factor for both dimensions.
     """
-    (rows, cols, _) = img.shape
+    (rows, cols) = image_shape[:2]
 
     smallest_side = min(rows, cols)
 
@@ -182,6 +250,22 @@ def resize_image(img, min_side=800, max_side=1333):
     if largest_side * scale > max_side:
         scale = max_side / largest_side
 
+    return scale
+
+
+def resize_image(img, min_side=800, max_side=1333):
+    """ Resize an image such that the size is constrained to min_side and max_side.
+
+    Args
+        min_side: The image's min side will be equal to min_side after resizing.
+        max_side: If after resizing the image's max side is above max_side, resize until the max side is equal to max_side.
+
+    Returns
+        A resized image.
+    """
+    # compute scale to resize the image
+    scale = compute_resize_scale(img.shape, min_side=min_side, max_side=max_side)
+
     # resize the image with the computed scale
     img = cv2.resize(img, None, fx=scale, fy=scale)
 
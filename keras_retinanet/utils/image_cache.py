@@ -0,0 +1,175 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import threading
+
+import cv2
+import numpy as np
+
+from .image import compute_resize_scale
+
+
+class LRUCache(object):
+    """ Least recently used cache with a budget in bytes.
+
+    Args
+        max_bytes : The maximum number of bytes held by the cache.
+        sizeof    : Function returning the size in bytes of a value (defaults to value.nbytes).
+    """
+    def __init__(self, max_bytes, sizeof=None):
+        self.max_bytes = max_bytes
+        self.sizeof    = sizeof or (lambda value: value.nbytes)
+        self.entries   = OrderedDict()
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.lock      = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """ Get the value for key, or None if it is not cached.
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries[key] = self.entries.pop(key)  # mark as most recently used
+            return value
+
+    def put(self, key, value):
+        """ Insert a value and return the list of (key, value) pairs that were evicted to make room for it.
+        """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return [(key, value)]
+
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.sizeof(self.entries.pop(key))
+
+            while self.nbytes + size > self.max_bytes:
+                old_key, old_value = self.entries.popitem(last=False)
+                self.nbytes    -= self.sizeof(old_value)
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+
+            self.entries[key] = value
+            self.nbytes      += size
+
+        return evicted
+
+    def stats(self):
+        """ Dictionary with the counters of the cache.
+        """
+        return {
+            'entries'   : len(self.entries),
+            'bytes'     : self.nbytes,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions,
+        }
+
+
+class ImageCache(object):
+    """ Two-tier cache for decoded images.
+
+    The first tier holds decoded uint8 arrays as returned by `Generator.load_image`.
+    The optional second tier holds images evicted from the first tier, re-encoded at the resolution they will be resized to.
+    Images from the second tier are returned together with the scale they were stored at.
+
+    Each process has its own cache, so with multiprocessing workers the budget applies per worker.
+
+    Args
+        max_bytes         : Budget of the decoded tier in bytes.
+        max_encoded_bytes : Budget of the encoded tier in bytes (0 disables the tier).
+        min_side          : The min side images are resized to by the generator.
+        max_side          : The max side images are resized to by the generator.
+        encoding          : Extension of the format used for the encoded tier (see cv2.imencode).
+    """
+    def __init__(
+        self,
+        max_bytes,
+        max_encoded_bytes = 0,
+        min_side          = 800,
+        max_side          = 1333,
+        encoding          = '.png',
+    ):
+        self.decoded  = LRUCache(max_bytes)
+        self.encoded  = LRUCache(max_encoded_bytes, sizeof=lambda value: value[0].nbytes) if max_encoded_bytes else None
+        self.min_side = min_side
+        self.max_side = max_side
+        self.encoding = encoding
+
+    def encode(self, image):
+        """ Encode an image at its target resolution, returns (encoded bytes, scale).
+        """
+        scale = compute_resize_scale(image.shape, min_side=self.min_side, max_side=self.max_side)
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+
+        success, encoded = cv2.imencode(self.encoding, image)
+        if not success:
+            raise ValueError('could not encode image with \'{}\''.format(self.encoding))
+        return encoded, scale
+
+    def get(self, key, load):
+        """ Get the image for key, calling load() on a miss.
+
+        Returns
+            image, scale: the (read-only) image and the scale of the image w.r.t. the image returned by load().
+        """
+        image = self.decoded.get(key)
+        if image is not None:
+            return image, 1.0
+
+        if self.encoded is not None:
+            value = self.encoded.get(key)
+            if value is not None:
+                encoded, scale = value
+                return cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED), scale
+
+        image = np.ascontiguousarray(load())
+        image.flags.writeable = False
+        self.put(key, image)
+        return image, 1.0
+
+    def put(self, key, image):
+        """ Insert a decoded image, demoting evicted images to the encoded tier.
+        """
+        evicted = self.decoded.put(key, image)
+        if self.encoded is None:
+            return
+
+        for evicted_key, evicted_image in evicted:
+            self.encoded.put(evicted_key, self.encode(evicted_image))
+
+    def stats(self):
+        """ Dictionary with the counters of both tiers.
+        """
+        result = {'decoded': self.decoded.stats()}
+        if self.encoded is not None:
+            result['encoded'] = self.encoded.stats()
+        return result
@@ -0,0 +1,156 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from multiprocessing.pool import ThreadPool
+import os
+import tempfile
+import warnings
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+# Python 2 only knows zipfile.BadZipfile
+_BadZipFile = getattr(zipfile, 'BadZipFile', getattr(zipfile, 'BadZipfile', None))
+
+
+def read_image_size(path):
+    """ Read the size of an image from its header, without decoding it.
+
+    Args
+        path: Path to the image.
+
+    Returns
+        The size of the image as (rows, cols).
+    """
+    with Image.open(path) as image:
+        return image.height, image.width
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def _ignoring_errors(function, default):
+    """ Wrap function to return default instead of raising.
+    """
+    def wrapped(path):
+        try:
+            return function(path)
+        except Exception:
+            return default
+    return wrapped
+
+
+def load_npz(path, keys=None, name='index'):
+    """ Load the arrays of a stored .npz file, returns None if there is none or it can't be read.
+
+    Args
+        path : Path of the .npz file (None to not load anything).
+        keys : Arrays the file must hold (None to load all of them). A file missing one of them is ignored.
+        name : Description of the file, used in the warning about an unreadable file.
+
+    Returns
+        A dict mapping the keys to arrays, or None.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            return {key: data[key] for key in (data.files if keys is None else keys)}
+    except (IOError, OSError, KeyError, ValueError, _BadZipFile) as e:
+        warnings.warn('Ignoring unreadable {} {}: {}'.format(name, path, e))
+        return None
+
+
+def save_npz(path, arrays, name='index'):
+    """ Store arrays in a .npz file atomically, warn if that is not possible (for example on a read-only dataset).
+
+    The arrays are written to a unique temporary file next to path first, so concurrent writers don't corrupt each other's file.
+
+    Args
+        path   : Path of the .npz file.
+        arrays : Dict mapping names to arrays.
+        name   : Description of the file, used in the warning about a failed write.
+    """
+    temp_path = None
+    try:
+        handle, temp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, **arrays)
+        # mkstemp creates files only readable by their owner
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, path)
+    except (IOError, OSError) as e:
+        warnings.warn('Could not store {} {}: {}'.format(name, path, e))
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def image_sizes(paths, index_path=None, workers=16, ignore_errors=False):
+    """ Get the sizes of a list of images, using a persistent index of header-only scans.
+
+    An entry of the index is reused as long as the modification time and the file size of its image match.
+    All other images are scanned in parallel and the index is updated.
+
+    Args
+        paths         : List of image paths.
+        index_path    : Path of the .npz file holding the index (None to not persist the index).
+        workers       : Number of threads used to stat and scan the images.
+        ignore_errors : If True, images that can't be read get size (-1, -1) instead of raising.
+
+    Returns
+        np.array of shape (len(paths), 2) holding (rows, cols) per image.
+    """
+    stat = _ignoring_errors(_stat, (np.nan, -1)) if ignore_errors else _stat
+    read = _ignoring_errors(read_image_size, (-1, -1)) if ignore_errors else read_image_size
+
+    paths = [str(path) for path in paths]
+    sizes = np.full((len(paths), 2), -1, dtype=np.int64)
+
+    pool = ThreadPool(workers)
+    try:
+        stats      = pool.map(stat, paths, chunksize=64) if paths else []
+        mtimes     = np.array([stat[0] for stat in stats], dtype=np.float64)
+        file_sizes = np.array([stat[1] for stat in stats], dtype=np.int64)
+
+        # reuse entries of images that didn't change
+        index = load_npz(index_path, keys=['paths', 'sizes', 'mtimes', 'file_sizes'], name='image size index')
+        if index is not None:
+            positions = dict((path, position) for position, path in enumerate(index['paths']))
+            for i, path in enumerate(paths):
+                position = positions.get(path)
+                if position is not None and index['mtimes'][position] == mtimes[i] and index['file_sizes'][position] == file_sizes[i]:
+                    sizes[i] = index['sizes'][position]
+
+        # scan the remaining images
+        missing = np.flatnonzero(sizes[:, 0] < 0)
+        if len(missing):
+            sizes[missing] = pool.map(read, [paths[i] for i in missing], chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+    if index_path is not None and (len(missing) or index is None or len(index['paths']) != len(paths)):
+        save_npz(index_path, {
+            'paths'      : np.array(paths),
+            'sizes'      : sizes,
+            'mtimes'     : mtimes,
+            'file_sizes' : file_sizes,
+        }, name='image size index')
+
+    return sizes
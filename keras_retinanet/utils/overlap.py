@@ -0,0 +1,121 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import warnings
+
+import numpy as np
+
+# maximum number of bytes of the temporary arrays of a chunk of the NumPy implementation
+MAX_CHUNK_BYTES = 2 ** 25
+
+
+def _chunks(num_boxes, num_query_boxes, itemsize, max_chunk_bytes):
+    """ Slices over the boxes such that the temporaries of a chunk (about 8 arrays of (rows, K)) stay within max_chunk_bytes.
+    """
+    rows = max(1, max_chunk_bytes // max(1, 8 * num_query_boxes * itemsize))
+    for start in range(0, num_boxes, rows):
+        yield slice(start, min(num_boxes, start + rows))
+
+
+def _overlap_chunk(boxes, query_boxes, query_areas):
+    """ Overlap of a chunk of boxes with all query boxes, with the same arithmetic as the compute_overlap extension.
+    """
+    iw = np.minimum(boxes[:, None, 2], query_boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], query_boxes[None, :, 0]) + 1
+    ih = np.minimum(boxes[:, None, 3], query_boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], query_boxes[None, :, 1]) + 1
+
+    box_areas    = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    intersection = iw * ih
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlaps = intersection / (box_areas[:, None] + query_areas[None, :] - intersection)
+    overlaps[(iw <= 0) | (ih <= 0)] = 0
+    return overlaps
+
+
+def _prepare(boxes, query_boxes):
+    """ Convert boxes and query boxes to the type the overlaps are computed in, like the compute_overlap extension.
+    """
+    boxes       = np.asarray(boxes)
+    query_boxes = np.asarray(query_boxes)
+    dtype       = np.float32 if boxes.dtype == np.float32 and query_boxes.dtype == np.float32 else np.float64
+    boxes       = np.asarray(boxes, dtype=dtype)
+    query_boxes = np.asarray(query_boxes, dtype=dtype)
+    query_areas = (query_boxes[:, 2] - query_boxes[:, 0] + 1) * (query_boxes[:, 3] - query_boxes[:, 1] + 1)
+    return boxes, query_boxes, query_areas
+
+
+def compute_overlap_numpy(boxes, query_boxes, max_chunk_bytes=MAX_CHUNK_BYTES):
+    """ NumPy implementation of compute_overlap, processing the boxes in chunks to bound the temporary memory.
+
+    Args
+        boxes           : (N, 4) ndarray of float
+        query_boxes     : (K, 4) ndarray of float
+        max_chunk_bytes : Maximum number of bytes of the temporary arrays of a chunk.
+
+    Returns
+        overlaps: (N, K) ndarray of overlap between boxes and query_boxes
+    """
+    boxes, query_boxes, query_areas = _prepare(boxes, query_boxes)
+
+    overlaps = np.zeros((boxes.shape[0], query_boxes.shape[0]), dtype=boxes.dtype)
+    if query_boxes.shape[0]:
+        for chunk in _chunks(boxes.shape[0], query_boxes.shape[0], boxes.itemsize, max_chunk_bytes):
+            overlaps[chunk] = _overlap_chunk(boxes[chunk], query_boxes, query_areas)
+
+    return overlaps
+
+
+def compute_max_overlap_numpy(boxes, query_boxes, max_chunk_bytes=MAX_CHUNK_BYTES):
+    """ NumPy implementation of compute_max_overlap, processing the boxes in chunks so the (N, K) overlaps are never stored.
+
+    Args
+        boxes           : (N, 4) ndarray of float
+        query_boxes     : (K, 4) ndarray of float
+        max_chunk_bytes : Maximum number of bytes of the temporary arrays of a chunk.
+
+    Returns
+        max_overlaps, argmax_overlaps, best_boxes: see compute_max_overlap.
+    """
+    boxes, query_boxes, query_areas = _prepare(boxes, query_boxes)
+
+    max_overlaps    = np.zeros((boxes.shape[0],), dtype=boxes.dtype)
+    argmax_overlaps = np.zeros((boxes.shape[0],), dtype=np.int64)
+    best_overlaps   = np.zeros((query_boxes.shape[0],), dtype=boxes.dtype)
+    best_boxes      = np.zeros((query_boxes.shape[0],), dtype=np.int64)
+    if not query_boxes.shape[0]:
+        return max_overlaps, argmax_overlaps, best_boxes
+
+    for chunk in _chunks(boxes.shape[0], query_boxes.shape[0], boxes.itemsize, max_chunk_bytes):
+        overlaps = _overlap_chunk(boxes[chunk], query_boxes, query_areas)
+
+        argmax_overlaps[chunk] = np.argmax(overlaps, axis=1)
+        max_overlaps[chunk]    = overlaps[np.arange(overlaps.shape[0]), argmax_overlaps[chunk]]
+
+        # earlier chunks win ties, like np.argmax on the whole matrix
+        chunk_best          = np.argmax(overlaps, axis=0)
+        chunk_best_overlaps = overlaps[chunk_best, np.arange(overlaps.shape[1])]
+        better              = chunk_best_overlaps > best_overlaps
+        best_overlaps[better] = chunk_best_overlaps[better]
+        best_boxes[better]    = chunk.start + chunk_best[better]
+
+    return max_overlaps, argmax_overlaps, best_boxes
+
+
+try:
+    from .compute_overlap import compute_max_overlap, compute_overlap  # noqa: F401
+except ImportError:
+    warnings.warn('The compute_overlap extension is not built, using a slower NumPy implementation (run "python setup.py build_ext --inplace").')
+    compute_overlap     = compute_overlap_numpy
+    compute_max_overlap = compute_max_overlap_numpy
@@ -0,0 +1,160 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cv2
+import numpy as np
+
+
+def _uniform(value_range, prng):
+    """ Draw a value from (min, max), or return the value if the range is a single value.
+    """
+    value_range = np.atleast_1d(value_range)
+    if len(value_range) == 1:
+        return float(value_range[0])
+    return prng.uniform(value_range[0], value_range[-1])
+
+
+def add_gaussian_noise(image, scale, prng, per_channel=False):
+    """ Add gaussian noise to a uint8 image, saturating at 0 and 255.
+
+    Args
+        image       : uint8 image of shape (rows, cols, channels).
+        scale       : Standard deviation of the noise.
+        prng        : PRNG the noise is seeded from.
+        per_channel : If True, draw separate noise for every channel instead of the same noise for all channels.
+    """
+    noise = np.empty(image.shape[:2] + ((image.shape[2],) if per_channel else (1,)), dtype=np.int16)
+    cv2.setRNGSeed(int(prng.randint(0, 2 ** 31 - 1)))
+    cv2.randn(noise.reshape(noise.shape[0], -1), 0, scale)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def gaussian_blur(image, sigma):
+    """ Blur a uint8 image with a (separable) gaussian kernel of standard deviation sigma.
+    """
+    if sigma < 0.01:
+        return image
+    return cv2.GaussianBlur(image, (0, 0), sigma)
+
+
+def add_hue_saturation(image, value):
+    """ Shift the hue and saturation of a uint8 BGR image with lookup tables in HSV space.
+
+    Args
+        image : uint8 BGR image of shape (rows, cols, 3).
+        value : Value in [-255, 255] added to the saturation, the hue is rotated by value / 255 * 180 degrees.
+    """
+    value = int(round(value))
+    if value == 0:
+        return image
+
+    identity = np.arange(256)
+    lut      = np.stack([
+        np.mod(identity + int(round(value * 90.0 / 255.0)), 180),  # OpenCV stores hue as degrees / 2
+        np.clip(identity + value, 0, 255),
+        identity,
+    ], axis=-1).astype(np.uint8).reshape(256, 1, 3)
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    hsv = cv2.LUT(hsv, lut)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def sharpen(image, alpha, lightness=1.0):
+    """ Sharpen a uint8 image, blending the image with its sharpened version by alpha.
+    """
+    if alpha <= 0:
+        return image
+    kernel = np.full((3, 3), -1.0, dtype=np.float32)
+    kernel[1, 1] = 8 + lightness
+    kernel = alpha * kernel
+    kernel[1, 1] += 1 - alpha
+    return cv2.filter2D(image, -1, kernel)
+
+
+class PhotometricAugmentation(object):
+    """ Random photometric augmentation of uint8 images, in NumPy and OpenCV.
+
+    Every operation is applied with its own chance, in a random order per image.
+    All randomness is drawn from the PRNG passed on every call, which makes the result reproducible per image.
+
+    Args
+        noise_chance      : Chance of adding gaussian noise.
+        noise_scale       : Standard deviation of the noise.
+        noise_per_channel : Chance of drawing separate noise for every channel.
+        blur_chance       : Chance of a gaussian blur.
+        blur_sigma        : (min, max) standard deviation of the blur, or a single value.
+        hue_sat_chance    : Chance of shifting hue and saturation.
+        hue_sat           : Maximum value of the shift (see add_hue_saturation).
+        sharpen_chance    : Chance of sharpening.
+        sharpen_alpha     : (min, max) blend factor of the sharpening, or a single value.
+    """
+    def __init__(
+        self,
+        noise_chance      = 0.0,
+        noise_scale       = 0.05 * 255,
+        noise_per_channel = 0.25,
+        blur_chance       = 0.0,
+        blur_sigma        = (0.0, 2.0),
+        hue_sat_chance    = 0.0,
+        hue_sat           = 30.0,
+        sharpen_chance    = 0.0,
+        sharpen_alpha     = (0.0, 1.0),
+    ):
+        self.noise_chance      = noise_chance
+        self.noise_scale       = noise_scale
+        self.noise_per_channel = noise_per_channel
+        self.blur_chance       = blur_chance
+        self.blur_sigma        = blur_sigma
+        self.hue_sat_chance    = hue_sat_chance
+        self.hue_sat           = hue_sat
+        self.sharpen_chance    = sharpen_chance
+        self.sharpen_alpha     = sharpen_alpha
+
+    def noise(self, image, prng):
+        return add_gaussian_noise(image, self.noise_scale, prng, per_channel=prng.uniform() < self.noise_per_channel)
+
+    def blur(self, image, prng):
+        return gaussian_blur(image, _uniform(self.blur_sigma, prng))
+
+    def hue_saturation(self, image, prng):
+        return add_hue_saturation(image, prng.uniform(-self.hue_sat, self.hue_sat))
+
+    def sharpen(self, image, prng):
+        return sharpen(image, _uniform(self.sharpen_alpha, prng))
+
+    def __call__(self, image, prng=None):
+        """ Augment a uint8 image of shape (rows, cols, channels) with randomness drawn from prng.
+        """
+        if prng is None:
+            prng = np.random
+
+        operations = [
+            (self.noise_chance,   self.noise),
+            (self.blur_chance,    self.blur),
+            (self.hue_sat_chance, self.hue_saturation),
+            (self.sharpen_chance, self.sharpen),
+        ]
+
+        # draw all decisions first, so the number of draws doesn't depend on the image
+        order   = prng.permutation(len(operations))
+        applied = prng.uniform(size=len(operations))
+        for index in order:
+            chance, operation = operations[index]
+            if applied[index] < chance:
+                image = operation(image, prng)
+
+        return image
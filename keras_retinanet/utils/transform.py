@@ -54,6 +54,33 @@ def transform_aabb(transform, aabb):
     return [min_corner[0], min_corner[1], max_corner[0], max_corner[1]]
 
 
+def transform_aabbs(transform, boxes):
+    """ Apply a transformation to a set of axis aligned bounding boxes.
+
+    Vectorized version of transform_aabb, all corners of all boxes are transformed with one matrix product.
+
+    Args
+        transform: The transformation to apply.
+        boxes:     np.array of shape (K, 4) holding (x1, y1, x2, y2) per box.
+    Returns
+        The new AABBs as np.array of shape (K, 4).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+
+    # All 4 corners of all AABBs as homogeneous points, shape (3, 4 * K).
+    points = np.ones((3, 4, boxes.shape[0]))
+    points[0] = [x1, x2, x1, x2]
+    points[1] = [y1, y2, y2, y1]
+    points = np.asarray(transform).dot(points.reshape(3, -1)).reshape(3, 4, boxes.shape[0])
+
+    # Extract the min and max corners again.
+    min_corner = points[:2].min(axis=1)
+    max_corner = points[:2].max(axis=1)
+
+    return np.concatenate([min_corner, max_corner]).T
+
+
 def _random_vector(min, max, prng=DEFAULT_PRNG):
     """ Construct a random vector between min and max.
     Args
@@ -186,6 +213,42 @@ def random_flip(flip_x_chance, flip_y_chance, prng=DEFAULT_PRNG):
     return scaling((1 - 2 * flip_x, 1 - 2 * flip_y))
 
 
+def classify_transform(transform, shape, eps=1e-6):
+    """ Classify a transformation of an image, to find transformations that don't need interpolation.
+    Args
+        transform: the homogeneous 3 by 3 transformation matrix.
+        shape:     the shape (rows, cols, ...) of the image that is transformed.
+        eps:       the tolerance for comparing matrix entries.
+    Returns
+        one of
+        - 'identity'    : the transformation does nothing.
+        - 'flip'        : the transformation flips the image along X and/or Y, mapping the image onto itself.
+        - 'translation' : the transformation translates the image by a whole number of pixels, less than the image size.
+        - 'affine'      : any other transformation.
+    """
+    rows, cols = shape[:2]
+    linear     = transform[:2, :2]
+    offset     = transform[:2, 2]
+
+    if np.any(np.abs(transform[2] - [0, 0, 1]) > eps):
+        return 'affine'
+    if np.any(np.abs(linear - np.diag(np.diag(linear))) > eps) or np.any(np.abs(np.abs(np.diag(linear)) - 1) > eps):
+        return 'affine'
+
+    flipped = np.diag(linear) < 0
+    if not np.any(flipped):
+        if np.all(np.abs(offset) <= eps):
+            return 'identity'
+        if np.all(np.abs(offset - np.round(offset)) <= eps) and np.all(np.abs(offset) < [cols, rows]):
+            return 'translation'
+        return 'affine'
+
+    # a flip maps x to size - x, so only a translation by the size of the image maps the image onto itself
+    if np.all(np.abs(offset - flipped * [cols, rows]) <= eps):
+        return 'flip'
+    return 'affine'
+
+
 def change_transform_origin(transform, center):
     """ Create a new transform representing the same transformation,
         only with the origin of the linear part changed.
@@ -279,6 +342,8 @@ def random_transform_generator(prng=None, **kwargs):
         flip_x_chance:   The chance (0 to 1) that a transform will contain a flip along X direction.
         flip_y_chance:   The chance (0 to 1) that a transform will contain a flip along Y direction.
         prng:            The pseudo-random number generator to use.
+
+    A different PRNG can be passed with `send(prng)`, the transformation it returns (and all subsequent ones) is drawn from that PRNG.
     """
 
     if prng is None:
@@ -286,4 +351,6 @@ def random_transform_generator(prng=None, **kwargs):
         prng = np.random.RandomState()
 
     while True:
-        yield random_transform(prng=prng, **kwargs)
+        new_prng = yield random_transform(prng=prng, **kwargs)
+        if new_prng is not None:
+            prng = new_prng
@@ -1,12 +1,25 @@
+import os
+import sys
+
 import setuptools
 from setuptools.extension import Extension
 import numpy as np
 
+# compute_overlap runs in parallel with OpenMP, Apple clang doesn't ship it (set KERAS_RETINANET_OPENMP=0 to build without)
+if os.environ.get('KERAS_RETINANET_OPENMP', '0' if sys.platform == 'darwin' else '1') == '0':
+    openmp_args = []
+elif sys.platform == 'win32':
+    openmp_args = ['/openmp']
+else:
+    openmp_args = ['-fopenmp']
+
 extensions = [
     Extension(
         'keras_retinanet.utils.compute_overlap',
         ['keras_retinanet/utils/compute_overlap.pyx'],
-        include_dirs=[np.get_include()]
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmp_args,
+        extra_link_args=[] if sys.platform == 'win32' else openmp_args,
     ),
 ]
 
@@ -27,6 +40,7 @@ setuptools.setup(
             'retinanet-evaluate=keras_retinanet.bin.evaluate:main',
             'retinanet-debug=keras_retinanet.bin.debug:main',
             'retinanet-convert-model=keras_retinanet.bin.convert_model:main',
+            'retinanet-pack=keras_retinanet.bin.pack:main',
         ],
     },
     ext_modules    = extensions,
@@ -0,0 +1,40 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import timeit
+
+import pytest
+
+# benchmarks are slow, they only run if this environment variable is set, e.g.:
+#   KERAS_RETINANET_BENCHMARK=1 py.test -s tests -k benchmark
+benchmark = pytest.mark.skipif(not os.environ.get('KERAS_RETINANET_BENCHMARK'), reason='set KERAS_RETINANET_BENCHMARK=1 to run benchmarks')
+
+
+def measure(name, function, repeat=3):
+    """ Print and return the best time of a number of calls to function.
+
+    Args
+        name     : Name of the benchmark, printed with the time.
+        function : Function without arguments to time.
+        repeat   : Number of calls, the fastest one is reported.
+
+    Returns
+        The time of the fastest call in seconds.
+    """
+    best = min(timeit.repeat(function, number=1, repeat=repeat))
+    print('{}: {:.2f} ms'.format(name, best * 1000))
+    return best
@@ -17,6 +17,8 @@ limitations under the License.
 import keras_retinanet.bin.train
 import keras.backend
 
+import glob
+import os
 import warnings
 
 import pytest
@@ -91,3 +93,66 @@ def test_vgg():
         'coco',
         'tests/test-data/coco',
     ])
+
+
+def test_resume_compact_targets(tmpdir):
+    # ignore warnings in this test
+    warnings.simplefilter('ignore')
+
+    # train a snapshot with the regular one-hot targets
+    keras_retinanet.bin.train.main([
+        '--epochs=1',
+        '--steps=1',
+        '--no-weights',
+        '--snapshot-path={}'.format(tmpdir),
+        'csv',
+        'tests/test-data/csv/annotations.csv',
+        'tests/test-data/csv/classes.csv',
+    ])
+    keras.backend.clear_session()
+    snapshots = glob.glob(os.path.join(str(tmpdir), '*', '*.h5'))
+    assert len(snapshots) == 1
+
+    # resume it with compact targets, which need the compact focal loss
+    keras_retinanet.bin.train.main([
+        '--epochs=1',
+        '--steps=1',
+        '--snapshot={}'.format(snapshots[0]),
+        '--no-snapshots',
+        '--compact-targets',
+        'csv',
+        'tests/test-data/csv/annotations.csv',
+        'tests/test-data/csv/classes.csv',
+    ])
+
+
+def test_resume_uint8_inputs_mismatch(tmpdir):
+    # ignore warnings in this test
+    warnings.simplefilter('ignore')
+
+    # train a snapshot that takes float inputs
+    keras_retinanet.bin.train.main([
+        '--epochs=1',
+        '--steps=1',
+        '--no-weights',
+        '--snapshot-path={}'.format(tmpdir),
+        'csv',
+        'tests/test-data/csv/annotations.csv',
+        'tests/test-data/csv/classes.csv',
+    ])
+    keras.backend.clear_session()
+    snapshots = glob.glob(os.path.join(str(tmpdir), '*', '*.h5'))
+    assert len(snapshots) == 1
+
+    # the generators would feed it raw uint8 pixels
+    with pytest.raises(ValueError):
+        keras_retinanet.bin.train.main([
+            '--epochs=1',
+            '--steps=1',
+            '--snapshot={}'.format(snapshots[0]),
+            '--no-snapshots',
+            '--uint8-inputs',
+            'csv',
+            'tests/test-data/csv/annotations.csv',
+            'tests/test-data/csv/classes.csv',
+        ])
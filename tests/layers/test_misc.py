@@ -209,3 +209,75 @@ class TestRegressBoxes(object):
         ], dtype=keras.backend.floatx())
 
         np.testing.assert_array_almost_equal(actual, expected, decimal=2)
+
+
+class TestNormalize(object):
+    def test_simple(self):
+        from keras_retinanet.utils.image import preprocess_image
+
+        image = np.random.RandomState(0).randint(0, 255, size=(1, 4, 5, 3)).astype(np.uint8)
+
+        for mode in ['caffe', 'tf']:
+            normalize_layer = keras_retinanet.layers.Normalize(mode=mode)
+
+            normalized = normalize_layer.call(keras.backend.constant(image, dtype='uint8'))
+            normalized = keras.backend.eval(normalized)
+
+            np.testing.assert_almost_equal(normalized, preprocess_image(image, mode=mode), decimal=4)
+
+
+class TestAnchorTargets(object):
+    def _inputs(self):
+        from keras_retinanet.utils.anchors import anchors_for_shape
+
+        # the NumPy reference uses the same float32 anchors as the graph, anchors with their center on the image border
+        # would otherwise be outside the image in one and inside it in the other because of rounding
+        anchors           = anchors_for_shape((64, 96, 3)).astype(keras.backend.floatx())
+        image_group       = [np.zeros((64, 96, 3)), np.zeros((50, 80, 3)), np.zeros((64, 64, 3))]
+        annotations_group = [
+            np.array([[10, 10, 40, 40, 0], [50, 20, 90, 60, 2]], dtype=float),
+            np.zeros((0, 5)),
+            np.array([[0, 0, 63, 63, 1]], dtype=float),
+        ]
+
+        # annotations padded with label -1
+        annotations = np.zeros((3, 2, 5))
+        annotations[..., 4] = -1
+        for index, image_annotations in enumerate(annotations_group):
+            annotations[index, :image_annotations.shape[0]] = image_annotations
+
+        inputs = [
+            keras.backend.variable(np.tile(anchors[None], (3, 1, 1))),
+            keras.backend.variable(annotations.astype(keras.backend.floatx())),
+            keras.backend.variable(np.array([image.shape[:2] for image in image_group], dtype=keras.backend.floatx())),
+        ]
+        return anchors, image_group, annotations_group, inputs
+
+    def test_parity(self):
+        from keras_retinanet.utils.anchors import anchor_targets_bbox
+
+        anchors, image_group, annotations_group, inputs = self._inputs()
+        expected_labels, expected_regression, _ = anchor_targets_bbox(anchors, image_group, annotations_group, num_classes=3)
+
+        anchor_targets_layer = keras_retinanet.layers.AnchorTargets(num_classes=3)
+        regression, labels   = anchor_targets_layer.call(inputs)
+        regression, labels   = keras.backend.eval(regression), keras.backend.eval(labels)
+
+        np.testing.assert_array_equal(labels, expected_labels)
+        np.testing.assert_array_equal(regression[..., -1], expected_regression[..., -1])
+
+        # regression targets only matter for positive anchors
+        positives = regression[..., -1] == 1
+        assert positives.any()
+        np.testing.assert_array_almost_equal(regression[positives], expected_regression[positives], decimal=4)
+
+    def test_compact(self):
+        from keras_retinanet.utils.anchors import anchor_targets_bbox_batched
+
+        anchors, image_group, annotations_group, inputs = self._inputs()
+        expected_labels, _, _ = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3, compact=True)
+
+        anchor_targets_layer = keras_retinanet.layers.AnchorTargets(num_classes=3, compact=True)
+        _, labels = anchor_targets_layer.call(inputs)
+
+        np.testing.assert_array_equal(keras.backend.eval(labels), expected_labels)
@@ -0,0 +1,63 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras_retinanet.preprocessing.coco import CocoGenerator
+
+import json
+import numpy as np
+
+
+def _write_dataset(tmpdir):
+    dataset = {
+        'images': [
+            {'id': 7, 'file_name': 'a.jpg', 'height': 10, 'width': 20},
+            {'id': 3, 'file_name': 'b.jpg', 'height': 30, 'width': 15},
+            {'id': 5, 'file_name': 'c.jpg', 'height': 10, 'width': 10},
+        ],
+        'annotations': [
+            {'id': 1, 'image_id': 3, 'category_id': 9, 'bbox': [1, 2, 3, 4], 'iscrowd': 0},
+            {'id': 2, 'image_id': 7, 'category_id': 2, 'bbox': [0, 0, 5, 5], 'iscrowd': 0},
+            {'id': 3, 'image_id': 3, 'category_id': 2, 'bbox': [4, 4, 2, 2], 'iscrowd': 0},
+            {'id': 4, 'image_id': 3, 'category_id': 2, 'bbox': [4, 4, 2, 2], 'iscrowd': 1},
+            {'id': 5, 'image_id': 7, 'category_id': 9, 'bbox': [1, 1, 0.5, 3], 'iscrowd': 0},
+        ],
+        'categories': [
+            {'id': 9, 'name': 'dog'},
+            {'id': 2, 'name': 'cat'},
+        ],
+    }
+    tmpdir.mkdir('annotations').join('instances_test.json').write(json.dumps(dataset))
+
+
+def test_coco_index(tmpdir):
+    _write_dataset(tmpdir)
+
+    for _ in range(2):
+        generator = CocoGenerator(str(tmpdir), 'test', group_method='none')
+
+        assert generator.image_ids == [7, 3, 5]
+        assert generator.classes == {'cat': 0, 'dog': 1}
+        assert generator.label_to_coco_label(1) == 9
+        assert generator.image_aspect_ratio(1) == 0.5
+        assert generator.image_path(2) == str(tmpdir.join('images', 'test', 'c.jpg'))
+
+        # crowd annotations and annotations smaller than a pixel are left out
+        np.testing.assert_array_equal(generator.load_annotations(0), [[0, 0, 5, 5, 0]])
+        np.testing.assert_array_equal(generator.load_annotations(1), [[1, 2, 4, 6, 1], [4, 4, 6, 6, 0]])
+        assert generator.load_annotations(2).shape == (0, 5)
+
+        # the second iteration loads the stored index
+        assert tmpdir.join('annotations', 'instances_test.index.npz').check()
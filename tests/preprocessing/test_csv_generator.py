@@ -23,6 +23,8 @@ except ImportError:
 
 from keras_retinanet.preprocessing import csv_generator
 
+from ..benchmark import benchmark, measure
+
 
 def csv_str(string):
     if str == bytes:
@@ -213,3 +215,70 @@ def test_read_annotations_empty_image():
 
     # Check that lines without annotations don't clear earlier annotations.
     assert csv_generator._read_annotations(csv_str('a.png,0,1,2,3,a\na.png,,,,,'), {'a': 1}) == {'a.png': [annotation(0, 1,  2,  3, 'a')]}
+
+
+def test_read_annotations_columnar():
+    classes = {'a': 1, 'b': 2, 'c': 4, 'd': 10}
+    data = (
+        'a.png,0,1,2,3,a'   '\n'
+        'b.png,,,,,'        '\n'
+        'c.png,4,5,6,7,b'   '\n'
+        'a.png,8,9,10,11,c' '\n'
+        'b.png,,,,,'        '\n'
+        'c.png,1,2,3,4,d'   '\n'
+    )
+
+    # a chunk size of 2 makes images span multiple chunks
+    image_names, offsets, boxes, labels = csv_generator._read_annotations_columnar(csv_str(data), classes, chunk_size=2)
+    expected = csv_generator._read_annotations(csv_str(data), classes)
+
+    assert image_names == list(expected.keys())
+    for i, name in enumerate(image_names):
+        rows = [[a['x1'], a['y1'], a['x2'], a['y2']] for a in expected[name]]
+        assert boxes[offsets[i]:offsets[i + 1]].tolist() == rows
+        assert labels[offsets[i]:offsets[i + 1]].tolist() == [classes[a['class']] for a in expected[name]]
+
+
+def test_read_annotations_columnar_errors():
+    classes = {'a': 1}
+    for data in [
+        'a.png,0,1,2,3,a\na.png,1,2,3,a',
+        'a.png,0,1,2,3,a\nb.png,0,1,2,3,a\na.png,0,x,2,3,a',
+        'a.png,0,1,2,3,a\na.png,0,1,2,3,g',
+        'a.png,0,1,2,3,a\na.png,1,8,3,5,a',
+        'a.png,0,1,2,3,a\na.png,,1,,,',
+    ]:
+        with pytest.raises(ValueError) as expected:
+            csv_generator._read_annotations(csv_str(data), classes)
+        with pytest.raises(ValueError) as columnar:
+            csv_generator._read_annotations_columnar(csv_str(data), classes, chunk_size=2)
+        assert str(columnar.value) == str(expected.value)
+
+
+def test_read_annotations_columnar_error_line(monkeypatch):
+    # if the row by row parser accepts a row, the columnar error still reports its line
+    monkeypatch.setattr(csv_generator, '_read_annotations', lambda *args, **kwargs: None)
+    with pytest.raises(ValueError) as columnar:
+        csv_generator._read_annotations_columnar(csv_str('a.png,0,1,2,3,a\nb.png,0,1,2,3,a\na.png,0,1,2,3,g'), {'a': 1}, chunk_size=2)
+    assert str(columnar.value).startswith('line 3:')
+
+
+@benchmark
+def test_benchmark_read_annotations(tmpdir):
+    classes = {'class_{}'.format(i): i for i in range(100)}
+    data    = ''.join('img_{}.jpg,{},{},{},{},class_{}\n'.format(i // 8, i % 300, i % 200, i % 300 + 50, i % 200 + 40, i % 100) for i in range(500000))
+
+    measure('500000 rows, _read_annotations', lambda: csv_generator._read_annotations(csv_str(data), classes))
+    measure('500000 rows, _read_annotations_columnar', lambda: csv_generator._read_annotations_columnar(csv_str(data), classes))
+
+    # loading the generator, the first time fills the annotation cache
+    data_file  = tmpdir.join('annotations.csv')
+    class_file = tmpdir.join('classes.csv')
+    data_file.write(data)
+    class_file.write(''.join('{},{}\n'.format(name, label) for name, label in classes.items()))
+
+    def load():
+        return csv_generator.CSVGenerator(str(data_file), str(class_file), cache_annotations=True, group_method='none', shuffle_groups=False)
+
+    load()
+    measure('500000 rows, CSVGenerator with annotation cache', load)
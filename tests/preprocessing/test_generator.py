@@ -15,17 +15,18 @@ limitations under the License.
 """
 
 from keras_retinanet.preprocessing.generator import Generator
+from keras_retinanet.utils.buffer_pool import BufferPool
 
 import numpy as np
 import pytest
 
 
 class SimpleGenerator(Generator):
-    def __init__(self, annotations_group, num_classes=0, image=None):
+    def __init__(self, annotations_group, num_classes=0, image=None, **kwargs):
         self.annotations_group = annotations_group
         self.num_classes_      = num_classes
         self.image             = image
-        super(SimpleGenerator, self).__init__(group_method='none', shuffle_groups=False)
+        super(SimpleGenerator, self).__init__(group_method='none', shuffle_groups=False, **kwargs)
 
     def num_classes(self):
         return self.num_classes_
@@ -178,3 +179,150 @@ class TestFilterAnnotations(object):
         # test that only object with class 0 is present in labels_batch
         labels = np.unique(np.argmax(labels_batch == 1, axis=2))
         assert(len(labels) == 1 and labels[0] == 0), 'Expected only class 0 to be present, but got classes {}'.format(labels)
+
+
+class TestSequence(object):
+    def test_epoch_order(self):
+        input_annotations_group = [np.zeros((0, 5)) for _ in range(10)]
+
+        simple_generator = SimpleGenerator(input_annotations_group)
+        assert len(simple_generator) == 10
+        np.testing.assert_equal(simple_generator.group_order, np.arange(10))
+
+        simple_generator.shuffle_groups = True
+        order = simple_generator.epoch_order(1)
+        np.testing.assert_equal(np.sort(order), np.arange(10))
+        np.testing.assert_equal(order, simple_generator.epoch_order(1))
+
+    def test_group_prng(self):
+        simple_generator = SimpleGenerator([np.zeros((0, 5))] * 2)
+        simple_generator.seed = 42
+
+        first  = simple_generator.group_prng(1).uniform(size=4)
+        second = simple_generator.group_prng(1).uniform(size=4)
+        np.testing.assert_equal(first, second)
+
+        simple_generator.on_epoch_end()
+        assert not np.array_equal(first, simple_generator.group_prng(1).uniform(size=4))
+
+    def test_next_transform(self):
+        from keras_retinanet.utils.transform import random_transform_generator
+
+        simple_generator = SimpleGenerator([np.zeros((0, 5))] * 2)
+        simple_generator.transform_generator = random_transform_generator(min_rotation=-0.1, max_rotation=0.1)
+
+        # the transformation depends only on the PRNG that is sent
+        first  = simple_generator.next_transform(np.random.RandomState(1))
+        second = simple_generator.next_transform(np.random.RandomState(1))
+        np.testing.assert_equal(first, second)
+
+
+class TestFusedPreprocessing(object):
+    def test_resize(self):
+        image       = np.random.RandomState(0).randint(0, 255, size=(100, 300, 3)).astype(np.uint8)
+        annotations = np.array([[10, 20, 50, 60, 0]], dtype=float)
+
+        simple_generator = SimpleGenerator([annotations], num_classes=1, image=image)
+        simple_generator.image_min_side = 50
+        simple_generator.image_max_side = 100
+        expected_image, expected_annotations = simple_generator.preprocess_group_entry(image, annotations.copy())
+
+        simple_generator.fused_preprocessing = True
+        fused_image, fused_annotations = simple_generator.preprocess_group_entry(image, annotations)
+
+        assert fused_image.shape == expected_image.shape
+        assert fused_image.dtype == expected_image.dtype
+        np.testing.assert_allclose(fused_image, expected_image, atol=1)
+        np.testing.assert_almost_equal(fused_annotations, expected_annotations)
+        np.testing.assert_equal(annotations, [[10, 20, 50, 60, 0]])
+
+    def test_resize_edge(self):
+        # a vertical edge ends up at the same output pixel as with cv2.resize, also for a small scale
+        image = np.zeros((500, 500, 3), dtype=np.uint8)
+        image[:, 302:] = 255
+
+        simple_generator = SimpleGenerator([np.zeros((0, 5))], num_classes=1, image=image)
+        simple_generator.image_min_side = 100
+        simple_generator.image_max_side = 100
+        expected_image, _ = simple_generator.preprocess_group_entry(image, np.zeros((0, 5)))
+
+        simple_generator.fused_preprocessing = True
+        fused_image, _ = simple_generator.preprocess_group_entry(image, np.zeros((0, 5)))
+
+        np.testing.assert_allclose(fused_image, expected_image, atol=1)
+
+    def test_photometric(self):
+        from keras_retinanet.utils.photometric import PhotometricAugmentation
+
+        image       = np.random.RandomState(0).randint(0, 255, size=(200, 600, 3)).astype(np.uint8)
+        annotations = np.array([[10, 20, 50, 60, 0]], dtype=float)
+
+        # the blur sigma is in pixels, so both paths have to blur at the target size
+        homogenous_transform = PhotometricAugmentation(noise_chance=1.0, blur_chance=1.0, blur_sigma=2.0)
+        simple_generator = SimpleGenerator([annotations], num_classes=1, image=image, homogenous_transform=homogenous_transform)
+        simple_generator.image_min_side = 50
+        simple_generator.image_max_side = 100
+        expected_image, _ = simple_generator.preprocess_group_entry(image, annotations.copy(), np.random.RandomState(1))
+
+        simple_generator.fused_preprocessing = True
+        fused_image, _ = simple_generator.preprocess_group_entry(image, annotations.copy(), np.random.RandomState(1))
+
+        assert fused_image.shape == expected_image.shape
+        np.testing.assert_allclose(fused_image, expected_image, atol=2)
+
+
+class TestBufferPool(object):
+    def test_compute_inputs(self):
+        simple_generator = SimpleGenerator([np.zeros((0, 5))] * 2)
+        simple_generator.batch_size  = 2
+        simple_generator.buffer_pool = BufferPool()
+
+        large = np.ones((20, 30, 3), dtype=np.uint8)
+        small = np.full((10, 30, 3), 2, dtype=np.uint8)
+
+        batch = simple_generator.compute_inputs([large, large])
+        simple_generator.release_batch((batch, []))
+
+        # the recycled buffer doesn't show the previous batch in the padding
+        reused = simple_generator.compute_inputs([small, large])
+        assert reused is batch
+        assert np.all(reused[0, 10:] == 0)
+        assert np.all(reused[0, :10] == 2)
+        assert np.all(reused[1] == 1)
+
+
+class TestInGraphTargets(object):
+    def test_compute_annotation_inputs(self):
+        simple_generator = SimpleGenerator([np.zeros((0, 5))] * 2, num_classes=3)
+        simple_generator.in_graph_targets = True
+
+        image_group       = [np.zeros((20, 30, 3)), np.zeros((10, 30, 3))]
+        annotations_group = [np.array([[1, 2, 10, 12, 2], [5, 5, 20, 15, 0]], dtype=float), np.zeros((0, 5))]
+
+        annotations, image_shapes = simple_generator.compute_annotation_inputs(image_group, annotations_group)
+        np.testing.assert_equal(annotations[0], annotations_group[0])
+        np.testing.assert_equal(annotations[1, :, 4], [-1, -1])
+        np.testing.assert_equal(image_shapes, [[20, 30], [10, 30]])
+
+        # a batch without annotations still has one (padding) annotation per image
+        annotations, _ = simple_generator.compute_annotation_inputs(image_group, [np.zeros((0, 5))] * 2)
+        assert annotations.shape == (2, 1, 5)
+        np.testing.assert_equal(annotations[..., 4], -1)
+
+        # the model outputs its losses, the targets are dummies
+        targets = simple_generator.compute_targets(image_group, annotations_group)
+        assert [target.shape for target in targets] == [(2, 1), (2, 1)]
+
+
+class TestComputeAnchorTargets(object):
+    def test_compact_targets_unsupported(self):
+        from keras_retinanet.utils.anchors import anchor_targets_bbox
+
+        with pytest.raises(ValueError):
+            Generator(compute_anchor_targets=anchor_targets_bbox, compact_targets=True)
+
+    def test_buffer_pool_unsupported(self):
+        from keras_retinanet.utils.anchors import anchor_targets_bbox
+
+        with pytest.raises(ValueError):
+            Generator(compute_anchor_targets=anchor_targets_bbox, buffer_pool=BufferPool())
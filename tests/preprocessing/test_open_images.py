@@ -0,0 +1,86 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras_retinanet.preprocessing.open_images import OpenImagesGenerator, generate_images_annotations
+
+import json
+import numpy as np
+import pytest
+from PIL import Image
+
+HEADER = 'ImageID,Source,LabelName,Confidence,XMin,XMax,YMin,YMax,IsOccluded,IsTruncated,IsGroupOf,IsDepiction,IsInside\n'
+
+
+def _write_dataset(tmpdir, rows):
+    metadata = tmpdir.mkdir('2018_04')
+    metadata.join('bbox_labels_600_hierarchy.json').write(json.dumps({'LabelName': '/m/root', 'Subcategory': [{'LabelName': '/m/cat'}, {'LabelName': '/m/dog'}]}))
+    metadata.join('class-descriptions-boxable.csv').write('/m/cat,Cat\n/m/dog,Dog\n')
+    metadata.mkdir('train').join('train-annotations-bbox.csv').write(HEADER + ''.join(row + '\n' for row in rows))
+
+    images = tmpdir.mkdir('images').mkdir('train')
+    Image.fromarray(np.zeros((10, 20, 3), dtype=np.uint8)).save(str(images.join('a.jpg')))
+    Image.fromarray(np.zeros((40, 10, 3), dtype=np.uint8)).save(str(images.join('b.jpg')))
+
+
+ROWS = [
+    'b,xclick,/m/dog,1,0.1,0.5,0.25,0.75,0,0,0,0,0',
+    'a,xclick,/m/cat,1,0,0.5,0,1,0,0,0,0,0',
+    'missing,xclick,/m/cat,1,0,0.5,0,1,0,0,0,0,0',
+    'a,xclick,/m/unknown,1,0,0.5,0,1,0,0,0,0,0',
+    'b,xclick,/m/cat,1,0.5,1,0,0.5,0,0,0,0,0',
+    'a,xclick,/m/dog,1,0.5,0.51,0,1,0,0,0,0,0',
+]
+
+
+def test_generate_images_annotations(tmpdir):
+    _write_dataset(tmpdir, ROWS)
+    cls_index = {'/m/cat': 0, '/m/dog': 1}
+
+    # a tiny chunk size gives every row its own chunk
+    with pytest.warns(UserWarning, match='filtering line 5'):
+        annotations = generate_images_annotations(str(tmpdir), str(tmpdir.join('2018_04')), 'train', cls_index, workers=2, chunk_size=1)
+
+    assert annotations['image_ids'].tolist() == ['b', 'a']
+    np.testing.assert_array_equal(annotations['sizes'], [[40, 10], [10, 20]])
+    np.testing.assert_array_equal(annotations['offsets'], [0, 2, 3])
+    np.testing.assert_allclose(annotations['boxes'], [[0.1, 0.25, 0.5, 0.75], [0.5, 0, 1, 0.5], [0, 0, 0.5, 1]])
+    np.testing.assert_array_equal(annotations['labels'], [1, 0, 0])
+
+
+def test_generate_images_annotations_invalid(tmpdir):
+    _write_dataset(tmpdir, ROWS[:2] + ['a,xclick,/m/cat,1,0.5,0.4,0,1,0,0,0,0,0'])
+
+    with pytest.raises(ValueError, match=r'line 2: x2 \(0.4\) must be higher than x1 \(0.5\)'):
+        generate_images_annotations(str(tmpdir), str(tmpdir.join('2018_04')), 'train', {'/m/cat': 0}, chunk_size=1)
+
+
+def test_open_images_generator(tmpdir):
+    _write_dataset(tmpdir, ROWS)
+
+    for _ in range(2):
+        generator = OpenImagesGenerator(str(tmpdir), 'train', annotation_cache_dir=str(tmpdir), group_method='none')
+
+        assert generator.size() == 2
+        assert generator.image_aspect_ratio(0) == 0.25
+        assert generator.image_path(1) == str(tmpdir.join('images', 'train', 'a.jpg'))
+        np.testing.assert_allclose(generator.load_annotations(0), [[1, 10, 5, 30, 1], [5, 0, 10, 20, 0]])
+
+        # the second iteration memory-maps the stored annotations
+        assert tmpdir.join('train_annotations', 'meta.json').check()
+
+    generator = OpenImagesGenerator(str(tmpdir), 'train', annotation_cache_dir=str(tmpdir), labels_filter=['Dog'], group_method='none')
+    assert generator.size() == 1
+    np.testing.assert_allclose(generator.load_annotations(0), [[1, 10, 5, 30, 0]])
@@ -0,0 +1,119 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras_retinanet.preprocessing.generator import Generator
+from keras_retinanet.preprocessing.pack import write_pack, PackGenerator, _PACK_FILES
+
+import numpy as np
+import os
+import pytest
+
+
+class SimpleGenerator(Generator):
+    def __init__(self, images, annotations_group, **kwargs):
+        self.images            = images
+        self.annotations_group = annotations_group
+        super(SimpleGenerator, self).__init__(group_method='none', shuffle_groups=False, **kwargs)
+
+    def size(self):
+        return len(self.images)
+
+    def num_classes(self):
+        return 2
+
+    def label_to_name(self, label):
+        return ['a', 'b'][label]
+
+    def load_image(self, image_index):
+        if image_index == getattr(self, 'fail_index', None):
+            raise IOError('failed to read image {}'.format(image_index))
+        return self.images[image_index]
+
+    def load_annotations(self, image_index):
+        return self.annotations_group[image_index]
+
+
+def test_write_and_read_pack(tmpdir):
+    prng   = np.random.RandomState(0)
+    images = [
+        prng.randint(0, 255, (200, 100, 3)).astype(np.uint8),
+        prng.randint(0, 255, (100, 300, 3)).astype(np.uint8),
+    ]
+    annotations_group = [
+        np.array([[10, 20, 50, 60, 1]], dtype=float),
+        np.zeros((0, 5)),
+    ]
+
+    generator = SimpleGenerator(images, annotations_group, image_min_side=50, image_max_side=100)
+    write_pack(generator, str(tmpdir), workers=1, chunk_size=1, verbose=0)
+
+    pack = PackGenerator(str(tmpdir), group_method='none')
+    assert pack.size() == 2
+    assert pack.num_classes() == 2
+    assert pack.label_to_name(1) == 'b'
+
+    assert pack.load_image(0).shape == (100, 50, 3)
+    assert pack.load_image(1).shape == (33, 100, 3)
+    assert pack.image_aspect_ratio(0) == 0.5
+
+    np.testing.assert_almost_equal(pack.load_annotations(0), [[5, 10, 25, 30, 1]])
+    assert pack.load_annotations(1).shape == (0, 5)
+
+    # a finished pack is left untouched when building again
+    write_pack(generator, str(tmpdir), workers=1, chunk_size=1, verbose=0)
+    assert PackGenerator(str(tmpdir)).size() == 2
+
+
+def _pack_generator():
+    prng   = np.random.RandomState(0)
+    images = [prng.randint(0, 255, (prng.randint(50, 200), prng.randint(50, 200), 3)).astype(np.uint8) for _ in range(5)]
+    annotations_group = [np.array([[10, 20, 40, 45, i % 2]] * i, dtype=float).reshape(-1, 5) for i in range(5)]
+    return SimpleGenerator(images, annotations_group, image_min_side=50, image_max_side=100)
+
+
+def _assert_packs_equal(path, expected_path):
+    for name in _PACK_FILES:
+        with open(os.path.join(path, name), 'rb') as f, open(os.path.join(expected_path, name), 'rb') as expected:
+            assert f.read() == expected.read(), name
+
+
+@pytest.mark.parametrize('damage', ['interrupted', 'truncated'])
+def test_resume_pack(tmpdir, damage):
+    clean   = str(tmpdir.join('clean'))
+    resumed = str(tmpdir.join('resumed'))
+    write_pack(_pack_generator(), clean, workers=1, chunk_size=2, verbose=0)
+
+    if damage == 'interrupted':
+        # fail partway through the second chunk, after some of its images are written
+        generator = _pack_generator()
+        generator.fail_index = 3
+        with pytest.raises(IOError):
+            write_pack(generator, resumed, workers=1, chunk_size=2, verbose=0)
+        with pytest.raises(ValueError):
+            PackGenerator(resumed)
+
+        # data after the last checkpoint is dropped when resuming
+        with open(os.path.join(resumed, 'images.bin'), 'ab') as f:
+            f.write(b'garbage')
+    else:
+        # a data file lost checkpointed data, the build starts over
+        write_pack(_pack_generator(), resumed, workers=1, chunk_size=2, verbose=0)
+        with open(os.path.join(resumed, 'boxes.bin'), 'r+b') as f:
+            f.truncate(os.path.getsize(os.path.join(resumed, 'boxes.bin')) // 2)
+
+    write_pack(_pack_generator(), resumed, workers=1, chunk_size=2, verbose=0)
+    _assert_packs_equal(resumed, clean)
+    assert PackGenerator(resumed).size() == 5
@@ -0,0 +1,79 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras_retinanet.preprocessing.pascal_voc import PascalVocGenerator, load_annotation_cache
+
+import numpy as np
+import pytest
+
+
+def _object(name, box, truncated=0, difficult=0):
+    return '<object><name>{}</name><truncated>{}</truncated><difficult>{}</difficult><bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax></bndbox></object>'.format(
+        name, truncated, difficult, *box)
+
+
+def _write_dataset(tmpdir):
+    annotations = tmpdir.mkdir('Annotations')
+    annotations.join('a.xml').write('<annotation>{}{}</annotation>'.format(_object('dog', (1, 2, 11, 12)), _object('cat', (5, 5, 9, 9), truncated=1)))
+    annotations.join('b.xml').write('<annotation>{}</annotation>'.format(_object('unicorn', (1, 1, 2, 2))))
+    annotations.join('c.xml').write('<annotation><object>')
+    tmpdir.mkdir('ImageSets').mkdir('Main').join('test.txt').write('a\nb\nc\n')
+
+
+def test_annotation_cache(tmpdir):
+    _write_dataset(tmpdir)
+    classes = {'cat': 0, 'dog': 1}
+
+    cached   = PascalVocGenerator(str(tmpdir), 'test', classes=classes, group_method='none')
+    uncached = PascalVocGenerator(str(tmpdir), 'test', classes=classes, group_method='none', annotation_cache=False)
+    assert tmpdir.join('Annotations.npz').exists()
+
+    np.testing.assert_array_equal(cached.load_annotations(0), uncached.load_annotations(0))
+    np.testing.assert_array_equal(cached.load_annotations(0), [[0, 1, 10, 11, 1], [4, 4, 8, 8, 0]])
+
+    cached.skip_truncated = True
+    np.testing.assert_array_equal(cached.load_annotations(0), [[0, 1, 10, 11, 1]])
+
+    # errors are raised when the image is loaded, like without the cache
+    for index in [1, 2]:
+        with pytest.raises(ValueError) as cached_error:
+            cached.load_annotations(index)
+        with pytest.raises(ValueError) as uncached_error:
+            uncached.load_annotations(index)
+        assert str(cached_error.value) == str(uncached_error.value)
+
+
+def test_annotation_cache_reuse(tmpdir):
+    _write_dataset(tmpdir)
+    cache_path = str(tmpdir.join('Annotations.npz'))
+
+    first  = load_annotation_cache(str(tmpdir.join('Annotations')), cache_path)
+    second = load_annotation_cache(str(tmpdir.join('Annotations')), cache_path)
+    for key in first:
+        np.testing.assert_array_equal(first[key], second[key])
+    assert list(second['files']) == ['a', 'b', 'c']
+
+
+def test_annotation_cache_foreign(tmpdir):
+    # an npz file that isn't an annotation cache is rebuilt instead of raising
+    _write_dataset(tmpdir)
+    cache_path = str(tmpdir.join('Annotations.npz'))
+    np.savez(cache_path, other=np.zeros(3))
+
+    with pytest.warns(UserWarning):
+        cache = load_annotation_cache(str(tmpdir.join('Annotations')), cache_path)
+    assert list(cache['files']) == ['a', 'b', 'c']
+    assert list(load_annotation_cache(str(tmpdir.join('Annotations')), cache_path)['files']) == ['a', 'b', 'c']
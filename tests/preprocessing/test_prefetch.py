@@ -0,0 +1,52 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras_retinanet.preprocessing.prefetch import Prefetcher
+from keras_retinanet.utils.transform import random_transform_generator
+
+from .test_generator import SimpleGenerator
+
+import numpy as np
+
+
+def test_prefetcher_order():
+    annotations_group = [np.array([[10 * i, 10, 10 * i + 40, 50, 0]], dtype=float) for i in range(5)]
+    image             = np.random.RandomState(0).randint(0, 255, size=(64, 96, 3)).astype(np.uint8)
+
+    generator = SimpleGenerator(annotations_group, num_classes=1, image=image)
+    generator.image_min_side      = 64
+    generator.image_max_side      = 96
+    generator.transform_generator = random_transform_generator(min_translation=(-0.1, -0.1), max_translation=(0.1, 0.1))
+
+    prefetcher = Prefetcher(generator, read_workers=2, augment_workers=2, target_workers=2, queue_size=2)
+    try:
+        # two epochs, so the pipeline wraps around and the augmentation differs between epochs
+        for epoch in range(2):
+            for index in range(len(generator)):
+                inputs, targets = prefetcher.next()
+                expected_inputs, expected_targets = generator[index]
+
+                np.testing.assert_array_equal(inputs, expected_inputs)
+                for target, expected_target in zip(targets, expected_targets):
+                    np.testing.assert_array_equal(target, expected_target)
+
+            generator.on_epoch_end()
+
+        stats = prefetcher.stats()
+        assert stats['consumer']['items'] == 2 * len(generator)
+        assert set(stats) == {'read', 'augment', 'targets', 'consumer'}
+    finally:
+        prefetcher.close()
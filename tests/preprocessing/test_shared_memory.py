@@ -0,0 +1,141 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras_retinanet.preprocessing import shared_memory
+from keras_retinanet.utils.transform import random_transform_generator
+
+from ..benchmark import benchmark, measure
+from .test_generator import SimpleGenerator
+
+import multiprocessing
+import numpy as np
+import pytest
+
+
+def test_flatten_batch():
+    inputs  = np.zeros((2, 8, 8, 3), dtype=np.float32)
+    targets = [np.ones((2, 10, 5), dtype=np.float32), np.ones((2, 10, 3), dtype=np.float32)]
+
+    arrays, structure = shared_memory._flatten_batch((inputs, targets))
+    assert len(arrays) == 3
+    assert structure == [None, 2]
+
+    result_inputs, result_targets = shared_memory._unflatten_batch(arrays, structure)
+    assert result_inputs is inputs
+    assert len(result_targets) == 2
+    assert result_targets[0] is targets[0]
+    assert result_targets[1] is targets[1]
+
+
+def test_align():
+    assert shared_memory._align(0) == 0
+    assert shared_memory._align(1) == 64
+    assert shared_memory._align(64) == 64
+    assert shared_memory._align(65) == 128
+
+
+@pytest.mark.skipif(shared_memory.shared_memory is None, reason='multiprocessing.shared_memory requires Python 3.8 or newer')
+def test_shared_memory_loader():
+    annotations_group = [np.array([[10 * i, 10, 10 * i + 40, 50, 0]], dtype=float) for i in range(3)]
+    image             = np.random.RandomState(0).randint(0, 255, size=(64, 96, 3)).astype(np.uint8)
+
+    generator = SimpleGenerator(annotations_group, num_classes=1, image=image)
+    generator.image_min_side      = 64
+    generator.image_max_side      = 96
+    generator.transform_generator = random_transform_generator(min_translation=(-0.1, -0.1), max_translation=(0.1, 0.1))
+
+    # a single worker delivers the batches in index order
+    loader = shared_memory.SharedMemoryLoader(generator, workers=1, num_slots=2)
+    try:
+        for epoch in range(2):
+            for index in range(len(generator)):
+                inputs, targets = loader.next()
+                expected_inputs, expected_targets = generator[index]
+
+                np.testing.assert_array_equal(inputs, expected_inputs)
+                for target, expected_target in zip(targets, expected_targets):
+                    np.testing.assert_array_equal(target, expected_target)
+
+            generator.on_epoch_end()
+
+        assert loader.oversized == 0
+    finally:
+        loader.close()
+
+
+class FailingGenerator(SimpleGenerator):
+    def load_image(self, image_index):
+        if image_index == 1:
+            raise ValueError('cannot load image 1')
+        return self.image
+
+
+@pytest.mark.skipif(shared_memory.shared_memory is None, reason='multiprocessing.shared_memory requires Python 3.8 or newer')
+def test_shared_memory_loader_error():
+    annotations_group = [np.array([[10, 10, 40, 50, 0]], dtype=float)] * 3
+    generator = FailingGenerator(annotations_group, num_classes=1, image=np.zeros((64, 96, 3), dtype=np.uint8))
+    generator.image_min_side = 64
+    generator.image_max_side = 96
+
+    # the error of the worker is raised by the consumer, later batches still arrive
+    loader = shared_memory.SharedMemoryLoader(generator, workers=1, num_slots=2)
+    try:
+        loader.next()
+        with pytest.raises(ValueError, match='cannot load image 1'):
+            loader.next()
+        loader.next()
+    finally:
+        loader.close()
+
+
+# generator of the pool workers that return pickled batches, set by _init_pickled
+_pickled_generator = None
+
+
+def _init_pickled(generator):
+    global _pickled_generator
+    _pickled_generator = generator
+
+
+def _pickled_batch(index):
+    return _pickled_generator[index]
+
+
+@benchmark
+@pytest.mark.skipif(shared_memory.shared_memory is None, reason='multiprocessing.shared_memory requires Python 3.8 or newer')
+def test_benchmark_shared_memory_loader():
+    annotations_group = [np.array([[10 * i, 10, 10 * i + 200, 300, i % 20] for i in range(20)], dtype=float)] * 32
+    generator = SimpleGenerator(annotations_group, num_classes=20, image=np.zeros((800, 1333, 3), dtype=np.uint8), batch_size=2)
+
+    def shared():
+        loader = shared_memory.SharedMemoryLoader(generator, workers=4)
+        try:
+            for _ in range(len(generator)):
+                loader.next()
+        finally:
+            loader.close()
+
+    def pickled():
+        pool = multiprocessing.get_context('fork').Pool(4, initializer=_init_pickled, initargs=(generator,))
+        try:
+            for _ in pool.imap(_pickled_batch, range(len(generator))):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    measure('{} batches through shared memory'.format(len(generator)), shared)
+    measure('{} batches pickled'.format(len(generator)), pickled)
@@ -31,3 +31,39 @@ def test_smooth_l1():
     loss = keras.backend.eval(loss)
 
     assert loss == pytest.approx((((1 - 0.5 / 9) * 2 + (0.5 * 9 * 0.05 ** 2)) / 3))
+
+
+def test_focal_compact():
+    classification = np.array([
+        [
+            [0.9, 0.1, 0.2],
+            [0.3, 0.6, 0.1],
+            [0.2, 0.2, 0.7],
+            [0.5, 0.4, 0.3],
+        ]
+    ], dtype=keras.backend.floatx())
+
+    # dense targets: one-hot labels and anchor state
+    dense = np.array([
+        [
+            [1, 0, 0, 1],
+            [0, 0, 0, 0],
+            [0, 0, 1, -1],
+            [0, 0, 1, 1],
+        ]
+    ], dtype=keras.backend.floatx())
+
+    # the same targets as (class index, anchor state)
+    compact = np.array([
+        [
+            [0, 1],
+            [0, 0],
+            [2, -1],
+            [2, 1],
+        ]
+    ], dtype=keras.backend.floatx())
+
+    dense_loss   = keras_retinanet.losses.focal()(keras.backend.variable(dense), keras.backend.variable(classification))
+    compact_loss = keras_retinanet.losses.focal(compact=True)(keras.backend.variable(compact), keras.backend.variable(classification))
+
+    assert keras.backend.eval(compact_loss) == pytest.approx(keras.backend.eval(dense_loss))
@@ -0,0 +1,241 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from keras_retinanet.utils.anchors import (
+    AnchorCache,
+    anchor_grid_for_shape,
+    anchors_for_shape,
+    anchor_targets_bbox,
+    anchor_targets_bbox_batched,
+    compute_max_overlap_grid,
+    labels_dtype,
+)
+from keras_retinanet.utils.overlap import compute_max_overlap
+
+from ..benchmark import benchmark, measure
+
+import pytest
+
+
+def test_anchor_cache_anchors():
+    cache   = AnchorCache(max_entries=1)
+    anchors = cache.anchors_for_shape((64, 96, 3))
+
+    np.testing.assert_array_equal(anchors, anchors_for_shape((64, 96, 3)))
+    assert cache.anchors_for_shape((64, 96, 3)) is anchors
+    assert not anchors.flags.writeable
+
+    # evicted by a different shape
+    cache.anchors_for_shape((96, 64, 3))
+    assert cache.anchors_for_shape((64, 96, 3)) is not anchors
+
+
+def test_anchor_cache_outside_image():
+    cache   = AnchorCache()
+    anchors = cache.anchors_for_shape((64, 96, 3))
+
+    centers  = np.stack([(anchors[:, 0] + anchors[:, 2]) / 2, (anchors[:, 1] + anchors[:, 3]) / 2], axis=1)
+    expected = np.logical_or(centers[:, 0] >= 80, centers[:, 1] >= 50)
+
+    mask = cache.outside_image(anchors, (50, 80, 3))
+    np.testing.assert_array_equal(mask, expected)
+    assert cache.outside_image(anchors, (50, 80, 3)) is mask
+
+    # anchors that did not come from the cache are computed on the fly
+    np.testing.assert_array_equal(cache.outside_image(anchors.copy(), (50, 80, 3)), expected)
+
+
+def test_anchor_targets_bbox_batched():
+    anchors = anchors_for_shape((64, 96, 3))
+    image_group = [np.zeros((64, 96, 3)), np.zeros((50, 80, 3)), np.zeros((64, 64, 3))]
+    annotations_group = [
+        np.array([[10, 10, 40, 40, 0], [50, 20, 90, 60, 2]], dtype=float),
+        np.zeros((0, 5)),
+        np.array([[0, 0, 63, 63, 1]], dtype=float),
+    ]
+
+    expected_labels, expected_regression, expected_annotations = anchor_targets_bbox(anchors, image_group, annotations_group, num_classes=3, compute_annotations=True)
+
+    out = (np.ones_like(expected_labels), np.ones_like(expected_regression), np.ones_like(expected_annotations))
+    labels, regression, annotations = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3, out=out, compute_annotations=True)
+
+    assert labels is out[0]
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_array_equal(regression[..., -1], expected_regression[..., -1])
+    np.testing.assert_array_equal(annotations, expected_annotations)
+
+    # regression targets only matter for positive anchors
+    positives = regression[..., -1] == 1
+    np.testing.assert_almost_equal(regression[positives], expected_regression[positives])
+
+
+def test_anchor_targets_bbox_annotations_opt_in():
+    anchors = anchors_for_shape((64, 96, 3))
+    image_group = [np.zeros((64, 96, 3))]
+    annotations_group = [np.array([[10, 10, 40, 40, 0]], dtype=float)]
+
+    assert anchor_targets_bbox(anchors, image_group, annotations_group, num_classes=3)[2] is None
+    assert anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3)[2] is None
+
+
+def test_anchor_targets_bbox_compact():
+    anchors = anchors_for_shape((64, 96, 3))
+    image_group = [np.zeros((64, 96, 3)), np.zeros((50, 80, 3))]
+    annotations_group = [
+        np.array([[10, 10, 40, 40, 0], [50, 20, 90, 60, 2]], dtype=float),
+        np.array([[0, 0, 63, 63, 1]], dtype=float),
+    ]
+
+    dense, _, _   = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3)
+    compact, _, _ = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3, compact=True)
+
+    assert compact.shape == dense.shape[:2] + (2,)
+    assert compact.dtype == np.int8
+    np.testing.assert_array_equal(compact[..., -1], dense[..., -1])
+
+    positive = dense[..., -1] == 1
+    np.testing.assert_array_equal(compact[positive, 0], np.argmax(dense[positive, :-1], axis=-1))
+
+
+def test_labels_dtype():
+    assert labels_dtype(80, compact=True) == np.int8
+    assert labels_dtype(500, compact=True) == np.int16
+    assert labels_dtype(40000, compact=True) == np.int32
+
+
+def test_anchor_targets_bbox_force_match():
+    anchors = anchors_for_shape((64, 96, 3))
+    image_group = [np.zeros((64, 96, 3)), np.zeros((64, 96, 3))]
+    annotations_group = [
+        np.array([[10, 10, 40, 40, 0], [60, 30, 63, 33, 2]], dtype=float),
+        np.zeros((0, 5)),
+    ]
+
+    # the small box doesn't reach positive_overlap with any anchor
+    labels, _, _ = anchor_targets_bbox(anchors, image_group, annotations_group, num_classes=3)
+    assert not labels[0, labels[0, :, -1] == 1, 2].any()
+
+    expected, _, _ = anchor_targets_bbox(anchors, image_group, annotations_group, num_classes=3, force_match=True)
+    labels, _, _   = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3, force_match=True)
+    np.testing.assert_array_equal(labels, expected)
+    assert labels[0, labels[0, :, -1] == 1, 2].sum() == 1
+    assert not (labels[1, :, -1] == 1).any()
+
+
+def _random_annotations(prng, count, image_shape):
+    corners = prng.uniform(0, 1, size=(count, 2)) * image_shape[1::-1]
+    sides   = np.exp(prng.uniform(np.log(2), np.log(max(image_shape[:2])), size=(count, 2)))
+    labels  = prng.randint(0, 3, size=(count, 1))
+    return np.concatenate([corners, corners + sides, labels], axis=1)
+
+
+def test_anchor_grid_for_shape():
+    grid    = anchor_grid_for_shape((100, 150, 3))
+    anchors = anchors_for_shape((100, 150, 3))
+
+    offset, shape, stride, base_anchors = grid[-1]
+    assert offset + shape[0] * shape[1] * base_anchors.shape[0] == anchors.shape[0]
+
+    # anchor (row, col, a) of a level
+    offset, (rows, cols), stride, base_anchors = grid[1]
+    row, col, a = 3, 5, 7
+    np.testing.assert_almost_equal(anchors[offset + (row * cols + col) * base_anchors.shape[0] + a], base_anchors[a] + (np.array([col, row, col, row]) + 0.5) * stride)
+
+
+def test_compute_max_overlap_grid():
+    prng    = np.random.RandomState(0)
+    shape   = (200, 300, 3)
+    grid    = anchor_grid_for_shape(shape)
+    anchors = anchors_for_shape(shape)
+    boxes   = _random_annotations(prng, 40, shape)[:, :4]
+    boxes[0] = [10, 10, 12, 11]  # small box without an anchor above the threshold
+
+    expected_max, expected_argmax, expected_best = compute_max_overlap(anchors, boxes)
+
+    # without a minimum overlap the result is identical
+    max_overlaps, argmax_overlaps, best_anchors = compute_max_overlap_grid(grid, anchors, boxes)
+    np.testing.assert_array_equal(max_overlaps, expected_max)
+    np.testing.assert_array_equal(argmax_overlaps, expected_argmax)
+    np.testing.assert_array_equal(best_anchors, expected_best)
+
+    # with a minimum overlap, anchors below it are zero
+    max_overlaps, argmax_overlaps, best_anchors = compute_max_overlap_grid(grid, anchors, boxes, min_overlap=0.4)
+    above = expected_max >= 0.4
+    np.testing.assert_array_equal(max_overlaps[above], expected_max[above])
+    np.testing.assert_array_equal(argmax_overlaps[above], expected_argmax[above])
+    assert not max_overlaps[~above].any() and not argmax_overlaps[~above].any()
+    np.testing.assert_array_equal(best_anchors, expected_best)
+
+    # without all_best_boxes, boxes without an anchor above the minimum overlap have no best anchor
+    max_overlaps, argmax_overlaps, best_anchors = compute_max_overlap_grid(grid, anchors, boxes, min_overlap=0.4, all_best_boxes=False)
+    np.testing.assert_array_equal(max_overlaps[above], expected_max[above])
+    assert best_anchors[0] == 0
+    matched = np.unique(argmax_overlaps[above])
+    np.testing.assert_array_equal(best_anchors[matched], expected_best[matched])
+
+
+def test_anchor_targets_bbox_batched_grid():
+    prng              = np.random.RandomState(1)
+    shape             = (128, 192, 3)
+    cache             = AnchorCache()
+    anchors           = cache.anchors_for_shape(shape)
+    image_group       = [np.zeros(shape), np.zeros((100, 150, 3)), np.zeros(shape)]
+    annotations_group = [_random_annotations(prng, 20, shape), _random_annotations(prng, 5, (100, 150)), np.zeros((0, 5))]
+
+    for force_match in [False, True]:
+        expected = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3, force_match=force_match)
+        targets  = anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=3, force_match=force_match, grid=cache.grid(anchors))
+        np.testing.assert_array_equal(targets[0], expected[0])
+        np.testing.assert_array_equal(targets[1], expected[1])
+
+
+@benchmark
+@pytest.mark.parametrize('image_side', [640, 1024])
+@pytest.mark.parametrize('num_boxes', [1, 50, 500])
+def test_benchmark_compute_max_overlap_grid(image_side, num_boxes):
+    prng    = np.random.RandomState(0)
+    shape   = (image_side, image_side * 5 // 3, 3)
+    grid    = anchor_grid_for_shape(shape)
+    anchors = anchors_for_shape(shape)
+    boxes   = _random_annotations(prng, num_boxes, shape)[:, :4]
+
+    name = '{} anchors x {} boxes'.format(anchors.shape[0], num_boxes)
+    measure(name + ', dense', lambda: compute_max_overlap(anchors, boxes))
+    measure(name + ', grid', lambda: compute_max_overlap_grid(grid, anchors, boxes, min_overlap=0.4, all_best_boxes=False))
+    measure(name + ', grid with all best boxes', lambda: compute_max_overlap_grid(grid, anchors, boxes, min_overlap=0.4))
+
+
+@benchmark
+@pytest.mark.parametrize('num_boxes', [5, 50])
+def test_benchmark_anchor_targets_bbox_batched(num_boxes):
+    prng              = np.random.RandomState(0)
+    shape             = (800, 1333, 3)
+    cache             = AnchorCache()
+    anchors           = cache.anchors_for_shape(shape)
+    image_group       = [np.zeros(shape)] * 8
+    annotations_group = [_random_annotations(prng, num_boxes, shape) for _ in image_group]
+
+    def per_image():
+        for image, annotations in zip(image_group, annotations_group):
+            anchor_targets_bbox(anchors, [image], [annotations], num_classes=80)
+
+    name = '8 images x {} boxes'.format(num_boxes)
+    measure(name + ', anchor_targets_bbox per image', per_image)
+    measure(name + ', anchor_targets_bbox_batched', lambda: anchor_targets_bbox_batched(anchors, image_group, annotations_group, num_classes=80))
+    measure(name + ', anchor_targets_bbox_batched with grid', lambda: anchor_targets_bbox_batched(
+        anchors, image_group, annotations_group, num_classes=80, grid=cache.grid(anchors)))
@@ -0,0 +1,112 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import gc
+import multiprocessing
+import weakref
+
+import numpy as np
+
+from keras_retinanet.utils.buffer_pool import BufferPool
+
+from ..benchmark import benchmark
+from ..preprocessing.test_generator import SimpleGenerator
+
+
+def test_buffer_pool_reuse():
+    pool = BufferPool()
+
+    array = pool.acquire((2, 3), np.float32)
+    assert array.shape == (2, 3) and array.dtype == np.float32
+
+    # released arrays are handed out again, also when released through a view
+    pool.release(array.T)
+    assert pool.acquire((2, 3), np.float32) is array
+    assert pool.acquire((2, 3), np.float32) is not array
+    assert pool.acquire((3, 2), np.float32) is not array
+
+    # arrays that don't belong to the pool are ignored
+    pool.release(np.zeros((2, 3), dtype=np.float32))
+    assert pool.stats() == {'allocations': 3, 'reuses': 1, 'free_arrays': 0, 'free_bytes': 0}
+
+
+def test_buffer_pool_max_bytes():
+    pool = BufferPool(max_bytes=100)
+
+    first  = pool.acquire((10,), np.float32)
+    second = pool.acquire((20,), np.float32)
+    pool.release(first)
+    pool.release(second)
+
+    # the least recently released shape is dropped
+    assert pool.stats()['free_bytes'] == 80
+    assert pool.acquire((10,), np.float32) is not first
+    assert pool.acquire((20,), np.float32) is second
+
+
+def test_buffer_pool_unreleased():
+    pool = BufferPool()
+
+    # arrays that are never released are not kept alive by the pool
+    array     = pool.acquire((10,), np.float32)
+    reference = weakref.ref(array)
+    del array
+    gc.collect()
+    assert reference() is None
+    assert len(pool.owned) == 0
+
+
+class CocoSizedGenerator(SimpleGenerator):
+    """ Images with the sizes and number of annotations of typical COCO images.
+    """
+    shapes = [(480, 640, 3), (640, 427, 3), (427, 640, 3), (375, 500, 3)]
+
+    def load_image(self, image_index):
+        return np.zeros(self.shapes[image_index % len(self.shapes)], dtype=np.uint8)
+
+
+def _run_batches(buffer_pool_bytes, num_batches=50):
+    """ Compute batches in a fresh process and return the number of batch arrays allocated and the peak RSS in kB.
+    """
+    import resource
+
+    annotations = np.array([[10 * i, 10, 10 * i + 100, 200, i] for i in range(7)], dtype=float)
+    buffer_pool = BufferPool(buffer_pool_bytes) if buffer_pool_bytes else None
+    generator   = CocoSizedGenerator([annotations] * 2 * num_batches, num_classes=80, batch_size=2, buffer_pool=buffer_pool)
+
+    # without a pool every array of every batch is a new allocation
+    allocations = 0
+    for index in range(num_batches):
+        inputs, targets = generator[index]
+        allocations += 1 + len(targets)
+        generator.release_batch((inputs, targets))
+        del inputs, targets
+
+    if buffer_pool is not None:
+        allocations = buffer_pool.stats()['allocations']
+    return allocations, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@benchmark
+def test_benchmark_buffer_pool():
+    for buffer_pool_bytes in [0, 2 ** 30]:
+        pool = multiprocessing.Pool(1)
+        try:
+            allocations, peak_rss = pool.apply(_run_batches, (buffer_pool_bytes,))
+        finally:
+            pool.close()
+            pool.join()
+        print('buffer pool of {} MB: {} batch arrays allocated, peak RSS {} MB'.format(buffer_pool_bytes // 2 ** 20, allocations, peak_rss // 1024))
@@ -0,0 +1,186 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import pytest
+
+from keras_retinanet.utils import overlap
+
+from ..benchmark import benchmark, measure
+
+try:
+    from keras_retinanet.utils import compute_overlap as extension
+except ImportError:
+    extension = None
+
+# (compute_overlap, compute_max_overlap) of every available implementation, they share the tests below
+implementations = [pytest.param((overlap.compute_overlap_numpy, overlap.compute_max_overlap_numpy), id='numpy')]
+if extension is not None:
+    implementations.append(pytest.param((extension.compute_overlap, extension.compute_max_overlap), id='extension'))
+
+
+def _random_boxes(prng, count, size=100):
+    corners = prng.uniform(0, size, size=(count, 2))
+    sides   = prng.uniform(0, size / 2, size=(count, 2))
+    return np.concatenate([corners, corners + sides], axis=1)
+
+
+def _reference_overlap(boxes, query_boxes):
+    iw = np.minimum(boxes[:, None, 2], query_boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], query_boxes[None, :, 0]) + 1
+    ih = np.minimum(boxes[:, None, 3], query_boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], query_boxes[None, :, 1]) + 1
+    intersection = np.where((iw > 0) & (ih > 0), iw * ih, 0)
+
+    areas       = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    query_areas = (query_boxes[:, 2] - query_boxes[:, 0] + 1) * (query_boxes[:, 3] - query_boxes[:, 1] + 1)
+    return intersection / (areas[:, None] + query_areas[None, :] - intersection)
+
+
+@pytest.mark.parametrize('implementation', implementations)
+def test_compute_overlap(implementation):
+    compute_overlap, _ = implementation
+    prng        = np.random.RandomState(0)
+    boxes       = _random_boxes(prng, 300)
+    query_boxes = _random_boxes(prng, 7)
+    expected    = _reference_overlap(boxes, query_boxes)
+
+    overlaps = compute_overlap(boxes, query_boxes)
+    assert overlaps.dtype == np.float64 and overlaps.shape == (300, 7)
+    np.testing.assert_allclose(overlaps, expected)
+
+    # the compatibility wrapper accepts other types and layouts
+    np.testing.assert_allclose(compute_overlap(boxes.astype(np.int64), np.asfortranarray(query_boxes).astype(np.int64)), _reference_overlap(boxes.astype(np.int64), query_boxes.astype(np.int64)))
+
+    # float32 inputs are computed in float32
+    overlaps = compute_overlap(boxes.astype(np.float32), query_boxes.astype(np.float32))
+    assert overlaps.dtype == np.float32
+    np.testing.assert_allclose(overlaps, expected, atol=1e-5)
+
+
+@pytest.mark.skipif(extension is None, reason='the compute_overlap extension is not built')
+def test_compute_overlap_fused():
+    prng        = np.random.RandomState(0)
+    boxes       = _random_boxes(prng, 300).astype(np.float32)
+    query_boxes = _random_boxes(prng, 7).astype(np.float32)
+
+    overlaps = extension.compute_overlap_fused(boxes, query_boxes)
+    assert overlaps.dtype == np.float32
+    np.testing.assert_allclose(overlaps, _reference_overlap(boxes.astype(np.float64), query_boxes.astype(np.float64)), atol=1e-5)
+
+
+@pytest.mark.parametrize('implementation', implementations)
+def test_compute_overlap_empty(implementation):
+    compute_overlap, _ = implementation
+    boxes = _random_boxes(np.random.RandomState(0), 10)
+    assert compute_overlap(boxes, np.zeros((0, 4))).shape == (10, 0)
+    assert compute_overlap(np.zeros((0, 4)), boxes).shape == (0, 10)
+
+
+@pytest.mark.parametrize('implementation', implementations)
+def test_compute_max_overlap(implementation):
+    compute_overlap, compute_max_overlap = implementation
+    prng        = np.random.RandomState(0)
+    boxes       = _random_boxes(prng, 1000)
+    query_boxes = _random_boxes(prng, 9)
+    overlaps    = compute_overlap(boxes, query_boxes)
+
+    max_overlaps, argmax_overlaps, best_boxes = compute_max_overlap(boxes, query_boxes)
+    np.testing.assert_allclose(max_overlaps, overlaps.max(axis=1))
+    np.testing.assert_array_equal(argmax_overlaps, np.argmax(overlaps, axis=1))
+    np.testing.assert_array_equal(best_boxes, np.argmax(overlaps, axis=0))
+
+    # ties resolve to the lowest index, like np.argmax
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [50, 50, 60, 60]], dtype=np.float64)
+    max_overlaps, argmax_overlaps, best_boxes = compute_max_overlap(boxes, boxes[[2, 0, 0]])
+    np.testing.assert_array_equal(argmax_overlaps, [1, 1, 0])
+    np.testing.assert_array_equal(best_boxes, [2, 0, 0])
+
+
+@pytest.mark.parametrize('implementation', implementations)
+def test_compute_max_overlap_empty(implementation):
+    _, compute_max_overlap = implementation
+    boxes = _random_boxes(np.random.RandomState(0), 10)
+    max_overlaps, argmax_overlaps, best_boxes = compute_max_overlap(boxes, np.zeros((0, 4)))
+    assert max_overlaps.shape == (10,) and not max_overlaps.any() and not argmax_overlaps.any()
+    assert best_boxes.shape == (0,)
+
+
+def test_numpy_chunks():
+    prng        = np.random.RandomState(0)
+    boxes       = _random_boxes(prng, 1000)
+    query_boxes = _random_boxes(prng, 9)
+
+    # chunks of a few rows give the same result as a single chunk
+    np.testing.assert_array_equal(overlap.compute_overlap_numpy(boxes, query_boxes, max_chunk_bytes=2048), overlap.compute_overlap_numpy(boxes, query_boxes))
+    for chunked, expected in zip(overlap.compute_max_overlap_numpy(boxes, query_boxes, max_chunk_bytes=2048), overlap.compute_max_overlap_numpy(boxes, query_boxes)):
+        np.testing.assert_array_equal(chunked, expected)
+
+
+@pytest.mark.skipif(extension is None, reason='the compute_overlap extension is not built')
+def test_numpy_matches_extension():
+    prng        = np.random.RandomState(0)
+    boxes       = _random_boxes(prng, 2000, size=500)
+    query_boxes = _random_boxes(prng, 50, size=500)
+
+    # the compiler may contract the union area into a fused multiply-add, so the overlaps can differ in the last bit
+    overlaps = overlap.compute_overlap_numpy(boxes, query_boxes)
+    np.testing.assert_allclose(overlaps, extension.compute_overlap(boxes, query_boxes), rtol=1e-12)
+
+    max_overlaps, argmax_overlaps, best_boxes = overlap.compute_max_overlap_numpy(boxes, query_boxes)
+    extension_max_overlaps, extension_argmax_overlaps, extension_best_boxes = extension.compute_max_overlap(boxes, query_boxes)
+    np.testing.assert_allclose(max_overlaps, extension_max_overlaps, rtol=1e-12)
+
+    # the arg maxima only have to agree where the best overlap is clearly ahead of the second best
+    def clear(overlaps):
+        top = np.sort(overlaps, axis=1)[:, -2:]
+        return top[:, 1] - top[:, 0] > 1e-9
+
+    rows    = clear(overlaps)
+    columns = clear(overlaps.T)
+    assert rows.sum() > 100 and columns.sum() > 40
+    np.testing.assert_array_equal(argmax_overlaps[rows], extension_argmax_overlaps[rows])
+    np.testing.assert_array_equal(best_boxes[columns], extension_best_boxes[columns])
+
+
+@benchmark
+@pytest.mark.parametrize('implementation', implementations)
+@pytest.mark.parametrize('num_anchors', [100000, 500000])
+@pytest.mark.parametrize('num_boxes', [1, 50, 500])
+def test_benchmark_compute_overlap(implementation, num_anchors, num_boxes):
+    compute_overlap, compute_max_overlap = implementation
+    prng  = np.random.RandomState(0)
+    boxes = _random_boxes(prng, num_anchors, size=1000)
+    query = _random_boxes(prng, num_boxes, size=1000)
+
+    for dtype in [np.float32, np.float64]:
+        typed_boxes, typed_query = boxes.astype(dtype), query.astype(dtype)
+
+        name = '{} anchors x {} boxes, {}'.format(num_anchors, num_boxes, np.dtype(dtype).name)
+        measure(name + ', ' + compute_max_overlap.__name__, lambda: compute_max_overlap(typed_boxes, typed_query))
+
+        # the full (N, K) matrix of the largest case takes gigabytes
+        if num_anchors * num_boxes <= 10 ** 8:
+            measure(name + ', ' + compute_overlap.__name__, lambda: compute_overlap(typed_boxes, typed_query))
+
+
+@benchmark
+@pytest.mark.parametrize('max_chunk_bytes', [2 ** 20, overlap.MAX_CHUNK_BYTES, 2 ** 28])
+def test_benchmark_numpy_chunks(max_chunk_bytes):
+    prng  = np.random.RandomState(0)
+    boxes = _random_boxes(prng, 500000, size=1000)
+    query = _random_boxes(prng, 50, size=1000)
+
+    name = '500000 anchors x 50 boxes, chunks of {} MB'.format(max_chunk_bytes // 2 ** 20)
+    measure(name, lambda: overlap.compute_max_overlap_numpy(boxes, query, max_chunk_bytes=max_chunk_bytes))
@@ -0,0 +1,127 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from keras_retinanet.utils.image import TransformParameters, apply_transform, compute_resize_scale, read_image_bgr, read_image_bgr_reduced
+from keras_retinanet.utils.transform import change_transform_origin, scaling, translation
+
+from ..benchmark import benchmark, measure
+
+
+def test_apply_transform_identity():
+    image = np.random.RandomState(0).randint(0, 255, size=(20, 30, 3)).astype(np.uint8)
+    result = apply_transform(np.identity(3), image, TransformParameters())
+    np.testing.assert_array_equal(result, image)
+
+    # the result is a copy, so it can be modified even if the image is read-only
+    assert not np.shares_memory(result, image)
+
+
+def test_apply_transform_translation():
+    image = np.random.RandomState(0).randint(0, 255, size=(20, 30, 3)).astype(np.uint8)
+
+    for fill_mode in ['constant', 'nearest', 'reflect', 'wrap']:
+        params = TransformParameters(fill_mode=fill_mode, cval=7)
+        for offset in [(3, -4), (-5, 2), (29, 19)]:
+            matrix   = translation(offset).astype(np.float64)
+            expected = cv2.warpAffine(image, matrix[:2, :], dsize=(30, 20), flags=params.cvInterpolation(), borderMode=params.cvBorderMode(), borderValue=params.cval)
+            np.testing.assert_array_equal(apply_transform(matrix, image, params), expected)
+
+
+def test_apply_transform_flip():
+    image = np.random.RandomState(0).randint(0, 255, size=(20, 30, 3)).astype(np.uint8)
+
+    matrix = change_transform_origin(scaling([-1, 1]), (15, 10))
+    np.testing.assert_array_equal(apply_transform(matrix, image, TransformParameters()), image[:, ::-1])
+
+    matrix = change_transform_origin(scaling([-1, -1]), (15, 10))
+    np.testing.assert_array_equal(apply_transform(matrix, image, TransformParameters()), image[::-1, ::-1])
+
+    matrix = change_transform_origin(scaling([1, -1]), (15, 10))
+    np.testing.assert_array_equal(apply_transform(matrix, image, TransformParameters()), image[::-1])
+
+    # single channel images keep their channel axis
+    np.testing.assert_array_equal(apply_transform(matrix, image[..., :1], TransformParameters()), image[::-1, :, :1])
+
+
+def test_read_image_bgr_reduced(tmpdir):
+    image = np.random.RandomState(0).randint(0, 255, size=(48, 64, 3)).astype(np.uint8)
+    jpeg  = str(tmpdir.join('image.jpg'))
+    png   = str(tmpdir.join('image.png'))
+    Image.fromarray(image).save(jpeg)
+    Image.fromarray(image).save(png)
+
+    # no reduction is possible for scales of at least 0.5
+    reduced, scale = read_image_bgr_reduced(jpeg, 0.6)
+    np.testing.assert_array_equal(reduced, read_image_bgr(jpeg))
+    assert scale == 1.0
+
+    # a half size image is the smallest that still has a min side of at least 48 * 0.3
+    reduced, scale = read_image_bgr_reduced(jpeg, 0.3)
+    assert reduced.shape == (24, 32, 3)
+    assert scale == 0.5
+
+    reduced, scale = read_image_bgr_reduced(jpeg, 0.1)
+    assert reduced.shape == (6, 8, 3)
+    assert scale == 0.125
+
+    # other formats are read at full resolution
+    reduced, scale = read_image_bgr_reduced(png, 0.1)
+    np.testing.assert_array_equal(reduced, read_image_bgr(png))
+    assert scale == 1.0
+
+
+@benchmark
+@pytest.mark.parametrize('kind', ['identity', 'flip', 'translation'])
+def test_benchmark_apply_transform(kind):
+    image  = np.random.RandomState(0).randint(0, 255, size=(800, 1333, 3)).astype(np.uint8)
+    params = TransformParameters()
+    matrix = {
+        'identity'    : np.identity(3),
+        'flip'        : change_transform_origin(scaling((-1, 1)), (0.5 * image.shape[1], 0.5 * image.shape[0])),
+        'translation' : translation((13, -7)).astype(np.float64),
+    }[kind]
+
+    def warp():
+        return cv2.warpAffine(image, matrix[:2, :], dsize=(image.shape[1], image.shape[0]), flags=params.cvInterpolation(),
+                              borderMode=params.cvBorderMode(), borderValue=params.cval)
+
+    measure('{}, cv2.warpAffine'.format(kind), warp)
+    measure('{}, apply_transform'.format(kind), lambda: apply_transform(matrix, image, params))
+
+
+@benchmark
+def test_benchmark_read_image_bgr_reduced(tmpdir):
+    # a 12 megapixel photo, resized to the default min side of 800
+    image = np.random.RandomState(0).randint(0, 255, size=(3000, 4000, 3)).astype(np.uint8)
+    jpeg  = str(tmpdir.join('image.jpg'))
+    Image.fromarray(cv2.GaussianBlur(image, (15, 15), 5)).save(jpeg, quality=90)
+    scale = compute_resize_scale(image.shape)
+
+    def full():
+        return cv2.resize(read_image_bgr(jpeg), None, fx=scale, fy=scale)
+
+    def reduced():
+        image, reduction = read_image_bgr_reduced(jpeg, scale)
+        return cv2.resize(image, None, fx=scale / reduction, fy=scale / reduction)
+
+    assert full().shape == reduced().shape
+    measure('read_image_bgr + resize', full)
+    measure('read_image_bgr_reduced + resize', reduced)
@@ -0,0 +1,71 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from keras_retinanet.utils.image_cache import LRUCache, ImageCache
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(max_bytes=300)
+    a = np.zeros(100, dtype=np.uint8)
+    b = np.zeros(100, dtype=np.uint8)
+    c = np.zeros(100, dtype=np.uint8)
+    d = np.zeros(100, dtype=np.uint8)
+
+    assert cache.put('a', a) == []
+    assert cache.put('b', b) == []
+    assert cache.put('c', c) == []
+
+    # touch 'a' so 'b' is the least recently used entry
+    assert cache.get('a') is a
+    evicted = cache.put('d', d)
+    assert [key for key, _ in evicted] == ['b']
+
+    assert cache.get('b') is None
+    assert cache.stats() == {'entries': 3, 'bytes': 300, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+
+def test_lru_cache_oversized():
+    cache = LRUCache(max_bytes=10)
+    value = np.zeros(11, dtype=np.uint8)
+    assert cache.put('a', value)[0][0] == 'a'
+    assert len(cache) == 0
+
+
+def test_image_cache():
+    image = np.random.RandomState(0).randint(0, 255, (40, 60, 3)).astype(np.uint8)
+    loads = []
+
+    def load():
+        loads.append(True)
+        return image
+
+    cache = ImageCache(max_bytes=image.nbytes, max_encoded_bytes=image.nbytes, min_side=20, max_side=100)
+    result, scale = cache.get(0, load)
+    np.testing.assert_array_equal(result, image)
+    assert scale == 1.0
+    assert not result.flags.writeable
+
+    result, scale = cache.get(0, load)
+    assert len(loads) == 1
+
+    # inserting a second image demotes the first one to the encoded tier at half resolution
+    cache.get(1, load)
+    result, scale = cache.get(0, load)
+    assert scale == 0.5
+    assert result.shape == (20, 30, 3)
+    assert len(loads) == 2
@@ -0,0 +1,70 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from keras_retinanet.utils import image_index
+
+
+def test_image_sizes(tmpdir):
+    paths = []
+    for i, (rows, cols) in enumerate([(10, 20), (30, 15)]):
+        path = str(tmpdir.join('{}.png'.format(i)))
+        Image.fromarray(np.zeros((rows, cols, 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+
+    index_path = str(tmpdir.join('sizes.npz'))
+    np.testing.assert_array_equal(image_index.image_sizes(paths, index_path=index_path), [[10, 20], [30, 15]])
+    assert os.path.exists(index_path)
+
+    # stored entries are used without reading the images
+    scanned = []
+    read_image_size = image_index.read_image_size
+    image_index.read_image_size = lambda path: scanned.append(path) or read_image_size(path)
+    try:
+        np.testing.assert_array_equal(image_index.image_sizes(paths, index_path=index_path), [[10, 20], [30, 15]])
+        assert scanned == []
+
+        # a changed image is scanned again
+        Image.fromarray(np.zeros((5, 7, 3), dtype=np.uint8)).save(paths[1])
+        os.utime(paths[1], (0, 0))
+        np.testing.assert_array_equal(image_index.image_sizes(paths, index_path=index_path), [[10, 20], [5, 7]])
+        assert scanned == [paths[1]]
+    finally:
+        image_index.read_image_size = read_image_size
+
+
+def test_npz(tmpdir):
+    path = str(tmpdir.join('index.npz'))
+    assert image_index.load_npz(path) is None
+
+    image_index.save_npz(path, {'a': np.arange(3), 'b': np.zeros((2, 2))})
+    loaded = image_index.load_npz(path, keys=['a'])
+    assert list(loaded) == ['a']
+    np.testing.assert_array_equal(loaded['a'], np.arange(3))
+    assert os.listdir(str(tmpdir)) == ['index.npz']
+
+    # files missing a key and files that aren't npz files are ignored
+    with pytest.warns(UserWarning):
+        assert image_index.load_npz(path, keys=['a', 'c']) is None
+    with open(path, 'wb') as f:
+        f.write(b'PK\x03\x04 not a zip file')
+    with pytest.warns(UserWarning):
+        assert image_index.load_npz(path) is None
@@ -0,0 +1,67 @@
+"""
+Copyright 2017-2018 Fizyr (https://fizyr.com)
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from keras_retinanet.utils.photometric import PhotometricAugmentation, add_gaussian_noise, add_hue_saturation, sharpen
+
+
+def _image():
+    return np.random.RandomState(0).randint(0, 255, size=(20, 30, 3)).astype(np.uint8)
+
+
+def test_add_gaussian_noise():
+    image = _image()
+
+    shared = add_gaussian_noise(image, 10, np.random.RandomState(1))
+    assert shared.dtype == np.uint8 and shared.shape == image.shape
+
+    # without per channel noise, all channels get the same noise (except where it saturates)
+    difference = shared.astype(np.int16) - image
+    unclipped  = np.all((shared > 0) & (shared < 255), axis=2)
+    assert np.all(difference[unclipped] == difference[unclipped][:, :1])
+
+    np.testing.assert_array_equal(add_gaussian_noise(image, 10, np.random.RandomState(1)), shared)
+
+
+def test_add_hue_saturation():
+    image = _image()
+    assert add_hue_saturation(image, 0) is image
+
+    # a hue rotation of 10 degrees turns red into orange
+    shifted = add_hue_saturation(np.full((1, 1, 3), (0, 0, 200), dtype=np.uint8), 28)
+    assert shifted.dtype == np.uint8
+    assert np.argmax(shifted[0, 0]) == 2 and shifted[0, 0, 1] > 0
+
+
+def test_sharpen():
+    image = _image()
+    assert sharpen(image, 0) is image
+
+    # a constant image stays constant
+    constant = np.full((10, 10, 3), 100, dtype=np.uint8)
+    np.testing.assert_array_equal(sharpen(constant, 0.5), constant)
+
+
+def test_photometric_augmentation():
+    image        = _image()
+    augmentation = PhotometricAugmentation(noise_chance=1.0, blur_chance=1.0, hue_sat_chance=1.0, sharpen_chance=1.0)
+
+    augmented = augmentation(image, np.random.RandomState(3))
+    assert augmented.dtype == np.uint8 and augmented.shape == image.shape
+    np.testing.assert_array_equal(augmentation(image, np.random.RandomState(3)), augmented)
+
+    assert PhotometricAugmentation()(image, np.random.RandomState(3)) is image
@@ -1,10 +1,12 @@
 import numpy as np
+import pytest
 from numpy.testing import assert_almost_equal
 from math import pi
 
 from keras_retinanet.utils.transform import (
     colvec,
     transform_aabb,
+    transform_aabbs,
     rotation, random_rotation,
     translation, random_translation,
     scaling, random_scaling,
@@ -13,8 +15,11 @@ from keras_retinanet.utils.transform import (
     random_transform,
     random_transform_generator,
     change_transform_origin,
+    classify_transform,
 )
 
+from ..benchmark import benchmark, measure
+
 
 def test_colvec():
     assert np.array_equal(colvec(0), np.array([[0]]))
@@ -144,8 +149,56 @@ def test_transform_aabb():
     assert_almost_equal([ 2,  4,  4,  6], transform_aabb(translation([1, 2]), [1, 2, 3, 4]))
 
 
+def test_transform_aabbs():
+    boxes = np.array([
+        [1, 2, 3, 4],
+        [0, 0, 10, 5],
+        [-5, 3, 7, 30],
+    ], dtype=float)
+
+    transforms = [
+        np.identity(3),
+        rotation(pi),
+        rotation(0.3),
+        translation([1, 2]),
+        scaling([0.5, 2]),
+        shear(0.2),
+        random_transform(prng=np.random.RandomState(0), min_rotation=-1, max_rotation=1, min_shear=-0.5, max_shear=0.5),
+    ]
+    for transform in transforms:
+        expected = [transform_aabb(transform, box) for box in boxes]
+        assert_almost_equal(expected, transform_aabbs(transform, boxes))
+
+    assert transform_aabbs(np.identity(3), np.zeros((0, 4))).shape == (0, 4)
+
+
 def test_change_transform_origin():
     assert np.array_equal(change_transform_origin(translation([3, 4]), [1, 2]), translation([3, 4]))
     assert_almost_equal(colvec(1, 2, 1), change_transform_origin(rotation(pi), [1, 2]).dot(colvec(1, 2, 1)))
     assert_almost_equal(colvec(0, 0, 1), change_transform_origin(rotation(pi), [1, 2]).dot(colvec(2, 4, 1)))
     assert_almost_equal(colvec(0, 0, 1), change_transform_origin(scaling([0.5, 0.5]), [-2, -4]).dot(colvec(2, 4, 1)))
+
+
+def test_classify_transform():
+    shape = (20, 30, 3)
+    assert classify_transform(np.identity(3), shape) == 'identity'
+    assert classify_transform(translation([3, -4]), shape) == 'translation'
+    assert classify_transform(translation([0.5, 0]), shape) == 'affine'
+    assert classify_transform(translation([30, 0]), shape) == 'affine'
+    assert classify_transform(change_transform_origin(scaling([-1, 1]), (15, 10)), shape) == 'flip'
+    assert classify_transform(change_transform_origin(scaling([-1, -1]), (15, 10)), shape) == 'flip'
+    assert classify_transform(scaling([-1, 1]), shape) == 'affine'
+    assert classify_transform(scaling([2, 1]), shape) == 'affine'
+    assert classify_transform(rotation(0.1), shape) == 'affine'
+
+
+@benchmark
+@pytest.mark.parametrize('num_boxes', [10, 100, 1000])
+def test_benchmark_transform_aabbs(num_boxes):
+    prng      = np.random.RandomState(0)
+    corners   = prng.uniform(0, 500, size=(num_boxes, 2))
+    boxes     = np.concatenate([corners, corners + prng.uniform(1, 200, size=(num_boxes, 2))], axis=1)
+    transform = random_transform(prng=prng, min_rotation=-0.1, max_rotation=0.1, min_scaling=(0.9, 0.9), max_scaling=(1.1, 1.1))
+
+    measure('{} boxes, transform_aabb per box'.format(num_boxes), lambda: [transform_aabb(transform, box) for box in boxes])
+    measure('{} boxes, transform_aabbs'.format(num_boxes), lambda: transform_aabbs(transform, boxes))